@@ -0,0 +1,133 @@
+"""
+Local attachments without re-reading and re-encoding unchanged files on every run.
+
+`llm.Attachment(path=...)` hashes the whole file for its id (printed, and part of the response cache
+fingerprint) and the plugin reads and base64-encodes it again when the request is built: for PDFs and
+videos of tens of MB that is the same CPU and memory work on every run.
+
+- File hashes are kept in SQLite keyed by path and stat (size, mtime, inode): a file whose stat didn't
+  change isn't read again to be hashed.
+- The base64 form of files of `CACHED_PAYLOAD_MIN_BYTES` or more is written once to an on-disk cache,
+  `<digest>.b64` (encoded in chunks, so the file is never in memory twice), and later runs read that
+  text back instead of reading and encoding the source again. Plugins build the request body from a
+  str, so the payload is still loaded into memory once per request. Payloads are keyed by content
+  hash, so a copy of the file under another path reuses it; the least recently used ones are removed
+  beyond `ATTACHMENT_CACHE_MAX_BYTES`.
+
+This module imports llm: import it where attachments are built, not at start-up.
+"""
+import base64
+import hashlib
+import os
+import sqlite3
+import time
+from pathlib import Path
+
+import llm
+
+ATTACHMENT_CACHE_DIR_NAME = ".attachment_cache"
+CACHED_PAYLOAD_MIN_BYTES = 256 * 1024
+ATTACHMENT_CACHE_MAX_BYTES = 2 * 1024 ** 3
+_ENCODE_CHUNK_BYTES = 3 * 1024 * 1024 # A multiple of 3: the encoded chunks concatenate into one valid base64 string
+
+
+def _stat_key(stat) -> tuple:
+    return (stat.st_size, stat.st_mtime_ns, stat.st_ino)
+
+
+class CachedFileAttachment(llm.Attachment):
+    """An llm.Attachment of a local file whose hash and base64 form come from an AttachmentCache."""
+
+    def __init__(self, path: str, digest: str, stat_key: tuple, payload_dir: Path, type: str = None):
+        super().__init__(type=type, path=path)
+        self._id = digest # llm's id of a path attachment is the sha256 of the file too
+        self._stat_key = stat_key
+        self._payload_dir = payload_dir
+
+    def base64_content(self):
+        stat = os.stat(self.path)
+        if stat.st_size < CACHED_PAYLOAD_MIN_BYTES or _stat_key(stat) != self._stat_key: # Too small, or changed since hashed
+            return super().base64_content()
+        payload_path = self._payload_dir / f"{self._id}.b64"
+        try:
+            return _read_payload(payload_path)
+        except FileNotFoundError:
+            pass
+        try:
+            _write_payload(self.path, payload_path)
+            _evict_payloads(self._payload_dir, keep=payload_path)
+            return _read_payload(payload_path)
+        except OSError as err:
+            print("▶️"*16, f"Didn't manage to cache the encoded {self.path}. Got error: {err}")
+            return super().base64_content()
+
+
+def _read_payload(payload_path: Path) -> str:
+    with open(payload_path, "rb") as f:
+        os.utime(f.fileno()) # Marks it as recently used for eviction
+        return f.read().decode("ascii")
+
+
+def _write_payload(source_path: str, payload_path: Path):
+    payload_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = payload_path.with_name(f"{payload_path.name}.{os.getpid()}.tmp")
+    try:
+        with open(source_path, "rb") as source, open(tmp_path, "wb") as payload:
+            while True:
+                chunk = source.read(_ENCODE_CHUNK_BYTES)
+                if not chunk:
+                    break
+                payload.write(base64.b64encode(chunk))
+        tmp_path.replace(payload_path)
+    finally:
+        tmp_path.unlink(missing_ok=True)
+
+
+def _evict_payloads(payload_dir: Path, keep: Path, max_bytes: int = ATTACHMENT_CACHE_MAX_BYTES):
+    payloads = []
+    for entry in os.scandir(payload_dir):
+        if entry.name.endswith(".b64"):
+            stat = entry.stat()
+            payloads.append((stat.st_mtime, stat.st_size, Path(entry.path)))
+    total = sum(size for _, size, _ in payloads)
+    for _, size, path in sorted(payloads):
+        if total <= max_bytes:
+            break
+        if path != keep:
+            path.unlink(missing_ok=True)
+            total -= size
+
+
+class AttachmentCache:
+    def __init__(self, cache_dir):
+        self.cache_dir = Path(cache_dir).expanduser()
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(str(self.cache_dir / "file_hashes.sqlite"), timeout=30)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS file_hashes (path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, "
+            "inode INTEGER, sha256 TEXT, checked_at REAL)"
+        )
+
+    def close(self):
+        self._db.commit()
+        self._db.close()
+
+    def file_digest(self, path: str):
+        """(sha256, stat key) of the file at `path`; it is read again only when its stat changed."""
+        path = os.path.abspath(path)
+        stat_key = _stat_key(os.stat(path))
+        row = self._db.execute("SELECT size, mtime_ns, inode, sha256 FROM file_hashes WHERE path = ?", (path,)).fetchone()
+        if row is not None and tuple(row[:3]) == stat_key:
+            return row[3], stat_key
+        with open(path, "rb") as f:
+            digest = hashlib.file_digest(f, "sha256").hexdigest()
+        self._db.execute(
+            "INSERT OR REPLACE INTO file_hashes (path, size, mtime_ns, inode, sha256, checked_at) VALUES (?, ?, ?, ?, ?, ?)",
+            (path, *stat_key, digest, time.time()),
+        )
+        self._db.commit()
+        return digest, stat_key
+
+    def attachment(self, path: str, type: str = None) -> CachedFileAttachment:
+        digest, stat_key = self.file_digest(path)
+        return CachedFileAttachment(path, digest, stat_key, self.cache_dir, type=type)
@@ -0,0 +1,254 @@
+"""
+Conversion of local attachments whose type the model family doesn't accept (SUPPORTED_ATTACHMENT_TYPES).
+
+Instead of being skipped, they are turned into text that goes into the prompt next to the website texts:
+
+- HTML: its text, extracted like a website's (html_text.py), rather than the markup;
+- other text/* files on providers without text/plain (CSV, source code, ... on claude and openai):
+  the text itself;
+- DOCX and PPTX: the text of the paragraphs / slides, read from the Office Open XML inside the zip;
+- PDF, for families without PDF support: the text layer, with pypdf when installed or poppler's
+  `pdftotext`. Without either, PDFs are skipped as before.
+
+Conversions run on a process pool, submitted before any URL is fetched: a 300-page PDF converts while
+the rest of attachments.md resolves instead of holding up the run. Outputs are cached in
+`<sha256 of the source>.<converter>.txt`, so an unchanged file (or a copy under another path) isn't
+converted again; the least recently used ones are removed beyond `CONVERSION_CACHE_MAX_BYTES`.
+"""
+import concurrent.futures
+import hashlib
+import os
+import re
+import shutil
+import subprocess
+import zipfile
+from pathlib import Path
+from xml.etree import ElementTree
+
+CONVERSION_CACHE_DIR_NAME = ".conversion_cache"
+CONVERSION_CACHE_MAX_BYTES = 256 * 1024 * 1024
+CONVERT_MAX_WORKERS = min(4, os.cpu_count() or 1)
+PDF_TO_TEXT_TIMEOUT_SECONDS = 300
+# Bumped when a converter's output changes, so older cached outputs aren't used
+CONVERTER_VERSION = 1
+
+DOCX_MIME_TYPE = "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+PPTX_MIME_TYPE = "application/vnd.openxmlformats-officedocument.presentationml.presentation"
+# Office files start with a plain zip signature, so mime_sniff types them application/zip
+_ZIP_EXTENSIONS = {".docx": "docx", ".pptx": "pptx"}
+
+_WORD_NS = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+_DRAWING_NS = "{http://schemas.openxmlformats.org/drawingml/2006/main}"
+_SLIDE_NAME_RE = re.compile(r"^ppt/slides/slide(\d+)\.xml$")
+
+
+class ConversionError(Exception):
+    pass
+
+
+def _pdf_backend():
+    try:
+        import pypdf # noqa: F401
+        return "pypdf"
+    except ImportError:
+        return "pdftotext" if shutil.which("pdftotext") else None
+
+
+def converter_for(path: str, mime_type: str, allowed_mimetypes) -> str:
+    """Name of the converter that makes `path` usable by a family accepting `allowed_mimetypes`, or None."""
+    if mime_type is None or mime_type in allowed_mimetypes:
+        return None
+    if mime_type == "text/html":
+        return "html" # Even where text/plain is accepted: the markup would cost more tokens than the text
+    if mime_type.startswith("text/"):
+        return None if "text/plain" in allowed_mimetypes else "text"
+    if mime_type == "application/pdf":
+        return "pdf"
+    if mime_type == DOCX_MIME_TYPE:
+        return "docx"
+    if mime_type == PPTX_MIME_TYPE:
+        return "pptx"
+    if mime_type == "application/zip":
+        return _ZIP_EXTENSIONS.get(os.path.splitext(path)[1].lower())
+    return None
+
+
+def _read_text(path: str) -> str:
+    with open(path, "rb") as f:
+        return f.read().decode("utf-8", errors="replace")
+
+
+def _html_to_text(path: str, main_content: bool = False) -> str:
+    from html_text import HtmlTextOptions, detect_charset, extract_text_from_chunks
+
+    size = os.path.getsize(path)
+    with open(path, "rb") as f:
+        first_chunk = f.read(64 * 1024)
+        # No caps here: the whole file is converted and cached, the caller truncates
+        options = HtmlTextOptions(max_bytes=size + 1, max_tokens=size + 1, main_content=main_content)
+        chunks = iter(lambda: f.read(64 * 1024), b"")
+        text, _, _ = extract_text_from_chunks(
+            _prepend(first_chunk, chunks), detect_charset(first_chunk), options, total_bytes=size
+        )
+    return text
+
+
+def _prepend(first, rest):
+    yield first
+    yield from rest
+
+
+def _docx_to_text(path: str) -> str:
+    with zipfile.ZipFile(path) as archive:
+        try:
+            root = ElementTree.fromstring(archive.read("word/document.xml"))
+        except KeyError:
+            raise ConversionError("no word/document.xml, not a DOCX file")
+    paragraphs = []
+    for paragraph in root.iter(f"{_WORD_NS}p"):
+        parts = []
+        for node in paragraph.iter():
+            if node.tag == f"{_WORD_NS}t":
+                parts.append(node.text or "")
+            elif node.tag == f"{_WORD_NS}tab":
+                parts.append("\t")
+            elif node.tag in (f"{_WORD_NS}br", f"{_WORD_NS}cr"):
+                parts.append("\n")
+        paragraphs.append("".join(parts))
+    return "\n".join(paragraphs).strip()
+
+
+def _pptx_to_text(path: str) -> str:
+    with zipfile.ZipFile(path) as archive:
+        slides = sorted(
+            (int(match.group(1)), name) for name in archive.namelist() if (match := _SLIDE_NAME_RE.match(name))
+        )
+        if not slides:
+            raise ConversionError("no slides found, not a PPTX file")
+        pages = []
+        for number, name in slides:
+            root = ElementTree.fromstring(archive.read(name))
+            lines = ["".join(node.text or "" for node in paragraph.iter(f"{_DRAWING_NS}t"))
+                     for paragraph in root.iter(f"{_DRAWING_NS}p")]
+            pages.append(f"--- slide {number} ---\n" + "\n".join(line for line in lines if line.strip()))
+    return "\n\n".join(pages)
+
+
+def _pdf_to_text(path: str) -> str:
+    backend = _pdf_backend()
+    if backend == "pypdf":
+        import pypdf
+
+        reader = pypdf.PdfReader(path)
+        pages = [page.extract_text() or "" for page in reader.pages]
+    elif backend == "pdftotext":
+        try:
+            result = subprocess.run(
+                ["pdftotext", "-layout", "-enc", "UTF-8", path, "-"],
+                capture_output=True, timeout=PDF_TO_TEXT_TIMEOUT_SECONDS,
+            )
+        except subprocess.TimeoutExpired:
+            raise ConversionError(f"pdftotext took more than {PDF_TO_TEXT_TIMEOUT_SECONDS}s")
+        if result.returncode != 0:
+            raise ConversionError(f"pdftotext failed: {result.stderr.decode('utf-8', errors='replace').strip()}")
+        pages = result.stdout.decode("utf-8", errors="replace").split("\f")
+        if pages and not pages[-1].strip():
+            pages.pop() # pdftotext ends every page with a form feed
+    else:
+        raise ConversionError("no PDF text extractor available (install pypdf or poppler's pdftotext)")
+    return "\n\n".join(f"--- page {number} ---\n{text.strip()}" for number, text in enumerate(pages, 1))
+
+
+def _convert(converter: str, path: str, main_content: bool = False) -> str:
+    """Runs in a worker process."""
+    if converter == "html":
+        return _html_to_text(path, main_content)
+    if converter == "text":
+        return _read_text(path)
+    if converter == "docx":
+        return _docx_to_text(path)
+    if converter == "pptx":
+        return _pptx_to_text(path)
+    if converter == "pdf":
+        return _pdf_to_text(path)
+    raise ConversionError(f"unknown converter {converter!r}")
+
+
+def _evict_outputs(cache_dir: Path, keep: Path, max_bytes: int = CONVERSION_CACHE_MAX_BYTES):
+    outputs = []
+    for entry in os.scandir(cache_dir):
+        if entry.name.endswith(".txt"):
+            stat = entry.stat()
+            outputs.append((stat.st_mtime, stat.st_size, Path(entry.path)))
+    total = sum(size for _, size, _ in outputs)
+    for _, size, path in sorted(outputs):
+        if total <= max_bytes:
+            break
+        if path != keep:
+            path.unlink(missing_ok=True)
+            total -= size
+
+
+class ConversionPool:
+    """
+    Converts files on a process pool, started on the first conversion that isn't cached. `file_digest`
+    maps a path to its sha256 (AttachmentCache's, which skips unchanged files); the default reads the file.
+    """
+
+    def __init__(self, cache_dir, file_digest=None, max_workers: int = CONVERT_MAX_WORKERS):
+        self.cache_dir = Path(cache_dir).expanduser()
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self._file_digest = file_digest
+        self._max_workers = max_workers
+        self._executor = None
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+
+    def _digest(self, path: str) -> str:
+        if self._file_digest is not None:
+            return self._file_digest(path)
+        with open(path, "rb") as f:
+            return hashlib.file_digest(f, "sha256").hexdigest()
+
+    def submit(self, path: str, converter: str, main_content: bool = False) -> concurrent.futures.Future:
+        """Future of (text, from_cache). Errors (ConversionError, OSError, a broken file) are raised by its result()."""
+        future = concurrent.futures.Future()
+        try:
+            if converter == "pdf" and _pdf_backend() is None:
+                raise ConversionError("no PDF text extractor available (install pypdf or poppler's pdftotext)")
+            name = f"{converter}-main" if converter == "html" and main_content else converter
+            output_path = self.cache_dir / f"{self._digest(path)}.{name}.v{CONVERTER_VERSION}.txt"
+            try:
+                with open(output_path, "rb") as f:
+                    os.utime(f.fileno()) # Marks it as recently used for eviction
+                    future.set_result((f.read().decode("utf-8"), True))
+                return future
+            except FileNotFoundError:
+                pass
+            if self._executor is None:
+                self._executor = concurrent.futures.ProcessPoolExecutor(max_workers=self._max_workers)
+            converting = self._executor.submit(_convert, converter, path, main_content)
+        except Exception as err:
+            future.set_exception(err)
+            return future
+
+        def done(converting):
+            try:
+                text = converting.result()
+            except BaseException as err:
+                future.set_exception(err)
+                return
+            try:
+                tmp_path = output_path.with_name(f"{output_path.name}.{os.getpid()}.tmp")
+                tmp_path.write_bytes(text.encode("utf-8"))
+                tmp_path.replace(output_path)
+                _evict_outputs(self.cache_dir, keep=output_path)
+            except OSError as err:
+                print("▶️"*16, f"Didn't manage to cache the converted {path}. Got error: {err}")
+            future.set_result((text, False))
+
+        converting.add_done_callback(done)
+        return future
@@ -0,0 +1,188 @@
+"""
+Batch mode: runs a JSONL file of prompts through LLMRunner's ASYNC_MODEL_* paths with bounded concurrency.
+
+Each input line is a record like
+    {"id": "q1", "provider": "openai", "model": "openai/gpt-4.1", "prompt": "...", "system": "...", "schema": {...}}
+Any other key (temperature, max_output_tokens, thinking, ...) is passed through as a model option, and
+"attachments" may list file paths or URLs.
+
+Results are appended to the output JSONL as soon as each row finishes, so the output file is also the
+checkpoint: rerunning the same batch skips every row that already has an "ok" result and only sends the
+rest (failed or never reached), without paying for completed rows again. When the daily budget of the
+"batch" mode runs out, no further rows are started and the run ends with BudgetExceeded; the rows
+that weren't sent are picked up by the next run.
+
+On ASYNC_MODEL_STREAM each row streams to `<base_folder>/batch/output.row-<id>.md`, checkpointed like a
+single run (checkpoint.py): a row cut off by Ctrl-C or an error keeps its partial answer in the logs
+and the usage ledger. The file is removed once the row's result is in the output JSONL.
+"""
+import hashlib
+import json
+import os
+import time
+from datetime import datetime
+
+from fanout import model_slug
+from usage_ledger import BudgetExceeded
+
+DEFAULT_BATCH_CONCURRENCY = 4
+# Batch rows are recorded in the usage ledger (and checked against budgets) under this mode
+BATCH_USAGE_MODE = "batch"
+
+# Keys of a record that describe the row rather than being passed to the model.
+_RECORD_META_KEYS = {"id", "provider", "model", "prompt", "attachments"}
+
+
+def record_id(record: dict) -> str:
+    """The record's own "id", or a hash of its content so reordering the input doesn't break resuming."""
+    if record.get("id") is not None:
+        return str(record["id"])
+    canonical = json.dumps(record, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()[:16]
+
+
+def load_completed_ids(output_path: str) -> set:
+    completed = set()
+    if not os.path.exists(output_path):
+        return completed
+    with open(output_path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                row = json.loads(line)
+            except json.JSONDecodeError:
+                continue # A line cut short by an interrupted run
+            if row.get("status") == "ok":
+                completed.add(row.get("id"))
+    return completed
+
+
+def _usage_to_dict(llm_response_obj) -> dict:
+    return {
+        "input": getattr(llm_response_obj, "input_tokens", None),
+        "output": getattr(llm_response_obj, "output_tokens", None),
+        "details": getattr(llm_response_obj, "token_details", None),
+    }
+
+
+async def _run_record(runner, record: dict, default_provider: str, default_model: str, execution_type, attachment_cache=None):
+    import llm
+
+    model_name = record.get("model") or default_model
+    if not model_name:
+        raise ValueError("record has no 'model' and no --model_name default was given")
+    provider = record.get("provider") or default_provider # None: the runner infers it from the model name
+    kwargs = {k: v for k, v in record.items() if k not in _RECORD_META_KEYS and v is not None}
+    attachments = []
+    for item in record.get("attachments") or []:
+        if item.startswith("http://") or item.startswith("https://"):
+            attachments.append(llm.Attachment(url=item))
+        elif attachment_cache is not None: # Rows often share files: hashed and encoded once (attachment_cache.py)
+            attachments.append(attachment_cache.attachment(os.path.expanduser(item)))
+        else:
+            attachments.append(llm.Attachment(path=os.path.expanduser(item)))
+    if attachments:
+        kwargs["attachments"] = attachments
+    runner.check_budget(BATCH_USAGE_MODE, [model_name], record["prompt"])
+    variant = f"row-{model_slug(record_id(record))}"
+    output_file = runner.base_folder / BATCH_USAGE_MODE / f"output.{variant}.md"
+    started = time.monotonic()
+    text, response_obj = await runner._execute_async(
+        model_name, provider, execution_type, record["prompt"], on_chunk=lambda chunk: None,
+        mode=BATCH_USAGE_MODE, output_file=output_file, variant=variant, **kwargs
+    )
+    runner._record_usage(BATCH_USAGE_MODE, model_name, response_obj, latency=time.monotonic() - started)
+    output_file.unlink(missing_ok=True) # The answer goes to the output JSONL
+    response_id = getattr(response_obj, "id", None)
+    return {"provider": provider, "model": model_name, "response": text,
+            "response_id": response_id, "usage": _usage_to_dict(response_obj)}
+
+
+async def _run_batch_async(runner, records, output_path, concurrency, default_provider, default_model, execution_type,
+                           attachment_cache=None):
+    import asyncio
+
+    queue = asyncio.Queue()
+    for record in records:
+        queue.put_nowait(record)
+    total = len(records)
+    done_count = 0
+    budget_error = None
+
+    with open(output_path, "a", encoding="utf-8") as output:
+        async def worker():
+            nonlocal done_count, budget_error
+            while budget_error is None:
+                try:
+                    record = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                row_id = record_id(record)
+                started = time.monotonic()
+                row = {"id": row_id}
+                try:
+                    row.update(await _run_record(runner, record, default_provider, default_model, execution_type, attachment_cache))
+                    row["status"] = "ok"
+                except BudgetExceeded as e:
+                    # Not the row's fault: it stays pending (no output line) and no further rows are started
+                    budget_error = budget_error or e
+                    return
+                except Exception as e:
+                    row.update({"status": "error", "error": f"{type(e).__name__}: {e}"})
+                row["elapsed_seconds"] = round(time.monotonic() - started, 3)
+                row["finished_at"] = datetime.now().isoformat(timespec="seconds")
+                # Single event loop thread, so whole lines never interleave.
+                output.write(json.dumps(row, ensure_ascii=False, default=str) + "\n")
+                output.flush()
+                done_count += 1
+                print(f"[{done_count}/{total}] {row['status']}: {row_id} ({row['elapsed_seconds']}s)", flush=True)
+
+        await asyncio.gather(*(worker() for _ in range(max(1, min(concurrency, total)))))
+    if budget_error is not None:
+        print(f"Batch stopped: {total - done_count} row(s) not sent, rerun the batch once the budget allows it.", flush=True)
+        raise budget_error
+
+
+def run_batch(runner, input_path: str, execution_type, output_path: str = None, concurrency: int = DEFAULT_BATCH_CONCURRENCY,
+              default_provider: str = None, default_model: str = None):
+    """
+    Runs every not-yet-completed record of `input_path` on `execution_type` (an ASYNC_MODEL_*
+    LLMExecutionType). Returns the output path. Raises BudgetExceeded when the "batch" mode's daily
+    budget stops the run.
+    """
+    import asyncio
+
+    input_path = os.path.expanduser(input_path)
+    if output_path is None:
+        root, _ = os.path.splitext(input_path)
+        output_path = f"{root}.out.jsonl"
+    output_path = os.path.expanduser(output_path)
+    if not execution_type.name.startswith("ASYNC_"):
+        raise ValueError(f"Batch mode needs an ASYNC_MODEL_* execution type, got {execution_type.name}")
+
+    records = []
+    with open(input_path, encoding="utf-8") as f:
+        for line_number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError as e:
+                raise ValueError(f"Invalid JSON in batch file '{input_path}' on line {line_number}: {e}")
+            if "prompt" not in record:
+                raise ValueError(f"Record on line {line_number} of '{input_path}' has no 'prompt'.")
+            records.append(record)
+
+    completed = load_completed_ids(output_path)
+    pending = [record for record in records if record_id(record) not in completed]
+    print(f"Batch {input_path}: {len(records)} record(s), {len(records) - len(pending)} already done, "
+          f"{len(pending)} to run with concurrency {concurrency} -> {output_path}")
+    if pending:
+        from attachment_cache import ATTACHMENT_CACHE_DIR_NAME, AttachmentCache
+
+        attachment_cache = AttachmentCache(runner.base_folder / ATTACHMENT_CACHE_DIR_NAME)
+        try:
+            asyncio.run(_run_batch_async(runner, pending, output_path, concurrency, default_provider, default_model, execution_type,
+                                         attachment_cache))
+        finally:
+            attachment_cache.close()
+    return output_path
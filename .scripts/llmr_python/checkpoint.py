@@ -0,0 +1,189 @@
+"""
+Checkpoints of in-flight runs, so an interrupted answer (Ctrl-C, closed terminal, crash) isn't lost.
+
+Every streamed provider call (single runs, fan-out models and batch rows) gets
+`<mode_folder>/partial/<run_id>/` holding the prompt, the options needed to send it again (meta.json)
+and the answer so far (answer.md, appended at every stream flush). The directory is only written once
+there is something to lose, at the first flushed block or when the run stops early, and removed when
+the run completes: `--resume_log` lists what is left and `--resume <run_id>` continues it, sending the
+partial answer as prefill where the provider allows it. Non-stream calls have no partial answer to
+keep and get no checkpoint.
+"""
+import json
+import os
+import shutil
+import time
+from datetime import datetime
+from pathlib import Path
+
+CHECKPOINT_DIR_NAME = "partial"
+
+# prompt() arguments that are stored elsewhere or must not be written to disk
+# fragments/cache only split the prompt for Anthropic's prompt cache (prompt_cache.py): prompt.md holds the whole text
+_NOT_STORED_OPTIONS = {"prompt", "key", "attachments", "conversation", "fragments", "cache"}
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class RunCheckpoint:
+    def __init__(self, run_dir: Path, meta: dict, prompt_args: dict = None):
+        self.run_dir = run_dir
+        self.meta = meta
+        self._unwritten_prompt_args = prompt_args # Set until the checkpoint is first written (see _write)
+
+    @property
+    def run_id(self) -> str:
+        return self.run_dir.name
+
+    @property
+    def answer_path(self) -> Path:
+        return self.run_dir / "answer.md"
+
+    @classmethod
+    def create(cls, mode_folder, mode: str, model_name: str, model_type: str, execution_type_name: str, prompt_args: dict,
+               variant: str = None):
+        """A checkpoint for a run about to start; nothing is written to disk until the first append() or mark()."""
+        run_id = f"{datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}_{os.getpid()}"
+        if variant:
+            run_id += f"_{variant}" # Fan-out models and batch rows start within the same second
+        meta = {
+            "mode": mode,
+            "model_name": model_name,
+            "model_type": model_type,
+            "execution_type": execution_type_name,
+            "options": {k: v for k, v in prompt_args.items() if k not in _NOT_STORED_OPTIONS},
+            "attachments": [],
+            "status": "running",
+            "pid": os.getpid(),
+            "started_at": time.time(),
+        }
+        return cls(Path(mode_folder) / CHECKPOINT_DIR_NAME / run_id, meta, prompt_args)
+
+    def _write(self):
+        """Writes the prompt, attachments and meta.json the first time there is something to keep."""
+        prompt_args = self._unwritten_prompt_args
+        if prompt_args is None:
+            return
+        self._unwritten_prompt_args = None
+        self.run_dir.mkdir(parents=True, exist_ok=True)
+        prompt_text = "\n".join(list(prompt_args.get("fragments") or []) + [prompt_args["prompt"]])
+        (self.run_dir / "prompt.md").write_text(prompt_text, encoding="utf-8")
+        attachments = self.meta["attachments"]
+        for index, attachment in enumerate(prompt_args.get("attachments") or []):
+            if attachment.path:
+                attachments.append({"path": attachment.path, "type": attachment.type})
+            elif attachment.url and attachment.content is None:
+                attachments.append({"url": attachment.url, "type": attachment.type})
+            else: # Content held in memory (e.g. a cached URL body): keep a copy
+                file_name = f"attachment-{index}"
+                (self.run_dir / file_name).write_bytes(attachment.content)
+                attachments.append({"content_file": file_name, "type": attachment.type, "url": attachment.url})
+        self.answer_path.touch()
+        self._write_meta()
+
+    @classmethod
+    def load(cls, run_dir):
+        run_dir = Path(run_dir)
+        meta = json.loads((run_dir / "meta.json").read_text(encoding="utf-8"))
+        return cls(run_dir, meta)
+
+    def _write_meta(self):
+        tmp_path = self.run_dir / "meta.json.tmp"
+        tmp_path.write_text(json.dumps(self.meta, indent=2, default=str), encoding="utf-8")
+        tmp_path.replace(self.run_dir / "meta.json")
+
+    def append(self, data: bytes):
+        """StreamSink flush hook: the answer so far is on disk after every flush."""
+        self._write()
+        with open(self.answer_path, "ab") as f:
+            f.write(data)
+
+    def answer_text(self) -> str:
+        try:
+            return self.answer_path.read_text(encoding="utf-8", errors="replace")
+        except FileNotFoundError:
+            return ""
+
+    def prompt_text(self) -> str:
+        return (self.run_dir / "prompt.md").read_text(encoding="utf-8")
+
+    def mark(self, status: str, error: str = None):
+        self.meta["status"] = status
+        if error:
+            self.meta["error"] = error
+        if self._unwritten_prompt_args is not None:
+            self._write() # Stopped before the first token: still kept, so --resume can send it again
+        else:
+            self._write_meta()
+
+    def state(self) -> str:
+        """"running" only while the process that wrote it is alive; a killed run reads as "interrupted"."""
+        status = self.meta.get("status")
+        if status == "running" and not _pid_alive(self.meta.get("pid", -1)):
+            return "interrupted"
+        return status
+
+    def finish(self):
+        shutil.rmtree(self.run_dir, ignore_errors=True)
+
+    def build_attachments(self):
+        import llm
+
+        attachments = []
+        for item in self.meta.get("attachments") or []:
+            if "content_file" in item:
+                attachments.append(llm.Attachment(type=item.get("type"), content=(self.run_dir / item["content_file"]).read_bytes()))
+            elif "path" in item:
+                attachments.append(llm.Attachment(type=item.get("type"), path=item["path"]))
+            else:
+                attachments.append(llm.Attachment(type=item.get("type"), url=item["url"]))
+        return attachments
+
+
+def list_checkpoints(base_folder, mode: str = None):
+    """Checkpoints of `mode` (or of every mode), oldest first."""
+    base_folder = Path(base_folder)
+    if not base_folder.is_dir():
+        return []
+    mode_folders = [base_folder / mode] if mode else sorted(p for p in base_folder.iterdir() if p.is_dir())
+    checkpoints = []
+    for mode_folder in mode_folders:
+        partial_folder = mode_folder / CHECKPOINT_DIR_NAME
+        if not partial_folder.is_dir():
+            continue
+        for run_dir in sorted(partial_folder.iterdir()):
+            try:
+                checkpoints.append(RunCheckpoint.load(run_dir))
+            except (OSError, ValueError):
+                continue # Half-written checkpoint
+    return checkpoints
+
+
+def find_checkpoint(base_folder, run_id: str, mode: str = None):
+    for checkpoint in list_checkpoints(base_folder, mode):
+        if checkpoint.run_id == run_id:
+            return checkpoint
+    return None
+
+
+def format_checkpoint_list(checkpoints) -> str:
+    if not checkpoints:
+        return "No partial runs."
+    lines = []
+    for checkpoint in checkpoints:
+        answer = checkpoint.answer_text()
+        tail = answer[-60:].replace("\n", " ")
+        lines.append(
+            f"{checkpoint.run_id}  {checkpoint.meta.get('mode')}  {checkpoint.meta.get('model_name')}  "
+            f"{checkpoint.meta.get('execution_type')}  {checkpoint.state()}  {len(answer):,} chars"
+            + (f"  | ...{tail}" if tail else "")
+        )
+    return "\n".join(lines)
@@ -0,0 +1,279 @@
+"""
+Content-hash deduplication of what goes into the prompt.
+
+The same file easily ends up in a prompt twice: in <context> and as a path in attachments.md, appended
+to task.md by ranger's prompt_with_files (files-to-prompt output) while its folder is also in context,
+or the same URL listed twice. Before the token plan is made, every unit (context file, file block in
+the task, website text, attachment) is hashed (sha256 over the content with line endings normalized):
+
+- an exact duplicate of the same path/URL is dropped;
+- an exact duplicate under another path is collapsed into a one-line reference to the first copy
+  (attachments and website texts can't hold a reference and are dropped);
+- a near-identical file (SimHash a few bits away, see similar_cache.py) is collapsed into a reference
+  plus a unified diff against the first copy, when that diff is much smaller than the file.
+
+The first copy in prompt order is kept: <context> comes first, which keeps the cached prefix intact
+(see prompt_cache.py). Dedup runs before the token plan, so the plan counts the smaller prompt; when
+trimming then drops a first copy (a context file, website text or attachment) that a collapsed or
+dropped duplicate stood for, `restore_references` puts the duplicate back in full, so no content is
+lost and the prompt never refers to text that isn't in it.
+"""
+import difflib
+import hashlib
+import mimetypes
+import os
+import re
+
+from prompt_builder import PromptSection
+from similar_cache import prompt_simhash
+from token_budget import estimate_attachment_tokens
+
+# Smaller units aren't worth it: the reference costs about as much as the content
+DEDUP_MIN_BYTES = 256
+# SimHash bits two files may differ by to be compared as near-identical (~95% similar)
+NEAR_DUPLICATE_MAX_DISTANCE = 3
+# The diff has to be at most this share of the file for the reference to pay off
+NEAR_DUPLICATE_MAX_DIFF_RATIO = 0.5
+_NEAR_DUPLICATE_SIZE_RATIO = 0.8
+
+# files-to-prompt output pasted into task.md: the default layout and --markdown
+_TASK_FILE_BLOCK_RES = (
+    re.compile(rb"^(?P<path>[^\n`]*[/.][^\n`]*)\n---\n(?P<content>.*?)\n\n---$", re.MULTILINE | re.DOTALL),
+    re.compile(rb"^(?P<path>[^\n`]*[/.][^\n`]*)\n(?P<fence>`{3,})[^\n`]*\n(?P<content>.*?)\n(?P=fence)$", re.MULTILINE | re.DOTALL),
+)
+_CONTEXT_ENTRY_TRAILER = b"\n\n---\n"
+
+
+def _normalized(data: bytes) -> bytes:
+    return data.replace(b"\r\n", b"\n").rstrip()
+
+
+def _digest(data: bytes) -> str:
+    return hashlib.sha256(_normalized(data)).hexdigest()
+
+
+class _FileUnit:
+    __slots__ = ("kind", "label", "section", "content")
+
+    def __init__(self, kind: str, label: str, section: PromptSection, content: bytes):
+        self.kind = kind # "context_file" or "task_file"
+        self.label = label
+        self.section = section
+        self.content = content
+
+    def reference(self, note: str) -> str:
+        if self.kind == "context_file":
+            return f"{self.label}\n---\n{note}{_CONTEXT_ENTRY_TRAILER.decode()}"
+        return f"{self.label}\n{note}"
+
+
+class _Reference:
+    """A duplicate that was collapsed or dropped in favour of `first` (PromptSection, website text or attachment)."""
+    __slots__ = ("first", "duplicate", "original", "action")
+
+    def __init__(self, first, duplicate, original, action):
+        self.first = first
+        self.duplicate = duplicate # The collapsed PromptSection, or the dropped website text / attachment
+        self.original = original # Text of a collapsed section before collapsing (None for websites and attachments)
+        self.action = action
+
+
+class DedupResult:
+    def __init__(self, websites, attachments):
+        self.replacements = {} # PromptSection -> new text ("" drops it), for PromptBuffer.replace_sections
+        self._all_websites = list(websites)
+        self._all_attachments = list(attachments)
+        self._dropped = set() # id() of the websites and attachments dropped as duplicates
+        self.actions = [] # (kind, label, what happened, tokens saved)
+        self.references = [] # _Reference for every collapsed or dropped unit
+
+    @property
+    def websites(self):
+        return [website for website in self._all_websites if id(website) not in self._dropped]
+
+    @property
+    def attachments(self):
+        return [attachment for attachment in self._all_attachments if id(attachment) not in self._dropped]
+
+    @property
+    def tokens_saved(self) -> int:
+        return sum(saved for _, _, _, saved in self.actions)
+
+    def restore_references(self, prompt_buffer, dropped_refs):
+        """
+        Puts back every duplicate whose first copy is among `dropped_refs` (the refs of the items the token
+        plan trimmed): collapsed sections get their full text again, dropped websites and attachments
+        come back in `websites` / `attachments`. Returns the labels of the restored units; the caller
+        plans the budget again.
+        """
+        dropped = {id(ref) for ref in dropped_refs}
+        sections = {}
+        labels = []
+        for reference in list(self.references):
+            if id(reference.first) not in dropped:
+                continue
+            self.references.remove(reference)
+            self.actions.remove(reference.action)
+            labels.append(reference.action[1])
+            if reference.original is not None:
+                sections[reference.duplicate] = reference.original
+            else:
+                self._dropped.discard(id(reference.duplicate))
+        if sections:
+            prompt_buffer.replace_sections(sections)
+            for span in sections:
+                if span.kind == "context_file" and span not in prompt_buffer.sections: # Was dropped as "listed twice"
+                    prompt_buffer.sections.append(span)
+            prompt_buffer.sections.sort(key=lambda section: section.start)
+        return labels
+
+    def report(self) -> str:
+        lines = [f"dedup: {len(self.actions)} duplicate unit(s) removed or collapsed, ~{self.tokens_saved:,} tokens saved"]
+        lines += [f"  - {kind}: {label} {note} (-{saved:,})" for kind, label, note, saved in self.actions]
+        return "\n".join(lines)
+
+
+def _same_path(first: str, label: str) -> bool:
+    return os.path.normpath(os.path.expanduser(first)) == os.path.normpath(os.path.expanduser(label))
+
+
+def _file_units(prompt_buffer):
+    units = []
+    for section in prompt_buffer.sections:
+        data = prompt_buffer.section_bytes(section)
+        if section.kind == "context_file":
+            header = f"{section.label}\n---\n".encode("utf-8")
+            if data.startswith(header) and data.endswith(_CONTEXT_ENTRY_TRAILER):
+                units.append(_FileUnit("context_file", section.label, section, data[len(header):-len(_CONTEXT_ENTRY_TRAILER)]))
+        elif section.kind == "task":
+            blocks = []
+            for pattern in _TASK_FILE_BLOCK_RES:
+                for match in pattern.finditer(data):
+                    if any(match.start() < end and start < match.end() for start, end in blocks):
+                        continue
+                    blocks.append((match.start(), match.end()))
+                    path = match.group("path").decode("utf-8", errors="replace").strip()
+                    span = PromptSection("task_file", path, section.start + match.start(), section.start + match.end())
+                    units.append(_FileUnit("task_file", path, span, match.group("content")))
+    units.sort(key=lambda unit: unit.section.start)
+    return units
+
+
+def _near_duplicate_diff(earlier: _FileUnit, later: _FileUnit, signatures: dict):
+    """Unified diff of `later` against `earlier` when the two are near-identical, else None."""
+    sizes = sorted((len(earlier.content), len(later.content)))
+    if sizes[0] < sizes[1] * _NEAR_DUPLICATE_SIZE_RATIO:
+        return None
+    for unit in (earlier, later):
+        if unit not in signatures:
+            signatures[unit] = prompt_simhash(unit.content.decode("utf-8", errors="replace"))
+    if bin(signatures[earlier] ^ signatures[later]).count("1") > NEAR_DUPLICATE_MAX_DISTANCE:
+        return None
+    diff = "".join(difflib.unified_diff(
+        earlier.content.decode("utf-8", errors="replace").splitlines(keepends=True),
+        later.content.decode("utf-8", errors="replace").splitlines(keepends=True),
+        fromfile=earlier.label, tofile=later.label, n=1,
+    ))
+    if len(diff.encode("utf-8")) > len(later.content) * NEAR_DUPLICATE_MAX_DIFF_RATIO:
+        return None
+    return diff.rstrip("\n")
+
+
+def _attachment_digest(attachment) -> str:
+    """Digest of an attachment's content (text normalized like files); URL attachments the plugin fetches are keyed by URL."""
+    mime_type = (attachment.type or (mimetypes.guess_type(attachment.path)[0] if attachment.path else "") or "").lower()
+    is_text = mime_type.startswith("text/")
+    if attachment.content is not None:
+        data = attachment.content
+    elif attachment.path:
+        if not is_text:
+            return attachment.id() # sha256 of the file; AttachmentCache attachments have it already
+        with open(attachment.path, "rb") as f:
+            data = f.read()
+    else:
+        return f"url:{attachment.url}"
+    return _digest(data) if is_text else hashlib.sha256(data).hexdigest()
+
+
+def _website_parts(website_text: str):
+    """(url, content) of a website text built by llm_runner._format_website_plain_text."""
+    lines = website_text.split("\n", 3)
+    url = lines[2] if len(lines) > 2 else ""
+    content = website_text.split("\n<content>\n", 1)[-1].split("\n</content>", 1)[0]
+    return url, content
+
+
+def dedup_prompt(prompt_buffer, websites, attachments, token_cache, model_family: str) -> DedupResult:
+    """Finds the duplicates; the caller applies `replacements` to the buffer and uses the kept websites/attachments."""
+    result = DedupResult(websites, attachments)
+    first_seen = {} # digest (or "url:<url>") -> label of the first copy
+    first_refs = {} # digest (or "url:<url>") -> the first copy: PromptSection, website text or attachment
+    kept_files = []
+    signatures = {}
+
+    def record(kind, label, summary, saved, first, duplicate, original=None):
+        action = (kind, label, summary, saved)
+        result.actions.append(action)
+        result.references.append(_Reference(first, duplicate, original, action))
+
+    def collapse(unit, note, summary, first):
+        new_text = unit.reference(note) if note else ""
+        result.replacements[unit.section] = new_text
+        original = prompt_buffer.section_bytes(unit.section)
+        saved = token_cache.count(original) - token_cache.count(new_text.encode("utf-8"))
+        record(unit.kind, unit.label, summary, saved, first, unit.section, original.decode("utf-8", errors="replace"))
+
+    for unit in (_file_units(prompt_buffer) if prompt_buffer is not None else []):
+        if len(unit.content) < DEDUP_MIN_BYTES:
+            continue
+        digest = _digest(unit.content)
+        first = first_seen.get(digest)
+        if first is None:
+            diff = None
+            for earlier in kept_files:
+                diff = _near_duplicate_diff(earlier, unit, signatures)
+                if diff is not None:
+                    break
+            if diff is not None:
+                diff_lines = diff.count("\n") + 1
+                collapse(unit, f"(near-identical to {earlier.label}; unified diff against it:)\n{diff}",
+                         f"(near-identical to {earlier.label}, collapsed into a {diff_lines}-line diff)", earlier.section)
+                continue
+            first_seen[digest] = unit.label
+            first_refs[digest] = unit.section
+            kept_files.append(unit)
+        elif unit.kind == "context_file" and _same_path(first, unit.label):
+            collapse(unit, None, "(listed twice, dropped)", first_refs[digest])
+        elif _same_path(first, unit.label):
+            collapse(unit, "(already included above)", "(already included above, collapsed into a reference)", first_refs[digest])
+        else:
+            collapse(unit, f"(identical to {first})", f"(identical to {first}, collapsed into a reference)", first_refs[digest])
+
+    for attachment in result._all_attachments:
+        label = attachment.path or attachment.url or f"{attachment.type} ({len(attachment.content or b'')} bytes)"
+        try:
+            digest = _attachment_digest(attachment)
+        except OSError:
+            continue
+        first = first_seen.get(digest)
+        if first is None:
+            first_seen[digest] = label
+            first_refs[digest] = attachment
+            continue
+        note = "(listed twice, dropped)" if _same_path(first, label) else f"(identical to {first}, dropped)"
+        result._dropped.add(id(attachment))
+        record("attachment", label, note, estimate_attachment_tokens(attachment, model_family), first_refs[digest], attachment)
+
+    for website_text in result._all_websites:
+        url, content = _website_parts(website_text)
+        digest = _digest(content.encode("utf-8"))
+        key = f"url:{url}" if f"url:{url}" in first_seen else digest
+        first = first_seen.get(key)
+        if first is None:
+            first_seen[f"url:{url}"] = first_seen[digest] = url
+            first_refs[f"url:{url}"] = first_refs[digest] = website_text
+            continue
+        note = "(listed twice, dropped)" if first == url else f"(same text as {first}, dropped)"
+        result._dropped.add(id(website_text))
+        record("website", url, note, token_cache.count(website_text.encode("utf-8")), first_refs[key], website_text)
+    return result
@@ -0,0 +1,40 @@
+"""
+Examples of calling LLMRunner from Python (kept out of llm_runner.py so importing it stays cheap).
+
+    python examples.py     # sends the short prompts below to openai/gpt-4.1 in the "general_tests" mode
+"""
+from textwrap import dedent
+
+from llm_runner import LLMExecutionType, LLMRunner
+
+simple_prompt = "Tell me a very short joke."
+
+system_prompt="You must be concise"
+
+prompt_for_json_request = dedent("""
+    Describe a dog with its name, age, breed, and one defining personality trait.
+""").strip()
+
+system_prompt_for_json_request = dedent("""
+    You are a helpful assistant specialized in providing information about pets.
+""").strip()
+
+
+json_schema = {
+    "properties": {
+        "name": {"title": "Name", "type": "string", "description": "The name of the dog"},
+        "age": {"title": "Age", "type": "integer", "description": "The age of the dog in years"},
+        "breed": {"title": "Breed", "type": "string", "description": "The breed of the dog"},
+        "personality": {"title": "Personality", "type": "string", "description": "A dominant personality trait of the dog"}
+    },
+    "required": ["name", "age", "breed", "personality"],
+    "title": "Dog",
+    "type": "object"
+}
+
+
+if __name__ == "__main__":
+    runner = LLMRunner(default_mode="general_tests")
+    runner.run_openai("openai/gpt-4.1", LLMExecutionType.MODEL_STREAM, simple_prompt, system=system_prompt)
+    runner.run_openai("openai/gpt-4.1", LLMExecutionType.MODEL_NON_STREAM, prompt_for_json_request,
+                      system=system_prompt_for_json_request, schema=json_schema)
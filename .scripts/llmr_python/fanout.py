@@ -0,0 +1,188 @@
+"""
+Fan-out mode: one assembled prompt sent to several models at once over ASYNC_MODEL_STREAM.
+
+Every model's stream is written to its own `<mode_folder>/output.<model>.md` as tokens arrive (through
+a StreamSink, checkpointed like a single run, so Ctrl-C keeps each model's partial answer for
+--resume), and the terminal shows one live status line per model. All streams run on one event loop,
+so the wall-clock time is that of the slowest model rather than the sum.
+"""
+import re
+import sys
+import time
+
+LIVE_VIEW_REFRESH_SECONDS = 0.1
+LIVE_VIEW_TAIL_CHARS = 48
+
+
+def model_slug(model_name: str) -> str:
+    """File-name safe version of a model ID: "openai/gpt-4.1" -> "openai_gpt-4.1"."""
+    return re.sub(r"[^A-Za-z0-9._-]+", "_", model_name)
+
+
+class _ModelStream:
+    def __init__(self, model_name: str, output_path):
+        self.model_name = model_name
+        self.output_path = output_path
+        self.chars = 0
+        self.tail = ""
+        self.state = "waiting"
+        self.started = time.monotonic()
+        self.first_token_at = None
+        self.finished_at = None
+
+    def write(self, chunk: str):
+        """Updates the status line; the text itself goes to output_path through the runner's StreamSink."""
+        if self.first_token_at is None:
+            self.first_token_at = time.monotonic()
+            self.state = "streaming"
+        self.chars += len(chunk)
+        self.tail = (self.tail + chunk)[-LIVE_VIEW_TAIL_CHARS:]
+
+    def finish(self, state: str):
+        self.state = state
+        self.finished_at = time.monotonic()
+
+    def status_line(self, name_width: int) -> str:
+        elapsed = (self.finished_at or time.monotonic()) - self.started
+        first_token = f"ttft {self.first_token_at - self.started:.1f}s" if self.first_token_at else "ttft -"
+        tail = self.tail.replace("\n", " ")
+        return (f"{self.model_name:<{name_width}}  {self.state:<9}  {self.chars:>8,} chars  "
+                f"{first_token:<10}  {elapsed:6.1f}s  | {tail}")
+
+
+class FanoutView:
+    """Redraws one status line per model in place (or prints a line per finished model when not a tty)."""
+
+    def __init__(self, streams, out=None):
+        self.streams = streams
+        self.out = out or sys.stdout
+        self.interactive = self.out.isatty()
+        self._name_width = max(len(stream.model_name) for stream in streams)
+        self._drawn = False
+        self._last_draw = 0.0
+
+    def refresh(self, force: bool = False):
+        if not self.interactive:
+            return
+        now = time.monotonic()
+        if not force and now - self._last_draw < LIVE_VIEW_REFRESH_SECONDS:
+            return
+        self._last_draw = now
+        if self._drawn:
+            self.out.write(f"\x1b[{len(self.streams)}F") # Back to the first status line
+        for stream in self.streams:
+            self.out.write("\x1b[2K" + stream.status_line(self._name_width) + "\n")
+        self.out.flush()
+        self._drawn = True
+
+    def finished(self, stream):
+        if self.interactive:
+            self.refresh(force=True)
+        else:
+            print(stream.status_line(self._name_width), file=self.out, flush=True)
+
+
+def filter_attachments_for_family(attachments, allowed_mimetypes):
+    """Keeps the attachments a model family accepts; ones with an unknown type are kept and left to the plugin."""
+    import mimetypes
+
+    kept = []
+    for attachment in attachments or []:
+        mime_type = attachment.type
+        if not mime_type and attachment.path:
+            mime_type = mimetypes.guess_type(attachment.path)[0]
+        if mime_type is None or mime_type.lower() in allowed_mimetypes:
+            kept.append(attachment)
+    return kept
+
+
+async def _run_fanout_async(runner, model_names, prompt_text, mode, mode_folder, execution_type, kwargs_for_model, token_plan=None):
+    import asyncio
+
+    streams = [_ModelStream(name, mode_folder / f"output.{model_slug(name)}.md") for name in model_names]
+    view = FanoutView(streams)
+    view.refresh(force=True)
+
+    async def run_one(stream):
+        def on_chunk(chunk):
+            stream.write(chunk)
+            view.refresh()
+        try:
+            result = await runner._execute_async(
+                stream.model_name, None, execution_type, prompt_text, on_chunk=on_chunk, mode=mode,
+                output_file=stream.output_path, variant=model_slug(stream.model_name), token_plan=token_plan,
+                **kwargs_for_model(stream.model_name)
+            )
+            stream.finish("done")
+            return result
+        except Exception as e:
+            stream.finish("failed")
+            stream.tail = f"{type(e).__name__}: {e}"[-LIVE_VIEW_TAIL_CHARS:]
+            return e
+        except BaseException: # Ctrl-C: the partial answer was kept by _execute_async
+            stream.finish("stopped")
+            raise
+        finally:
+            view.finished(stream)
+
+    results = await asyncio.gather(*(run_one(stream) for stream in streams))
+    return list(zip(streams, results))
+
+
+def run_fanout(runner, model_names, prompt_text: str, mode: str, execution_type, kwargs_for_model, token_plan=None):
+    """
+    Streams `prompt_text` to every model in `model_names` concurrently. `kwargs_for_model(name)` returns the
+    run kwargs for one model (attachments filtered for its family, provider-specific options, ...).
+    Models whose answer is in the response cache (or the similar-prompt index) aren't sent; the others'
+    answers are cached like single runs'. Logs are saved per model as output.<model>.md / last-log.<model>.md.
+    Returns {model_name: text or exception}. Raises BudgetExceeded, before anything is sent, when the
+    models to send together would go over the mode's daily budget.
+    """
+    import asyncio
+
+    mode_folder = runner.base_folder / mode
+    mode_folder.mkdir(parents=True, exist_ok=True)
+    results = {}
+    cache_entries = {}
+    to_send = []
+    for model_name in model_names:
+        cached_response, cache_entries[model_name] = runner._cache_lookup_for(mode, model_name, prompt_text, kwargs_for_model(model_name))
+        if cached_response is None:
+            to_send.append(model_name)
+            continue
+        results[model_name] = full_response_text = cached_response.text()
+        system_prompt_text = kwargs_for_model(model_name).get("system")
+        try:
+            runner._save_logs(mode, cached_response, runner._format_prompt_for_log(prompt_text, system_prompt_text),
+                              full_response_text, token_plan=token_plan, variant=model_slug(model_name))
+        except Exception as err:
+            print("▶️"*16, f"Didn't manage to save logs for {model_name}. Got error: {err}")
+    if not to_send:
+        return results
+
+    runner.check_budget(mode, to_send, prompt_text, token_plan)
+    print("▶️"*16, f"fan-out to {len(to_send)} models: {', '.join(to_send)}")
+    if token_plan is not None:
+        print(token_plan.report())
+    print("▶️"*16, "\n")
+    started = time.monotonic()
+    outcomes = asyncio.run(_run_fanout_async(runner, to_send, prompt_text, mode, mode_folder, execution_type, kwargs_for_model,
+                                             token_plan))
+    print("▶️"*16, f"fan-out finished in {time.monotonic() - started:.1f}s")
+
+    for stream, outcome in outcomes:
+        if isinstance(outcome, Exception):
+            print(f"Error: {stream.model_name} failed: {outcome}", file=sys.stderr)
+            results[stream.model_name] = outcome
+            continue
+        full_response_text, llm_response_obj = outcome
+        results[stream.model_name] = full_response_text
+        runner._cache_store(cache_entries[stream.model_name], mode, stream.model_name, full_response_text, llm_response_obj)
+        system_prompt_text = kwargs_for_model(stream.model_name).get("system")
+        try:
+            runner._save_logs(mode, llm_response_obj, runner._format_prompt_for_log(prompt_text, system_prompt_text),
+                              full_response_text, token_plan=token_plan, variant=model_slug(stream.model_name),
+                              response_file=stream.output_path, latency=stream.finished_at - stream.started)
+        except Exception as err:
+            print("▶️"*16, f"Didn't manage to save logs for {stream.model_name}. Got error: {err}")
+    return results
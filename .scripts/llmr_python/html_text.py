@@ -0,0 +1,361 @@
+"""
+Incremental HTML-to-text extraction for website attachments.
+
+The extractor is fed the response body chunk by chunk (`iter_content`) and never keeps the raw
+document around: HTMLParser only buffers an unfinished tag, and the emitted text is bounded by the
+token cap. Reading stops as soon as either cap is hit, so peak memory doesn't grow with page size.
+
+With `main_content=True` the extractor also keeps a light element tree (no text, just counters)
+and, once the page is read, keeps only the text under the best scoring container, in the spirit of
+readability: paragraphs score by length and commas, containers collect their paragraphs' scores,
+class/id names like "sidebar" or "cookie" count against a container and link-heavy blocks are
+discounted. Navigation, footers and asides are dropped while parsing.
+"""
+import codecs
+import re
+from html.parser import HTMLParser
+
+WEBSITE_MAX_BYTES = 5 * 1024 * 1024
+WEBSITE_MAX_TOKENS = 60_000
+# Main-content text shorter than this (when the full text is longer) means the scoring went wrong: the full text is kept
+MAIN_CONTENT_MIN_CHARS = 200
+CHARS_PER_TOKEN = 4 # Rough estimate, good enough for caps and reporting
+
+# Content of these never reaches the output.
+_SKIP_TAGS = {"script", "style", "noscript", "template", "svg", "canvas", "iframe", "object", "head"}
+# These start a new line in the output.
+_BLOCK_TAGS = {
+    "address", "article", "aside", "blockquote", "br", "dd", "div", "dl", "dt", "fieldset",
+    "figcaption", "figure", "footer", "form", "h1", "h2", "h3", "h4", "h5", "h6", "header",
+    "hr", "li", "main", "nav", "ol", "p", "pre", "section", "table", "td", "th", "tr", "ul",
+}
+_VOID_TAGS = {"area", "base", "br", "col", "embed", "hr", "img", "input", "link", "meta", "source", "track", "wbr"}
+
+# Main-content mode: elements dropped outright, elements that can hold the article, and the
+# paragraph-like elements whose text is scored.
+# Not "form": ASP.NET and many CMS pages wrap the whole body in one; its controls are covered by button/select
+_BOILERPLATE_TAGS = {"nav", "footer", "aside", "button", "select", "dialog", "menu"}
+_CONTAINER_TAGS = {"body", "main", "article", "section", "div", "td", "blockquote"}
+_PARAGRAPH_TAGS = {"p", "pre", "td", "blockquote", "li", "dd", "h1", "h2", "h3", "h4", "h5", "h6"}
+_NEGATIVE_NAME_RE = re.compile(
+    r"ad-|ads|advert|banner|breadcrumb|combx|comment|community|cookie|consent|disqus|extra|foot|"
+    r"gdpr|header|legends|masthead|media|menu|modal|nav|newsletter|pager|pagination|popup|promo|"
+    r"related|remark|rss|share|shoutbox|sidebar|skyscraper|social|sponsor|subscribe|tags|tool|widget",
+    re.IGNORECASE,
+)
+_POSITIVE_NAME_RE = re.compile(r"article|body|content|entry|hentry|main|page|post|text|blog|story|prose|markdown", re.IGNORECASE)
+_TAG_BONUS = {"article": 25, "main": 25, "section": 5, "div": 5, "td": 3, "blockquote": 3}
+
+_META_CHARSET_RE = re.compile(rb"""<meta[^>]+charset=["']?([\w.:-]+)""", re.IGNORECASE)
+_HEADER_CHARSET_RE = re.compile(r"""charset=["']?([\w.:-]+)""", re.IGNORECASE)
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+def estimate_tokens(text: str) -> int:
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def detect_charset(first_chunk: bytes, content_type_header: str = "") -> str:
+    """Charset from the Content-Type header wins, then a <meta charset> in the first chunk, then utf-8."""
+    candidates = []
+    header_match = _HEADER_CHARSET_RE.search(content_type_header or "")
+    if header_match:
+        candidates.append(header_match.group(1))
+    meta_match = _META_CHARSET_RE.search(first_chunk[:4096])
+    if meta_match:
+        candidates.append(meta_match.group(1).decode("ascii", errors="ignore"))
+    for candidate in candidates:
+        try:
+            codecs.lookup(candidate)
+            return candidate
+        except LookupError:
+            continue
+    return "utf-8"
+
+
+class HtmlTextOptions:
+    """Per-site extraction settings, threaded from the CLI down to the URL resolver."""
+
+    def __init__(self, max_bytes: int = WEBSITE_MAX_BYTES, max_tokens: int = WEBSITE_MAX_TOKENS, main_content: bool = False):
+        self.max_bytes = max_bytes
+        self.max_tokens = max_tokens
+        self.main_content = main_content
+
+
+class _Node:
+    __slots__ = ("parent", "tag", "weight", "score", "text_chars", "link_chars", "commas")
+
+    def __init__(self, parent, tag, weight=0):
+        self.parent = parent
+        self.tag = tag
+        self.weight = weight
+        self.score = 0.0
+        self.text_chars = 0
+        self.link_chars = 0
+        self.commas = 0
+
+
+class StreamingTextExtractor(HTMLParser):
+    def __init__(self, encoding: str = "utf-8", options: HtmlTextOptions = None):
+        super().__init__(convert_charrefs=True)
+        self.options = options or HtmlTextOptions()
+        self._decoder = codecs.getincrementaldecoder(encoding)(errors="replace")
+        # Element whose content is being dropped (script, style, ...) and how deeply it is nested.
+        self._skip_tag = None
+        self._skip_depth = 0
+        self._skip_is_boilerplate = False
+        self.dropped_chars = 0 # Text inside boilerplate elements, for the reduction report
+        self._parts = []
+        self._text_chars = 0
+        self._pending_newline = False
+        self.bytes_read = 0
+        self.truncated_reason = None
+        # Main-content mode state: element tree, open element stack and (node, text) segments.
+        self._main_content = self.options.main_content
+        self._nodes = [_Node(None, "#document")]
+        self._open = [0]
+        self._link_depth = 0
+        self._segments = []
+        self.main_content_fallback = False # Set by text() when main-content mode kept almost nothing
+
+    @property
+    def done(self) -> bool:
+        return self.truncated_reason is not None
+
+    def feed_bytes(self, chunk: bytes):
+        """Feeds one raw chunk; returns False once a cap has been hit and reading should stop."""
+        if self.done:
+            return False
+        max_bytes = self.options.max_bytes
+        if max_bytes is not None and self.bytes_read + len(chunk) > max_bytes:
+            chunk = chunk[:max_bytes - self.bytes_read]
+            self.truncated_reason = f"byte cap of {max_bytes} reached"
+        self.bytes_read += len(chunk)
+        self.feed(self._decoder.decode(chunk))
+        return not self.done
+
+    def close(self):
+        if not self.done:
+            self.feed(self._decoder.decode(b"", final=True))
+        super().close()
+
+    def handle_starttag(self, tag, attrs):
+        if self._skip_tag:
+            if self._skip_tag == "head" and tag == "body": # Page never closed its <head>
+                self._skip_tag, self._skip_depth = None, 0
+            else:
+                if tag == self._skip_tag:
+                    self._skip_depth += 1
+                return
+        if tag in _SKIP_TAGS or (self._main_content and self._is_boilerplate(tag, attrs)):
+            if tag not in _VOID_TAGS:
+                self._skip_tag, self._skip_depth = tag, 1
+                self._skip_is_boilerplate = tag not in _SKIP_TAGS
+            return
+        if tag in _BLOCK_TAGS:
+            self._pending_newline = True
+        if not self._main_content or tag in _VOID_TAGS:
+            return
+        if tag == "a":
+            self._link_depth += 1
+        if tag in _PARAGRAPH_TAGS or tag in _BLOCK_TAGS:
+            # A new block implicitly closes an open <p>.
+            if self._nodes[self._open[-1]].tag == "p":
+                self._open.pop()
+        names = " ".join(value or "" for name, value in attrs if name in ("class", "id"))
+        weight = 0
+        if names:
+            if _NEGATIVE_NAME_RE.search(names):
+                weight -= 25
+            if _POSITIVE_NAME_RE.search(names):
+                weight += 25
+        self._nodes.append(_Node(self._open[-1], tag, weight))
+        self._open.append(len(self._nodes) - 1)
+
+    def handle_startendtag(self, tag, attrs):
+        if tag in _BLOCK_TAGS and not self._skip_tag:
+            self._pending_newline = True
+
+    def handle_endtag(self, tag):
+        if self._skip_tag:
+            if tag == self._skip_tag:
+                self._skip_depth -= 1
+                if self._skip_depth <= 0:
+                    self._skip_tag, self._skip_depth = None, 0
+            return
+        if tag in _BLOCK_TAGS:
+            self._pending_newline = True
+        if not self._main_content:
+            return
+        # Pop up to the matching element; stray end tags that match nothing open are ignored.
+        for depth in range(len(self._open) - 1, 0, -1):
+            if self._nodes[self._open[depth]].tag == tag:
+                del self._open[depth:]
+                # Recounted rather than decremented: an unclosed <a> popped here must not
+                # leave the rest of the page counted as link text.
+                self._link_depth = sum(1 for node_id in self._open if self._nodes[node_id].tag == "a")
+                return
+
+    def _is_boilerplate(self, tag, attrs):
+        if tag in _BOILERPLATE_TAGS:
+            return True
+        if tag in ("html", "body", "main", "article"):
+            return False
+        names = " ".join(value or "" for name, value in attrs if name in ("class", "id"))
+        return bool(names) and bool(_NEGATIVE_NAME_RE.search(names)) and not _POSITIVE_NAME_RE.search(names) \
+            and any(word in names.lower() for word in ("cookie", "consent", "banner", "sidebar", "breadcrumb", "newsletter", "popup", "modal"))
+
+    def handle_data(self, data):
+        if self._skip_tag and self._skip_is_boilerplate:
+            self.dropped_chars += len(data.strip())
+        if self._skip_tag or self.done:
+            return
+        text = _WHITESPACE_RE.sub(" ", data)
+        if not text.strip():
+            if self._parts and not self._parts[-1].endswith((" ", "\n")):
+                self._emit(" ")
+            return
+        if self._pending_newline and self._parts:
+            self._emit("\n")
+            text = text.lstrip()
+        elif not self._parts or self._parts[-1].endswith("\n"):
+            text = text.lstrip()
+        self._pending_newline = False
+        self._emit(text)
+
+    def _emit(self, text):
+        max_tokens = self.options.max_tokens
+        if max_tokens is not None:
+            room = max_tokens * CHARS_PER_TOKEN - self._text_chars
+            if len(text) > room:
+                text = text[:max(room, 0)]
+                self.truncated_reason = f"token cap of {max_tokens} reached"
+        if text:
+            self._parts.append(text)
+            self._text_chars += len(text)
+            if self._main_content:
+                node = self._nodes[self._open[-1]]
+                node.text_chars += len(text.strip())
+                node.commas += text.count(",")
+                if self._link_depth:
+                    node.link_chars += len(text.strip())
+                self._segments.append(self._open[-1])
+
+    def full_text(self) -> str:
+        return "".join(self._parts).strip()
+
+    def text(self) -> str:
+        if not self._main_content:
+            return self.full_text()
+        kept_nodes = self._main_content_nodes()
+        if kept_nodes is None:
+            return self.full_text()
+        kept_cache = {}
+
+        def is_kept(node_id):
+            path = []
+            while node_id is not None and node_id not in kept_cache:
+                if node_id in kept_nodes:
+                    kept_cache[node_id] = True
+                    break
+                path.append(node_id)
+                node_id = self._nodes[node_id].parent
+            result = kept_cache.get(node_id, False) if node_id is not None else False
+            for visited in path:
+                kept_cache[visited] = result
+            return result
+
+        kept_parts = [part for part, node_id in zip(self._parts, self._segments) if is_kept(node_id)]
+        text = "".join(kept_parts).strip()
+        # Collapse the blank runs left where dropped blocks used to be.
+        text = re.sub(r"\n\s*\n+", "\n", text)
+        full_text = self.full_text()
+        if len(text) < MAIN_CONTENT_MIN_CHARS and len(full_text) > len(text):
+            self.main_content_fallback = True
+            return full_text
+        return text
+
+    def _main_content_nodes(self):
+        """Returns the ids of the elements whose text forms the main content, or None to keep everything."""
+        nodes = self._nodes
+        # Children are always created after their parents, so one reverse pass accumulates subtree totals.
+        subtree_chars = [node.text_chars for node in nodes]
+        subtree_links = [node.link_chars for node in nodes]
+        for node_id in range(len(nodes) - 1, 0, -1):
+            parent = nodes[node_id].parent
+            subtree_chars[parent] += subtree_chars[node_id]
+            subtree_links[parent] += subtree_links[node_id]
+
+        def container_of(node_id):
+            node_id = nodes[node_id].parent
+            while node_id is not None and nodes[node_id].tag not in _CONTAINER_TAGS:
+                node_id = nodes[node_id].parent
+            return node_id
+
+        candidates = {}
+        for node_id, node in enumerate(nodes):
+            if node.tag not in _PARAGRAPH_TAGS or subtree_chars[node_id] < 25:
+                continue
+            content_score = 1 + node.commas + min(subtree_chars[node_id] // 100, 3)
+            parent = container_of(node_id)
+            if parent is None:
+                continue
+            candidates[parent] = candidates.get(parent, 0) + content_score
+            grandparent = container_of(parent)
+            if grandparent is not None:
+                candidates[grandparent] = candidates.get(grandparent, 0) + content_score / 2
+
+        best_id, best_score, scores = None, 0.0, {}
+        for node_id, content_score in candidates.items():
+            node = nodes[node_id]
+            link_density = subtree_links[node_id] / subtree_chars[node_id] if subtree_chars[node_id] else 0
+            score = (content_score + node.weight + _TAG_BONUS.get(node.tag, 0)) * (1 - link_density)
+            scores[node_id] = score
+            if score > best_score:
+                best_id, best_score = node_id, score
+        if best_id is None:
+            return None
+        # Siblings that score close to the winner are usually the rest of a split-up article.
+        threshold = max(10, best_score * 0.2)
+        kept = {best_id}
+        for node_id, score in scores.items():
+            if score >= threshold and nodes[node_id].parent == nodes[best_id].parent:
+                kept.add(node_id)
+        return kept
+
+    def truncation_note(self, total_bytes: int = None):
+        """Human readable summary of what was left out, or None if the page was read in full."""
+        if not self.done:
+            return None
+        if total_bytes:
+            remaining = max(total_bytes - self.bytes_read, 0)
+            return f"{self.truncated_reason}; read {self.bytes_read} of {total_bytes} bytes ({remaining} bytes not read)"
+        return f"{self.truncated_reason}; read {self.bytes_read} bytes, rest of the page not read"
+
+
+def extract_text_from_chunks(chunks, encoding: str = "utf-8", options: HtmlTextOptions = None, total_bytes: int = None):
+    """
+    Consumes `chunks` until the page ends or a cap is hit. Returns (text, truncation_note, reduction_note);
+    reduction_note is only set in main-content mode and describes how much boilerplate was dropped.
+    """
+    extractor = StreamingTextExtractor(encoding, options)
+    for chunk in chunks:
+        if chunk and not extractor.feed_bytes(chunk):
+            break
+    extractor.close()
+    text = extractor.text()
+    reduction_note = None
+    if extractor.options.main_content:
+        # Boilerplate dropped while parsing never reached full_text(), so it is added back for the comparison.
+        full_text = extractor.full_text()
+        full_bytes = len(full_text.encode("utf-8")) + extractor.dropped_chars
+        kept_bytes = len(text.encode("utf-8"))
+        saved = 100 * (1 - kept_bytes / full_bytes) if full_bytes else 0
+        full_tokens = estimate_tokens(full_text) + extractor.dropped_chars // CHARS_PER_TOKEN
+        reduction_note = (
+            f"main content kept {kept_bytes} of {full_bytes} bytes, "
+            f"~{full_tokens} -> ~{estimate_tokens(text)} tokens ({saved:.0f}% less)"
+        )
+        if extractor.main_content_fallback:
+            reduction_note += "; the main content found was almost empty, so the full text was kept"
+    return text, extractor.truncation_note(total_bytes), reduction_note
@@ -0,0 +1,186 @@
+"""
+On-disk cache for URL attachments.
+
+Payloads (extracted website text and raw binary bodies) are stored content-addressed under
+`<cache_dir>/blobs/`, so the same bytes served from two URLs are kept once. A small SQLite
+index maps each URL to its blobs plus the validators (ETag / Last-Modified) needed to
+revalidate it with a conditional request. Entries are evicted least-recently-used once the
+total size goes over `max_bytes`.
+"""
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+HTTP_CACHE_MAX_BYTES = 512 * 1024 * 1024
+# Larger binary bodies aren't downloaded into memory to be cached: the plugin fetches them by URL
+HTTP_CACHE_MAX_BODY_BYTES = 20 * 1024 * 1024
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    url TEXT PRIMARY KEY,
+    content_type TEXT,
+    etag TEXT,
+    last_modified TEXT,
+    text_hash TEXT,
+    body_hash TEXT,
+    meta TEXT,
+    size INTEGER NOT NULL DEFAULT 0,
+    fetched_at REAL NOT NULL,
+    last_access REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS entries_last_access ON entries(last_access);
+"""
+
+
+class HttpCacheEntry:
+    def __init__(self, cache, row):
+        self._cache = cache
+        self.url = row["url"]
+        self.content_type = row["content_type"]
+        self.etag = row["etag"]
+        self.last_modified = row["last_modified"]
+        self.text_hash = row["text_hash"]
+        self.body_hash = row["body_hash"]
+        self.fetched_at = row["fetched_at"]
+        self.meta = json.loads(row["meta"]) if row["meta"] else {}
+
+    def text(self):
+        data = self._cache._read_blob(self.text_hash)
+        return data.decode("utf-8") if data is not None else None
+
+    def body(self):
+        return self._cache._read_blob(self.body_hash)
+
+    def conditional_headers(self) -> dict:
+        headers = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+
+class HttpCache:
+    """
+    Thread-safe: the attachment resolver calls it from several worker threads, so all index
+    access goes through one connection guarded by a lock.
+
+    `ttl_seconds` is the freshness window. Inside it a hit is served without any network I/O;
+    outside it (or when it is None) the caller should revalidate with `conditional_headers()`.
+    """
+
+    def __init__(self, cache_dir, max_bytes: int = HTTP_CACHE_MAX_BYTES, ttl_seconds: float = None):
+        self.cache_dir = Path(cache_dir).expanduser()
+        self.blob_dir = self.cache_dir / "blobs"
+        self.blob_dir.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(str(self.cache_dir / "index.sqlite"), check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        self._db.executescript(_SCHEMA)
+        columns = {row["name"] for row in self._db.execute("PRAGMA table_info(entries)")}
+        if "meta" not in columns: # Index created before extraction metadata was stored
+            self._db.execute("ALTER TABLE entries ADD COLUMN meta TEXT")
+            self._db.commit()
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _blob_path(self, digest: str) -> Path:
+        return self.blob_dir / digest[:2] / digest
+
+    def _read_blob(self, digest):
+        if not digest:
+            return None
+        try:
+            return self._blob_path(digest).read_bytes()
+        except FileNotFoundError:
+            return None
+
+    def _write_blob(self, data: bytes) -> str:
+        digest = hashlib.sha256(data).hexdigest()
+        path = self._blob_path(digest)
+        if not path.exists():
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = path.with_suffix(f".tmp{threading.get_ident()}")
+            tmp_path.write_bytes(data)
+            tmp_path.replace(path)
+        return digest
+
+    def lookup(self, url: str):
+        """Returns the entry for `url` (refreshing its LRU position) or None."""
+        with self._lock:
+            row = self._db.execute("SELECT * FROM entries WHERE url = ?", (url,)).fetchone()
+            if row is None:
+                return None
+            entry = HttpCacheEntry(self, row)
+            # A blob may have been removed by hand; treat that as a miss.
+            if (entry.text_hash and not self._blob_path(entry.text_hash).exists()) or \
+               (entry.body_hash and not self._blob_path(entry.body_hash).exists()):
+                self._db.execute("DELETE FROM entries WHERE url = ?", (url,))
+                self._db.commit()
+                return None
+            self._db.execute("UPDATE entries SET last_access = ? WHERE url = ?", (time.time(), url))
+            self._db.commit()
+            return entry
+
+    def is_fresh(self, entry: HttpCacheEntry) -> bool:
+        return self.ttl_seconds is not None and (time.time() - entry.fetched_at) < self.ttl_seconds
+
+    def mark_revalidated(self, url: str):
+        """Records a 304 Not Modified: the cached payload is good for another TTL window."""
+        with self._lock:
+            now = time.time()
+            self._db.execute("UPDATE entries SET fetched_at = ?, last_access = ? WHERE url = ?", (now, now, url))
+            self._db.commit()
+
+    def store(self, url: str, headers, content_type: str, text: str = None, body: bytes = None, meta: dict = None):
+        text_hash = self._write_blob(text.encode("utf-8")) if text is not None else None
+        body_hash = self._write_blob(body) if body is not None else None
+        size = (len(text.encode("utf-8")) if text is not None else 0) + (len(body) if body is not None else 0)
+        now = time.time()
+        with self._lock:
+            old_hashes = self._db.execute(
+                "SELECT text_hash, body_hash FROM entries WHERE url = ?", (url,)
+            ).fetchone()
+            self._db.execute(
+                "INSERT OR REPLACE INTO entries "
+                "(url, content_type, etag, last_modified, text_hash, body_hash, meta, size, fetched_at, last_access) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (url, content_type, headers.get("ETag"), headers.get("Last-Modified"),
+                 text_hash, body_hash, json.dumps(meta) if meta else None, size, now, now),
+            )
+            if old_hashes is not None:
+                self._drop_unreferenced([h for h in old_hashes if h and h not in (text_hash, body_hash)])
+            self._evict()
+            self._db.commit()
+
+    def _drop_unreferenced(self, digests):
+        for digest in digests:
+            in_use = self._db.execute(
+                "SELECT 1 FROM entries WHERE text_hash = ? OR body_hash = ? LIMIT 1", (digest, digest)
+            ).fetchone()
+            if in_use is None:
+                self._blob_path(digest).unlink(missing_ok=True)
+
+    def _evict(self):
+        total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for row in self._db.execute("SELECT url, size, text_hash, body_hash FROM entries ORDER BY last_access").fetchall():
+            self._db.execute("DELETE FROM entries WHERE url = ?", (row["url"],))
+            self._drop_unreferenced([h for h in (row["text_hash"], row["body_hash"]) if h])
+            total -= row["size"]
+            if total <= self.max_bytes:
+                break
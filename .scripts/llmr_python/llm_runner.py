@@ -1,17 +1,49 @@
-import llm
+import time
+_MODULE_IMPORTS_STARTED = time.perf_counter()
+# llm (with its plugins), requests and asyncio are imported where they are first needed: they are most of
+# the start-up time and commands like --usage or --search never touch them.
 import os
 import json
-import asyncio
 from datetime import datetime
 from pathlib import Path
 from textwrap import dedent
 from enum import Enum
 import argparse
 import sys
-from strip_tags import strip_tags
-import requests
-import mimetypes
-import tempfile
+import atexit
+import shutil
+import signal
+import collections
+import itertools
+import concurrent.futures
+import threading
+import urllib.parse
+from typing import TYPE_CHECKING
+from http_cache import HTTP_CACHE_MAX_BODY_BYTES, HttpCache
+from attachment_convert import CONVERSION_CACHE_DIR_NAME, ConversionPool, converter_for
+from mime_sniff import MIME_CACHE_FILE_NAME, MimeTypeCache, classify_files, sniff_mime_type
+from prompt_builder import assemble_prompt, iter_context_files
+from dedup import dedup_prompt
+from prompt_cache import place_prefix_breakpoint, split_stable_prefix, supports_cache_option
+from response_cache import RESPONSE_CACHE_TTL_SECONDS, ResponseCache, request_fingerprint
+from similar_cache import DEFAULT_SIMILARITY_THRESHOLD, SimilarPromptIndex, prompt_simhash
+from stream_sink import StreamSink
+from log_store import LOG_STORE_DIR_NAME, LogStore
+from search_index import DEFAULT_SEARCH_LIMIT, SEARCH_INDEX_FILE_NAME, SearchIndex, cost_from_log_header
+from checkpoint import RunCheckpoint, find_checkpoint, format_checkpoint_list, list_checkpoints
+from fanout import filter_attachments_for_family, run_fanout
+from batch import DEFAULT_BATCH_CONCURRENCY, run_batch
+from startup_profile import StartupProfile, mark_module_imports, profile_phase
+from pricing import BUCKET_LABELS as PRICE_BUCKET_LABELS, compute_cost, pricing_version
+from usage_ledger import USAGE_GROUPS, USAGE_LEDGER_FILE_NAME, BudgetExceeded, UsageLedger, format_usage_summary
+from token_budget import DEFAULT_RESERVED_OUTPUT_TOKENS, TokenCountCache, context_window_for, plan_token_budget
+from html_text import CHARS_PER_TOKEN, HtmlTextOptions, WEBSITE_MAX_BYTES, WEBSITE_MAX_TOKENS, detect_charset, extract_text_from_chunks
+
+if TYPE_CHECKING: # Annotations only; the real imports stay lazy (see above)
+    import llm
+    import requests
+
+mark_module_imports("llm_runner", _MODULE_IMPORTS_STARTED, time.perf_counter())
 
 SUPPORTED_ATTACHMENT_TYPES = {
     "gemini": {
@@ -48,7 +80,206 @@ def get_model_family(model_id: str) -> str:
         # print(f"Warning: Unknown model family for model ID '{model_id}'. Attachment type filtering may be restrictive.")
         return "unknown"
 
-def get_attachments(attachments_file, model_id_str): # model is an llm.Model instance
+# Default for --daemon_idle_timeout
+DAEMON_IDLE_TIMEOUT_SECONDS = 30 * 60
+
+# max_output_tokens sent to gemini models, single runs and fan-out alike
+GEMINI_MAX_OUTPUT_TOKENS = 800000
+
+# Concurrency limits for resolving URL lines of attachments.md.
+URL_RESOLVER_MAX_WORKERS = 8
+URL_RESOLVER_MAX_PER_HOST = 4
+
+def _build_http_session(max_workers: int = URL_RESOLVER_MAX_WORKERS) -> "requests.Session":
+    """Returns a Session whose keep-alive pool is large enough for the resolver's workers."""
+    import requests
+
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=max_workers, pool_maxsize=URL_RESOLVER_MAX_PER_HOST)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+def _format_website_plain_text(url: str, plain_text: str, truncation_note: str = None) -> str:
+    # Built line by line rather than with dedent(): the page text is multi-line and unindented,
+    # which would leave dedent() with no common prefix to strip.
+    lines = ["<website-plain-text-content>", "<url>", url, "</url>", "<content>", plain_text, "</content>"]
+    if truncation_note:
+        lines += ["<truncated>", truncation_note, "</truncated>"]
+    lines.append("</website-plain-text-content>")
+    return "\n".join(lines)
+
+def _format_file_plain_text(path: str, plain_text: str, truncation_note: str = None) -> str:
+    # Same layout as website texts (dedup and the token plan read the source from the third line)
+    lines = ["<file-plain-text-content>", "<path>", path, "</path>", "<content>", plain_text, "</content>"]
+    if truncation_note:
+        lines += ["<truncated>", truncation_note, "</truncated>"]
+    lines.append("</file-plain-text-content>")
+    return "\n".join(lines)
+
+def _cached_url_result(entry, url, allowed_mimetypes, model_family, model_id_str, line_number, note):
+    """Builds a resolver result from an HttpCache entry. `note` says why the cache was used (fresh / revalidated)."""
+    import llm
+
+    messages = []
+    if entry.text_hash:
+        messages.append(f"Processing HTML URL (plain text from cache, {note}): {url}")
+        return None, _format_website_plain_text(url, entry.text(), entry.meta.get("truncation_note")), messages
+    if entry.content_type in allowed_mimetypes:
+        messages.append(f"Processing URL (type: {entry.content_type}, from cache, {note}): {url}")
+        return llm.Attachment(content=entry.body(), type=entry.content_type), None, messages
+    messages.append(f"Warning: Unsupported content type '{entry.content_type}' for URL {url} (from file line {line_number}) by model (family: {model_family}, ID: {model_id_str}). Skipping.")
+    return None, None, messages
+
+URL_PROBE_CHUNK_SIZE = 64 * 1024
+
+def _resolve_url_line(session, host_limits, url, line_number, allowed_mimetypes, model_family, model_id_str, http_cache=None, html_options=None):
+    """
+    Resolves one URL line of attachments.md. Runs on a worker thread, so it doesn't print:
+    it returns (attachment, website_text, messages) and the caller prints messages in file order.
+
+    One streamed GET per URL: the type is decided from the response headers (or the sniffed first
+    chunk when the server doesn't send one), then the body is either consumed or the connection is
+    closed without downloading the rest.
+    """
+    import llm
+    import requests
+
+    messages = []
+    cached = http_cache.lookup(url) if http_cache is not None else None
+    html_options = html_options or HtmlTextOptions()
+    extraction_meta = {"main_content": bool(html_options.main_content), "max_bytes": html_options.max_bytes, "max_tokens": html_options.max_tokens}
+    if cached is not None and cached.text_hash and any(cached.meta.get(key) != value for key, value in extraction_meta.items()):
+        cached = None # Text was extracted in the other mode or under other caps; fetch it again (unconditionally)
+    if cached is not None and http_cache.is_fresh(cached):
+        return _cached_url_result(cached, url, allowed_mimetypes, model_family, model_id_str, line_number, "fresh")
+
+    host = urllib.parse.urlsplit(url).netloc.lower()
+    with host_limits[host]:
+        try:
+            conditional_headers = cached.conditional_headers() if cached is not None else {}
+            with session.get(url, stream=True, timeout=(10, 30), headers=conditional_headers) as get_response:
+                if get_response.status_code == 304 and cached is not None:
+                    http_cache.mark_revalidated(url)
+                    return _cached_url_result(cached, url, allowed_mimetypes, model_family, model_id_str, line_number, "not modified")
+                get_response.raise_for_status()
+
+                chunks = get_response.iter_content(chunk_size=URL_PROBE_CHUNK_SIZE)
+                first_chunk = next(chunks, b"")
+                # Normalize content_type: take part before ';', lowercase.
+                content_type = get_response.headers.get('content-type', '').split(';')[0].strip().lower()
+                if not content_type or content_type == "application/octet-stream":
+                    content_type = sniff_mime_type(first_chunk) or content_type
+
+                if not content_type:
+                    messages.append(f"Warning: Could not determine content type for URL {url} (from file line {line_number}). Skipping.")
+                    return None, None, messages
+
+                if content_type != 'text/html' and content_type not in allowed_mimetypes:
+                    messages.append(f"Warning: Unsupported content type '{content_type}' for URL {url} (from file line {line_number}) by model (family: {model_family}, ID: {model_id_str}). Skipping.")
+                    return None, None, messages
+
+                if content_type == 'text/html':
+                    messages.append(f"Processing HTML URL (extracting plain text): {url}")
+                    encoding = detect_charset(first_chunk, get_response.headers.get('content-type', ''))
+                    # Content-Length is the compressed size when the body is encoded; only report it when it's comparable.
+                    total_bytes = None
+                    if not get_response.headers.get('content-encoding'):
+                        total_bytes = int(get_response.headers.get('content-length') or 0) or None
+                    plain_text, truncation_note, reduction_note = extract_text_from_chunks(
+                        itertools.chain([first_chunk], chunks), encoding, html_options, total_bytes
+                    )
+                    if http_cache is not None:
+                        http_cache.store(url, get_response.headers, content_type, text=plain_text,
+                                         meta={"truncation_note": truncation_note, **extraction_meta})
+                    if reduction_note:
+                        messages.append(f"  {reduction_note}: {url}")
+
+                    if truncation_note:
+                        messages.append(f"  Extracted plain text content from: {url} (truncated: {truncation_note})")
+                    else:
+                        messages.append(f"  Extracted plain text content from: {url}")
+                    return None, _format_website_plain_text(url, plain_text, truncation_note), messages
+
+                # Without a cache there's nothing to keep the body for, and large bodies aren't buffered
+                # to be cached: the plugin fetches those. Passing the type along spares it a HEAD request.
+                content_length = int(get_response.headers.get('content-length') or 0)
+                if http_cache is None or content_length > HTTP_CACHE_MAX_BODY_BYTES:
+                    messages.append(f"Processing URL (type: {content_type}): {url}")
+                    return llm.Attachment(url=url, type=content_type), None, messages
+
+                body_chunks = [first_chunk]
+                body_size = len(first_chunk)
+                for chunk in chunks:
+                    body_chunks.append(chunk)
+                    body_size += len(chunk)
+                    if body_size > HTTP_CACHE_MAX_BODY_BYTES:
+                        messages.append(f"Processing URL (type: {content_type}, over {HTTP_CACHE_MAX_BODY_BYTES} bytes, not cached): {url}")
+                        return llm.Attachment(url=url, type=content_type), None, messages
+                body = b"".join(body_chunks)
+
+            http_cache.store(url, get_response.headers, content_type, body=body)
+            messages.append(f"Processing URL (type: {content_type}): {url}")
+            return llm.Attachment(content=body, type=content_type), None, messages
+
+        except requests.exceptions.RequestException as e:
+            messages.append(f"Error fetching or processing URL {url} (from file line {line_number}): {e}. Skipping.")
+    return None, None, messages
+
+def _resolve_local_line(path, line_number, allowed_mimetypes, model_family, model_id_str, mime_type, attachment_cache=None):
+    """
+    Resolves one local file of attachments.md, typed beforehand from its content (see classify_files).
+    Same return shape as _resolve_url_line.
+    """
+    import mimetypes
+    import llm
+
+    messages = []
+    if not os.path.isfile(path): # Check if it's a file and exists
+        messages.append(f"Warning: Local file path {path} (from file line {line_number}) does not exist or is not a file. Skipping.")
+        return None, None, messages
+
+    if mime_type is None:
+        messages.append(f"Warning: Could not determine MIME type for local file {path} (from file line {line_number}). Skipping.")
+        return None, None, messages
+
+    extension_type = (mimetypes.guess_type(path)[0] or "").lower()
+    if extension_type and extension_type != mime_type and not (extension_type.startswith("text/") and mime_type.startswith("text/")):
+        messages.append(f"Note: {path} contains {mime_type} although its extension says {extension_type}.")
+    if mime_type not in allowed_mimetypes and mime_type.startswith("text/") and "text/plain" in allowed_mimetypes:
+        mime_type = "text/plain" # Source code, markdown, ... are plain text to the provider
+
+    if mime_type in allowed_mimetypes:
+        messages.append(f"Processing local file (type: {mime_type}): {path}")
+        # The type is passed along so the plugin doesn't read the file again to guess it
+        if attachment_cache is not None:
+            return attachment_cache.attachment(path, type=mime_type), None, messages
+        return llm.Attachment(path=path, type=mime_type), None, messages
+    messages.append(f"Warning: Unsupported MIME type '{mime_type}' for local file {path} (from file line {line_number}) by model (family: {model_family}, ID: {model_id_str}). Skipping.")
+    return None, None, messages
+
+def _converted_local_line(path, line_number, mime_type, conversion, html_options: HtmlTextOptions = None):
+    """
+    Result of a local file converted to text (see attachment_convert.py), cut at the website token cap.
+    Same return shape as _resolve_url_line.
+    """
+    messages = []
+    try:
+        text, from_cache = conversion.result()
+    except Exception as err:
+        messages.append(f"Warning: Could not convert local file {path} (type: {mime_type}, from file line {line_number}) to text: {err}. Skipping.")
+        return None, None, messages
+    max_chars = (html_options or HtmlTextOptions()).max_tokens * CHARS_PER_TOKEN
+    truncation_note = None
+    if len(text) > max_chars:
+        truncation_note = f"converted text cut at ~{max_chars // CHARS_PER_TOKEN} tokens; {len(text) - max_chars} of {len(text)} characters not included"
+        text = text[:max_chars]
+    messages.append(f"Processing local file (type: {mime_type}, converted to text{', from cache' if from_cache else ''}): {path}")
+    return None, _format_file_plain_text(path, text, truncation_note), messages
+
+def get_attachments(attachments_file, model_id_str, max_workers: int = URL_RESOLVER_MAX_WORKERS, http_cache=None,
+                    html_options: HtmlTextOptions = None, attachment_cache=None, mime_cache=None,
+                    conversion_pool: ConversionPool = None): # model is an llm.Model instance
     _resolved_attachments_file_path = os.path.normpath(os.path.expanduser(attachments_file))
 
     attachments = []
@@ -62,94 +293,94 @@ def get_attachments(attachments_file, model_id_str): # model is an llm.Model ins
     elif model_family == "unknown" and not allowed_mimetypes:
          print(f"Warning: Model family is 'unknown' (model ID: '{model_id_str}') and no default MIME types are set. Attachments may not be processed correctly.")
 
-    if os.path.exists(_resolved_attachments_file_path) and os.path.getsize(_resolved_attachments_file_path) > 0:
-        with open(_resolved_attachments_file_path, "r") as f:
-            lines = f.readlines()
-        
-        for line_number, raw_line in enumerate(lines, 1):
-            line = raw_line.strip()
-            if not line:
-                continue
-
-            if line.startswith("http://") or line.startswith("https://"):
-                try:
-                    head_response = requests.head(line, allow_redirects=True, timeout=10)
-                    head_response.raise_for_status()
-                    # Normalize content_type: take part before ';', lowercase.
-                    content_type = head_response.headers.get('content-type', '').split(';')[0].strip().lower()
-
-                    if not content_type:
-                        print(f"Warning: Could not determine content type for URL {line} (from file line {line_number}). Skipping.")
-                        continue
-
-                    if content_type == 'text/html':
-                        print(f"Processing HTML URL (extracting plain text): {line}")
-                        get_response = requests.get(line, timeout=30)
-                        get_response.raise_for_status()
-                        html_content = get_response.text
-                        
-                        plain_text = strip_tags(html_content, minify=True)
-                        
-                        plain_text_from_url = dedent(f"""
-                            <website-plain-text-content>
-                            <url>
-                            {line}
-                            </url>
-                            <content>
-                            {plain_text}
-                            </content>
-                            </website-plain-text-content>
-                        """).strip()
-                        plain_text_websites.append(plain_text_from_url)
-                        print(f"  Extracted plain text content from: {line}")
-                    
-                    elif content_type in allowed_mimetypes:
-                        attachments.append(llm.Attachment(url=line))
-                        print(f"Processing URL (type: {content_type}): {line}")
-                    else:
-                        print(f"Warning: Unsupported content type '{content_type}' for URL {line} (from file line {line_number}) by model (family: {model_family}, ID: {model_id_str}). Skipping.")
+    if not (os.path.exists(_resolved_attachments_file_path) and os.path.getsize(_resolved_attachments_file_path) > 0):
+        return attachments, plain_text_websites
+
+    with open(_resolved_attachments_file_path, "r") as f:
+        lines = f.readlines()
+
+    # Validate every line up front so a typo fails before any network I/O is started.
+    entries = []
+    for line_number, raw_line in enumerate(lines, 1):
+        line = raw_line.strip()
+        if not line:
+            continue
+        if line.startswith("http://") or line.startswith("https://"):
+            entries.append(("url", line, line_number))
+        elif line.startswith("/") or line.startswith("~"):
+            path = os.path.expanduser(line)
+            if os.path.isdir(path): # Every file in it, skipping hidden and .gitignore'd ones like --context_files
+                entries.extend(("local", file_path, line_number) for file_path in iter_context_files([path]))
+            else:
+                entries.append(("local", path, line_number))
+        else:
+            # Original error for invalid line format
+            raise ValueError(
+                f"Invalid format in attachments file '{_resolved_attachments_file_path}' "
+                f"on line {line_number}: '{line}'. Each line must be a valid file or directory path "
+                "(starting with '/' or '~') or a URL (starting with 'http://' or 'https://')."
+            )
 
-                except requests.exceptions.RequestException as e:
-                    print(f"Error fetching or processing URL {line} (from file line {line_number}): {e}. Skipping.")
-                    continue
-            
-            elif line.startswith("/") or line.startswith("~"):
-                path = os.path.expanduser(line)
-                if not os.path.isfile(path): # Check if it's a file and exists
-                    print(f"Warning: Local file path {path} (from file line {line_number}) does not exist or is not a file. Skipping.")
-                    continue
-                
-                mime_type, _ = mimetypes.guess_type(path)
-                if mime_type is None:
-                    # Fallback for common text types if mimetypes.guess_type fails
-                    lower_path = path.lower()
-                    if lower_path.endswith(".txt"):
-                        mime_type = "text/plain"
-                    elif lower_path.endswith(".csv"):
-                        mime_type = "text/csv"
-                    else:
-                        print(f"Warning: Could not determine MIME type for local file {path} (from file line {line_number}). Skipping.")
-                        continue
-                
-                mime_type = mime_type.lower() # Normalize MIME type
-
-                if mime_type in allowed_mimetypes:
-                    attachments.append(llm.Attachment(path=path))
-                    print(f"Processing local file (type: {mime_type}): {path}")
-                else:
-                    print(f"Warning: Unsupported MIME type '{mime_type}' for local file {path} (from file line {line_number}) by model (family: {model_family}, ID: {model_id_str}). Skipping.")
-            
+    local_types = classify_files([path for kind, path, _ in entries if kind == "local"], mime_cache, max_workers)
+    # Files the family doesn't accept are converted to text on a process pool (see attachment_convert.py),
+    # started before the URL threads so the workers aren't forked while those run.
+    conversions = {}
+    if conversion_pool is not None:
+        for kind, path, _ in entries:
+            converter = converter_for(path, local_types.get(path), allowed_mimetypes) if kind == "local" else None
+            if converter is not None and path not in conversions:
+                conversions[path] = conversion_pool.submit(path, converter, main_content=bool(html_options and html_options.main_content))
+    url_count = sum(1 for kind, _, _ in entries if kind == "url")
+    workers = max(1, min(max_workers, url_count))
+    host_limits = collections.defaultdict(lambda: threading.BoundedSemaphore(URL_RESOLVER_MAX_PER_HOST))
+    with _build_http_session(workers) as session, concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        # Submit all URLs first, then walk the entries in file order; each result is printed as soon as
+        # every line before it is done, so output order (and attachment order) matches the file.
+        pending = []
+        for kind, line, line_number in entries:
+            if kind == "url":
+                pending.append(executor.submit(
+                    _resolve_url_line, session, host_limits, line, line_number,
+                    allowed_mimetypes, model_family, model_id_str, http_cache, html_options,
+                ))
+            else:
+                pending.append((line, line_number))
+
+        for item in pending:
+            if isinstance(item, concurrent.futures.Future):
+                attachment, website_text, messages = item.result()
+            elif item[0] in conversions:
+                attachment, website_text, messages = _converted_local_line(
+                    item[0], item[1], local_types.get(item[0]), conversions[item[0]], html_options
+                )
             else:
-                # Original error for invalid line format
-                raise ValueError(
-                    f"Invalid format in attachments file '{_resolved_attachments_file_path}' "
-                    f"on line {line_number}: '{line}'. Each line must be a valid file path "
-                    "(starting with '/' or '~') or a URL (starting with 'http://' or 'https://')."
+                attachment, website_text, messages = _resolve_local_line(
+                    item[0], item[1], allowed_mimetypes, model_family, model_id_str, local_types.get(item[0]), attachment_cache
                 )
+            for message in messages:
+                print(message)
+            if attachment is not None:
+                attachments.append(attachment)
+            if website_text is not None:
+                plain_text_websites.append(website_text)
     return attachments, plain_text_websites
 
 
 
+class PartialResponse:
+    """
+    Stands in for the llm.Response of a run cut short (Ctrl-C, API error mid-stream): the provider's usage
+    never arrived, so the tokens are estimated from the prompt and the partial answer.
+    """
+    partial = True
+
+    def __init__(self, model_id: str, input_tokens: int, output_tokens: int):
+        self.model = argparse.Namespace(model_id=model_id)
+        self.input_tokens = input_tokens
+        self.output_tokens = output_tokens
+        self.token_details = None
+
+
 class LLMExecutionType(Enum):
     MODEL_NON_STREAM = "run_model_non_stream"
     MODEL_STREAM = "run_model_stream"
@@ -160,111 +391,101 @@ class LLMRunner:
     def __init__(self, base_folder: str = "~/utils/llmr_py_runs", default_mode: str = "default"):
         self.base_folder = Path(base_folder).expanduser()
         self.default_mode = default_mode
+        self.load_api_keys()
+        self._model_instances = {}
+        self.response_cache = None # ResponseCache; set by the CLI unless --no_cache
+        self.similar_index = None # SimilarPromptIndex next to the response cache; every cached run is indexed
+        self.similar_threshold = None # Set (--similar_cache) to reuse answers of near-duplicate prompts
+        self.stream_socket_path = None # Unix socket that also receives streamed output (--stream_socket)
+        self.log_store = None # LogStore, opened on the first saved run
+        self.search_index = None # SearchIndex (FTS5) over run history, updated on every saved run
+        self.usage_ledger = None # UsageLedger: tokens, cost and latency of every call, plus per-mode daily budgets
+        self.ignore_budget = False # Set (--ignore_budget) to send requests over a mode's daily budget
+        self.profile = None # StartupProfile collecting phase timings (--profile_startup)
+
+    def load_api_keys(self):
+        """(Re)reads the API keys from the environment; the daemon calls it with each client's environment."""
         self.api_keys = {
             "gemini": os.environ.get("LLM_GEMINI_KEY") or os.environ.get("GOOGLE_API_KEY"),
             "openai": os.environ.get("OPENAI_API_KEY"),
             "claude": os.environ.get("ANTHROPIC_API_KEY"),
         }
 
+    def _profile_mark(self, name: str):
+        if self.profile is not None:
+            self.profile.mark_once(name)
+
     def _get_api_key(self, model_type: str):
         key = self.api_keys.get(model_type.lower())
         if not key:
             print(f"Warning: API key for {model_type} not found in environment variables.")
         return key
 
-    def _calculate_pricing(self, model_name_used: str, input_tokens: int, output_tokens: int, total_tokens: int = None):
-        input_price_val = 0.0
-        output_price_val = 0.0
-        model_info_str = ""
-        model_name_lower = model_name_used.lower()
-
-        # Pricing based on bash script and common models
-        # Ensure these are up-to-date with actual costs
-        if "gemini" in model_name_lower:
-            # Example: gemini-1.5-pro-latest vs gemini-1.5-flash-latest
-            if "flash" in model_name_lower: # Gemini 1.5 Flash
-                input_price_val = (input_tokens / 1_000_000) * 0.35 
-                output_price_val = (output_tokens / 1_000_000) * 0.70 # Adjusted from $1.05 to $0.70 for Flash example
-            elif "gemini-1.0-pro" in model_name_lower: # Older Gemini Pro
-                input_price_val = (input_tokens / 1_000_000) * 0.50
-                output_price_val = (output_tokens / 1_000_000) * 1.50
-            else: # Default to Gemini 1.5 Pro pricing
-                input_price_val = (input_tokens / 1_000_000) * 3.50 
-                output_price_val = (output_tokens / 1_000_000) * 10.50
-            model_info_str = dedent(f"""
-              **gemini usage ({model_name_used})**:
-                - input_tokens: {input_tokens} (price: ${input_price_val:.6f})
-                - output_tokens: {output_tokens} (price: ${output_price_val:.6f})
-            """).strip()
-        elif "gpt" in model_name_lower or "openai" in model_name_lower:
-            if "gpt-4o-mini" in model_name_lower:
-                input_price_val = (input_tokens / 1_000_000) * 0.15
-                output_price_val = (output_tokens / 1_000_000) * 0.60
-            elif "gpt-4o" in model_name_lower and not "mini" in model_name_lower: # gpt-4o (full)
-                input_price_val = (input_tokens / 1_000_000) * 5.00
-                output_price_val = (output_tokens / 1_000_000) * 15.00
-            elif "gpt-4-turbo" in model_name_lower or "gpt-4.1" in model_name_lower : # Covers gpt-4-turbo, gpt-4-turbo-preview, etc.
-                input_price_val = (input_tokens / 1_000_000) * 10.00
-                output_price_val = (output_tokens / 1_000_000) * 30.00
-            elif "gpt-3.5-turbo" in model_name_lower:
-                input_price_val = (input_tokens / 1_000_000) * 0.50
-                output_price_val = (output_tokens / 1_000_000) * 1.50
-            else: # Fallback for other OpenAI models
-                input_price_val = (input_tokens / 1_000_000) * 1.00 
-                output_price_val = (output_tokens / 1_000_000) * 3.00
-            
-            effective_total_tokens = total_tokens if total_tokens is not None else input_tokens + output_tokens
-            model_info_str = dedent(f"""
-              **openai usage ({model_name_used})**:
-                - input_tokens: {input_tokens} (price: ${input_price_val:.6f})
-                - output_tokens: {output_tokens} (price: ${output_price_val:.6f})
-                - total_tokens: {effective_total_tokens}
-            """).strip()
-        elif "claude" in model_name_lower:
-            if "sonnet" in model_name_lower: # Claude 3/3.5/3.7 Sonnet
-                input_price_val = (input_tokens / 1_000_000) * 3.00
-                output_price_val = (output_tokens / 1_000_000) * 15.00
-            elif "haiku" in model_name_lower: # Claude 3 Haiku
-                input_price_val = (input_tokens / 1_000_000) * 0.25
-                output_price_val = (output_tokens / 1_000_000) * 1.25
-            elif "opus" in model_name_lower: # Claude 3 Opus
-                input_price_val = (input_tokens / 1_000_000) * 15.00
-                output_price_val = (output_tokens / 1_000_000) * 75.00
-            else: # Fallback for other Claude models
-                input_price_val = (input_tokens / 1_000_000) * 3.00
-                output_price_val = (output_tokens / 1_000_000) * 15.00
-            model_info_str = dedent(f"""
-              **claude usage ({model_name_used})**:
-                - input_tokens: {input_tokens} (price: ${input_price_val:.6f})
-                - output_tokens: {output_tokens} (price: ${output_price_val:.6f})
-            """).strip()
-        else:
-            effective_total_tokens = total_tokens if total_tokens is not None else input_tokens + output_tokens
-            model_info_str = dedent(f"""
-              **Unknown model usage ({model_name_used})**:
-                - input_tokens: {input_tokens}
-                - output_tokens: {output_tokens}
-                - total_tokens: {effective_total_tokens}
-            """).strip()
-
-        return model_info_str
+    def _calculate_pricing(self, model_name_used: str, input_tokens: int, output_tokens: int, total_tokens: int = None,
+                           token_details: dict = None):
+        # Prices come from pricing.json (see pricing.py); a model missing from it is reported as unpriced
+        effective_total_tokens = total_tokens if total_tokens is not None else input_tokens + output_tokens
+
+        cost = compute_cost(model_name_used, input_tokens, output_tokens, token_details)
+        if not cost.priced:
+            lines = [f"**Unpriced model ({model_name_used})**: no entry in pricing.json (version {pricing_version()})"]
+            lines += [f"  - {PRICE_BUCKET_LABELS[bucket]}: {tokens}" for bucket, tokens in cost.buckets.items()
+                      if tokens or bucket in ("input", "output")]
+            lines += self._prompt_cache_lines(cost.buckets)
+            lines.append(f"  - total_tokens: {effective_total_tokens}")
+            return "\n".join(lines)
+
+        family = next((name for name in ("gemini", "claude") if cost.matched_prefix.startswith(name)), "openai")
+        lines = [f"**{family} usage ({model_name_used})**:"]
+        for bucket, tokens in cost.buckets.items():
+            if tokens or bucket in ("input", "output"):
+                lines.append(f"  - {PRICE_BUCKET_LABELS[bucket]}: {tokens} (price: ${cost.costs[bucket]:.6f})")
+        lines += self._prompt_cache_lines(cost.buckets)
+        lines.append(f"  - total_tokens: {effective_total_tokens}")
+        lines.append(f"  - total cost: ${cost.total:.6f} (pricing.json {pricing_version()}, matched '{cost.matched_prefix}')")
+        return "\n".join(lines)
+
+    def _prompt_cache_lines(self, buckets: dict):
+        """How much of the prompt the provider served from its prompt cache (see prompt_cache.py)."""
+        if not buckets["cached_input"] and not buckets["cache_write"]:
+            return []
+        prompt_tokens = buckets["input"] + buckets["cached_input"] + buckets["cache_write"] + buckets["audio_input"]
+        line = f"  - prompt cache: {buckets['cached_input']} of {prompt_tokens} prompt tokens read from cache ({buckets['cached_input'] / prompt_tokens:.0%})"
+        if buckets["cache_write"]:
+            line += f", {buckets['cache_write']} written to it"
+        return [line]
+
+    def _response_tokens(self, llm_response_obj):
+        """(input_tokens, output_tokens, token_details) reported for a response."""
+        # Set on the response by the plugin (Response.set_usage) once it is done; also on CachedResponse
+        # and PartialResponse (estimated).
+        input_tokens = getattr(llm_response_obj, 'input_tokens', None) or 0
+        output_tokens = getattr(llm_response_obj, 'output_tokens', None) or 0
+        return input_tokens, output_tokens, getattr(llm_response_obj, 'token_details', None)
+
+    def _save_logs(self, mode: str, llm_response_obj: "llm.Response", prompt_text_with_system: str, full_response_text: str,
+                   token_plan=None, variant: str = None, response_file=None, latency: float = None):
+        # variant (a model slug in fan-out runs) keeps several models' files apart: output.<variant>.md etc.
+        # response_file: output.md already written by a StreamSink; it is left as is and copied into the log.
+        # The run's history goes to the log store (log_store.py); output.md and last-log.md are views of the newest run.
+        model_name_actually_used = "<model-name-missing>" # TODO FIXME should take this from selected model instead
+        if hasattr(llm_response_obj, 'model'):
+            model_name_actually_used = llm_response_obj.model.model_id
+        logged_model = None if model_name_actually_used == "<model-name-missing>" else model_name_actually_used
+        created_at = datetime.now().timestamp()
+        # Usage is recorded before anything else can fail, so the budget counts the call even when the logs aren't written
+        usage_row = self._record_usage(mode, logged_model, llm_response_obj, latency=latency, variant=variant, created_at=created_at)
 
-    def _save_logs(self, mode: str, llm_response_obj: llm.Response, prompt_text_with_system: str, full_response_text: str):
         mode_folder = self.base_folder / mode
-        log_folder = mode_folder / "log"
-        log_folder.mkdir(parents=True, exist_ok=True)
+        mode_folder.mkdir(parents=True, exist_ok=True)
 
-        timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-        log_file = log_folder / f"{timestamp}.md"
-        last_log_file = mode_folder / "last-log.md"
-        output_file = mode_folder / "output.md"
+        suffix = f".{variant}" if variant else ""
+        last_log_file = mode_folder / f"last-log{suffix}.md"
+        output_file = mode_folder / f"output{suffix}.md"
 
         llm_internal_id = "<No ID Found>"
         if hasattr(llm_response_obj, 'id'):
             llm_internal_id = llm_response_obj.id
-        model_name_actually_used = "<model-name-missing>" # TODO FIXME should take this from selected model instead
-        if hasattr(llm_response_obj, 'model'):
-            model_name_actually_used = llm_response_obj.model.model_id
         
         api_response_json = {}
         if hasattr(llm_response_obj, 'json') and callable(llm_response_obj.json):
@@ -276,25 +497,28 @@ class LLMRunner:
         api_specific_response_id = api_response_json.get('id', "N/A")
         object_type = api_response_json.get('object', "N/A")
 
-        input_tokens = 0
-        output_tokens = 0
-        if hasattr(llm_response_obj, 'usage'):
-            input_tokens = getattr(llm_response_obj.usage, 'prompt_tokens', 0) or 0
-            output_tokens = getattr(llm_response_obj.usage, 'completion_tokens', 0) or 0
-        
+        input_tokens, output_tokens, token_details = self._response_tokens(llm_response_obj)
+
         total_tokens_from_api = None
         if 'usage' in api_response_json and isinstance(api_response_json.get('usage'), dict):
             total_tokens_from_api = api_response_json['usage'].get('total_tokens')
         pricing_info_str = "<didn't manage to get price>"
         if model_name_actually_used != "<model-name-missing>":
             try:
-                pricing_info_str = self._calculate_pricing(model_name_actually_used, input_tokens, output_tokens, total_tokens_from_api)
+                pricing_info_str = self._calculate_pricing(model_name_actually_used, input_tokens, output_tokens, total_tokens_from_api,
+                                                           token_details)
             except Exception as err:
                 print(f"▶️"*16, f"Didn't managed to get prices info")
                 pricing_info_str = "<Didn't managed to get prices info>"
         
         if "openai" in model_name_actually_used.lower() and object_type != "N/A":
             pricing_info_str = f"**Object type**: {object_type}\n{pricing_info_str}"
+        if getattr(llm_response_obj, 'similarity', None) is not None:
+            pricing_info_str = f"**Similar-prompt cache hit**: reused the answer to a {llm_response_obj.similarity:.1%} similar prompt stored {llm_response_obj.cached_at()}, nothing was billed for this run\n{pricing_info_str}"
+        elif getattr(llm_response_obj, 'partial', False):
+            pricing_info_str = f"**Partial run**: usage estimated from the prompt and the partial answer (~{CHARS_PER_TOKEN} chars per token)\n{pricing_info_str}"
+        elif getattr(llm_response_obj, 'cache_hit', False):
+            pricing_info_str = f"**Response cache hit**: answer stored {llm_response_obj.cached_at()}, nothing was billed for this run\n{pricing_info_str}"
 
         log_content = dedent(f"""
             # llm internal id: {llm_internal_id}
@@ -305,131 +529,176 @@ class LLMRunner:
             {pricing_info_str}
         """).strip()
 
-        log_content += "\n\n" + dedent(f"""
-            # Input:
-            {prompt_text_with_system}
-        """).strip()
-
-        log_content += "\n\n" + dedent(f"""
-            # Output:
-            {full_response_text}
-        """).strip()
+        if token_plan is not None:
+            log_content += "\n\n**Token plan (estimated before sending)**:\n" + token_plan.report()
+
+        # Written piece by piece rather than as one big string: the answer is copied from the already
+        # streamed output file when there is one, so it isn't held in memory yet again.
+        with open(last_log_file, "w", encoding="utf-8") as log:
+            log.write(log_content)
+            log.write("\n\n# Input:\n")
+            log.write(prompt_text_with_system.strip())
+            log.write("\n\n# Output:\n")
+            if response_file is not None and Path(response_file) == output_file:
+                with open(response_file, encoding="utf-8") as response:
+                    shutil.copyfileobj(response, log)
+            else:
+                output_file.write_text(full_response_text, encoding='utf-8')
+                log.write(full_response_text.strip())
 
-        output_file.write_text(full_response_text, encoding='utf-8')
-        last_log_file.write_text(log_content, encoding='utf-8')
-        log_file.write_text(log_content, encoding='utf-8')
+        run_key = self._get_log_store().append_run(
+            mode, log_content, prompt_text_with_system.strip(), full_response_text,
+            model=logged_model, variant=variant, created_at=created_at,
+        )
+        try:
+            self._get_search_index().add_run(run_key, mode, logged_model, created_at, cost_from_log_header(pricing_info_str),
+                                             prompt_text_with_system, full_response_text)
+        except Exception as err: # The next --search catches up from the log store anyway
+            print(f"▶️"*16, f"Didn't manage to index the run for search. Got error: {err}")
+        if usage_row is not None:
+            try:
+                self._get_usage_ledger().set_run_key(usage_row, run_key)
+            except Exception as err:
+                print("▶️"*16, f"Didn't manage to link the usage row to the run. Got error: {err}")
+        return run_key
 
-    async def _get_response_object_from_logs(self, model_instance, full_response_text):
-        # Helper to fetch last log entry and construct a mock Response object
-        # This is a fallback for async streaming where Response object isn't directly available
+    def _record_usage(self, mode: str, model_name: str, llm_response_obj, latency: float = None, variant: str = None,
+                      run_key: str = None, created_at: float = None):
+        """Adds the call to the usage ledger; returns the row id, or None when it couldn't be recorded."""
         try:
-            logs_db = llm.get_logs_db() # type: ignore
-            # Query for the most recent response, ideally matching the model and part of the prompt if possible
-            # For simplicity, just taking the very last one. This could be fragile.
-            cursor = logs_db.execute(
-                "SELECT id, response_json, prompt_tokens, completion_tokens, model_id FROM responses ORDER BY rowid DESC LIMIT 1"
+            cache_hit = bool(getattr(llm_response_obj, 'cache_hit', False))
+            input_tokens, output_tokens, token_details = self._response_tokens(llm_response_obj)
+            cost = compute_cost(model_name or "", input_tokens, output_tokens, token_details)
+            return self._get_usage_ledger().record(
+                get_model_family(model_name) if model_name else None, model_name, mode, input_tokens, output_tokens,
+                cached_tokens=cost.buckets["cached_input"], reasoning_tokens=cost.buckets["reasoning"],
+                cost=0.0 if cache_hit else cost.total, latency=latency, cache_hit=cache_hit,
+                variant=variant, run_key=run_key, created_at=created_at, partial=getattr(llm_response_obj, 'partial', False),
             )
-            last_log_row = cursor.fetchone()
-            if last_log_row:
-                usage_obj = llm.Usage(prompt_tokens=last_log_row["prompt_tokens"], completion_tokens=last_log_row["completion_tokens"])
-                
-                class MockResponseFromLog:
-                    def __init__(self, log_id, model_inst, usage, response_json_str, text_val):
-                        self.id = log_id
-                        self.model = model_inst # The Model instance used for the call
-                        self.usage = usage
-                        self._response_json_str = response_json_str
-                        self._text = text_val
-                    
-                    def json(self):
-                        return json.loads(self._response_json_str) if self._response_json_str else {}
-                    def text(self):
-                        return self._text
-
-                return MockResponseFromLog(
-                    log_id=last_log_row["id"],
-                    model_inst=model_instance,
-                    usage=usage_obj,
-                    response_json_str=last_log_row["response_json"],
-                    text_val=full_response_text
-                )
-        except Exception as e:
-            print(f"Warning: Could not retrieve detailed logs for async stream from DB: {e}")
-        return None
-
-    async def _handle_async_stream(self, model_instance, prompt_args_dict: dict):
+        except Exception as err:
+            print("▶️"*16, f"Didn't manage to record usage. Got error: {err}")
+            return None
+
+    def check_budget(self, mode: str, model_names, prompt_text: str, token_plan=None):
+        """
+        Raises BudgetExceeded when sending `prompt_text` to every model in `model_names` would take the
+        day's spend of `mode` over its budget. Input is estimated by the token plan (chars/4 without one),
+        output by the mode's recent answers on that model (the reserved output without history).
+        """
+        if self.ignore_budget:
+            return
+        ledger = self._get_usage_ledger()
+        if ledger.budget(mode) is None:
+            return
+        input_estimate = token_plan.total_tokens if token_plan is not None else (len(prompt_text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+        estimate = 0.0
+        for model_name in model_names:
+            output_estimate = ledger.average_output_tokens(mode, model_name)
+            if output_estimate is None:
+                output_estimate = token_plan.reserved_output if token_plan is not None else DEFAULT_RESERVED_OUTPUT_TOKENS
+            estimate += compute_cost(model_name, input_estimate, int(output_estimate)).total or 0.0
+        ledger.check_budget(mode, estimate)
+
+    async def _handle_async_stream(self, model_instance, prompt_args_dict: dict, on_chunk=None, sink=None):
+        # on_chunk replaces printing to the terminal (batch and fan-out runs route chunks elsewhere)
+        # With a sink (StreamSink) chunks go straight to output.md and the text is read back once at the end.
         response_chunks = []
-        # The prompt() method itself is an async generator here
-        async_prompt_gen = model_instance.prompt(**prompt_args_dict)
+        async_prompt_gen = model_instance.prompt(**prompt_args_dict) # AsyncResponse, iterated for its chunks
         async for chunk in async_prompt_gen:
-            print(str(chunk), end="", flush=True)
-            response_chunks.append(str(chunk))
-        print() 
-        full_response_text = "".join(response_chunks)
-        # XXX Disabled for now. Since don't work
-        #  llm_response_obj = await self._get_response_object_from_logs(model_instance, full_response_text)
-        llm_response_obj = {}
+            self._profile_mark("first byte")
+            if on_chunk is not None:
+                on_chunk(str(chunk))
+            else:
+                print(str(chunk), end="", flush=True)
+            if sink is not None:
+                sink.write(str(chunk))
+            else:
+                response_chunks.append(str(chunk))
+        if on_chunk is None:
+            print()
+        if sink is not None:
+            sink.close()
+            full_response_text = sink.getvalue()
+        else:
+            full_response_text = "".join(response_chunks)
+        # The finished AsyncResponse holds the usage, id and raw JSON of this very call; converting it gives
+        # _save_logs the same sync interface (json(), usage(), ...) as the MODEL_* paths.
+        llm_response_obj = await async_prompt_gen.to_sync_response()
         return full_response_text, llm_response_obj
 
-    async def _handle_async_non_stream(self, model_instance, prompt_args_dict: dict):
+    async def _handle_async_non_stream(self, model_instance, prompt_args_dict: dict, on_chunk=None):
         async_response_obj = await model_instance.prompt(**prompt_args_dict) # This is an AsyncResponse
         
         full_response_text = await async_response_obj.text()
-        print(full_response_text)
-        usage_info = await async_response_obj.usage()
-        
-        # Wrap AsyncResponse to behave like a sync Response for logging
-        class SyncedResponseWrapper:
-            def __init__(self, async_resp, text_val, usage_val):
-                self.id = async_resp.id
-                self.model = async_resp.model # This is the Model instance
-                self.usage = usage_val
-                self._async_response = async_resp 
-                self._text = text_val
-            
-            def json(self): # Attempt to get .response_json if available
-                if hasattr(self._async_response, 'response_json') and self._async_response.response_json:
-                    return self._async_response.response_json
-                # Fallback: try to get it from logs if not directly on async_response
-                # This part is complex as AsyncResponse might not store it directly.
-                # For now, we rely on what AsyncResponse provides or what _get_response_object_from_logs might do.
-                # The _save_logs method will try .json() and handle failure.
-                print("Warning: .json() on SyncedResponseWrapper might be incomplete for async non-stream if not directly on AsyncResponse.")
-                return {} # Or try to fetch from logs like in _get_response_object_from_logs
-
-            def text(self):
-                return self._text
-
-        return full_response_text, SyncedResponseWrapper(async_response_obj, full_response_text, usage_info)
+        self._profile_mark("first byte")
+        if on_chunk is not None:
+            on_chunk(full_response_text)
+        else:
+            print(full_response_text)
+        return full_response_text, await async_response_obj.to_sync_response()
+
+    def _get_log_store(self) -> LogStore:
+        if self.log_store is None:
+            self.log_store = LogStore(self.base_folder / LOG_STORE_DIR_NAME)
+        return self.log_store
+
+    def _get_usage_ledger(self) -> UsageLedger:
+        if self.usage_ledger is None:
+            self.usage_ledger = UsageLedger(self.base_folder / USAGE_LEDGER_FILE_NAME)
+        return self.usage_ledger
+
+    def _get_search_index(self) -> SearchIndex:
+        if self.search_index is None:
+            self.search_index = SearchIndex(self.base_folder / SEARCH_INDEX_FILE_NAME)
+        return self.search_index
+
+    def _get_model_instance(self, model_name: str, is_async: bool):
+        """Resolved model instances are kept, so repeated runs in one process skip the plugin lookup."""
+        cache_key = (model_name, is_async)
+        if cache_key not in self._model_instances:
+            import llm
+
+            with profile_phase(self.profile, "model lookup"):
+                self._model_instances[cache_key] = llm.get_async_model(model_name) if is_async else llm.get_model(model_name)
+            if get_model_family(model_name) == "claude":
+                place_prefix_breakpoint(self._model_instances[cache_key])
+        return self._model_instances[cache_key]
+
+    def _format_prompt_for_log(self, prompt_text: str, system_prompt_text: str = None) -> str:
+        if system_prompt_text:
+            return dedent(f"""
+                System:
+                {system_prompt_text}
+                User:
+                {prompt_text}
+            """).strip()
+        return dedent(f"{prompt_text}")
 
-    def _run_model(self, model_name: str, model_type: str, execution_type: LLMExecutionType, 
-                   prompt_text: str, mode_for_logging: str = None, **kwargs):
-        current_mode = mode_for_logging if mode_for_logging is not None else self.default_mode
-        
+    def _build_prompt_args(self, model_name: str, model_type: str, prompt_text: str, kwargs: dict):
+        """
+        Turns run_* keyword arguments into llm prompt() arguments. Consumes `kwargs`.
+        Returns (prompt_args, full_prompt_for_log), or (None, None) when a required API key is missing.
+        """
         api_key_to_use = kwargs.pop('key', self._get_api_key(model_type))
-        if not api_key_to_use and not llm.get_model(model_name).needs_key == False: # Check if model actually needs a key
+        if not api_key_to_use and not self._get_model_instance(model_name, False).needs_key == False: # Check if model actually needs a key
             print(f"API key for {model_type} ({model_name}) is missing and model requires a key. Aborting.")
             return None, None
 
-        is_async = execution_type in [LLMExecutionType.ASYNC_MODEL_STREAM, LLMExecutionType.ASYNC_MODEL_NON_STREAM]
-        
-        model_instance = llm.get_model(model_name) if not is_async else llm.get_async_model(model_name)
-
         prompt_args = {"prompt": prompt_text}
         if api_key_to_use: # Only add key if it's available
              prompt_args["key"] = api_key_to_use
         
-        system_prompt_text = kwargs.get("system")
-        if system_prompt_text:
-            full_prompt_for_log = dedent(f"""
-                System:
-                {system_prompt_text}
-                User:
-                {prompt_text}
-            """).strip()
-        else:
-            full_prompt_for_log = dedent(f"{prompt_text}")
-
+        full_prompt_for_log = self._format_prompt_for_log(prompt_text, kwargs.get("system"))
+
+        # Anthropic caches only up to a breakpoint: send the stable prefix as a fragment and mark its end (see prompt_cache.py).
+        # OpenAI and Gemini cache the prefix of the single prompt text on their own.
+        stable_prefix_chars = kwargs.pop('stable_prefix_chars', None)
+        if model_type == "claude" and "cache" not in kwargs and supports_cache_option(self._get_model_instance(model_name, False)):
+            split = split_stable_prefix(prompt_text, stable_prefix_chars)
+            if split is not None:
+                prompt_args["fragments"] = [split[0]]
+                prompt_args["prompt"] = split[1]
+                prompt_args["cache"] = True
 
         # Common params from kwargs
         common_llm_params = ["system", "temperature", "attachments", "conversation", "max_output_tokens", "top_p", "top_k", "schema"]
@@ -446,6 +715,123 @@ class LLMRunner:
                  del prompt_args["max_output_tokens"] # Prefer explicit max_tokens for Claude
 
         prompt_args.update(kwargs) # Add remaining specific args like thinking, json_object, etc.
+        return prompt_args, full_prompt_for_log
+
+    async def _execute_async(self, model_name: str, model_type: str, execution_type: LLMExecutionType,
+                             prompt_text: str, on_chunk=None, mode: str = None, output_file=None, variant: str = None, **kwargs):
+        """
+        Runs one prompt on an ASYNC_MODEL_* path without printing a header or saving logs; the caller
+        owns the output (see batch.py and fanout.py). Returns (full_response_text, llm_response_obj).
+        A stream is written through a StreamSink to `output_file` and checkpointed like in _run_model, so a
+        call interrupted or failed midway keeps its partial answer (logs, usage ledger, --resume).
+        """
+        token_plan = kwargs.pop('token_plan', None)
+        model_type = model_type or get_model_family(model_name)
+        prompt_args, full_prompt_for_log = self._build_prompt_args(model_name, model_type, prompt_text, kwargs)
+        if prompt_args is None:
+            raise RuntimeError(f"API key for {model_type} ({model_name}) is missing.")
+        model_instance = self._get_model_instance(model_name, True)
+        if execution_type != LLMExecutionType.ASYNC_MODEL_STREAM:
+            return await self._handle_async_non_stream(model_instance, prompt_args, on_chunk=on_chunk)
+        if output_file is None:
+            return await self._handle_async_stream(model_instance, prompt_args, on_chunk=on_chunk)
+        mode = mode or self.default_mode
+        checkpoint = self._create_checkpoint(mode, model_name, model_type, execution_type, prompt_args, variant=variant)
+        sink = StreamSink(output_file, on_flush=checkpoint.append if checkpoint is not None else None)
+        try:
+            result = await self._handle_async_stream(model_instance, prompt_args, on_chunk=on_chunk, sink=sink)
+        except BaseException as err: # Includes the CancelledError of the other streams when one of them gets Ctrl-C
+            sink.close()
+            if checkpoint is not None:
+                self._keep_partial_run(checkpoint, err, mode, model_name, full_prompt_for_log, token_plan, output_file, variant=variant)
+            raise
+        if checkpoint is not None:
+            checkpoint.finish()
+        return result
+
+    def _create_checkpoint(self, mode: str, model_name: str, model_type: str, execution_type: LLMExecutionType, prompt_args: dict,
+                           variant: str = None):
+        """A RunCheckpoint for stream paths (the only ones with a partial answer to keep), or None."""
+        if execution_type not in (LLMExecutionType.MODEL_STREAM, LLMExecutionType.ASYNC_MODEL_STREAM):
+            return None
+        try:
+            return RunCheckpoint.create(self.base_folder / mode, mode, model_name, model_type, execution_type.name, prompt_args,
+                                        variant=variant)
+        except Exception as err:
+            print("▶️"*16, f"Didn't manage to create a checkpoint for this run. Got error: {err}")
+            return None
+
+    def _find_similar_response(self, mode: str, context_key: str, prompt_signature: int, model_instance):
+        """Looks up the closest earlier prompt of this mode; asks before reusing its answer when run interactively."""
+        stale = set()
+        while True:
+            match = self.similar_index.lookup(mode, context_key, prompt_signature, self.similar_threshold, exclude=stale)
+            if match is None:
+                return None
+            cached_response = self.response_cache.lookup(match.fingerprint, model=model_instance)
+            if cached_response is not None:
+                break
+            self.similar_index.remove(match.fingerprint) # Answer expired or evicted from the response cache
+            stale.add(match.fingerprint)
+        cached_response.similarity = match.similarity
+        print(f"▶️"*16, f"similar prompt found: {match.similarity:.1%} similar to a run stored {cached_response.cached_at()}")
+        if sys.stdin.isatty():
+            answer = input("Reuse its answer instead of calling the provider? [Y/n] ").strip().lower()
+            if answer not in ("", "y", "yes"):
+                return None
+        return cached_response
+
+    def _cache_lookup(self, mode: str, model_name: str, prompt_args: dict, prompt_text: str, model_instance):
+        """
+        Looks the request up in the response cache (and the similar-prompt index with --similar_cache).
+        Returns (cached_response or None, cache_entry); cache_entry goes to _cache_store once the answer
+        is in, and is None when the request isn't cacheable.
+        """
+        if self.response_cache is None or "conversation" in prompt_args: # A conversation carries history we don't hash
+            return None, None
+        fingerprint = request_fingerprint(model_name, prompt_args)
+        cached_response = self.response_cache.lookup(fingerprint, model=model_instance)
+        similar_context_key = prompt_signature = None
+        if self.similar_index is not None:
+            similar_context_key = request_fingerprint(model_name, {k: v for k, v in prompt_args.items() if k not in ("prompt", "fragments")})
+            prompt_signature = prompt_simhash(prompt_text)
+        if cached_response is None and self.similar_threshold is not None and prompt_signature is not None:
+            cached_response = self._find_similar_response(mode, similar_context_key, prompt_signature, model_instance)
+        if cached_response is not None and cached_response.similarity is None:
+            print("▶️"*16, f"{model_name}: response cache hit (stored {cached_response.cached_at()}); use --no_cache to send the request again")
+        return cached_response, (fingerprint, similar_context_key, prompt_signature)
+
+    def _cache_store(self, cache_entry, mode: str, model_name: str, full_response_text: str, llm_response_obj):
+        if cache_entry is None or not full_response_text:
+            return
+        fingerprint, similar_context_key, prompt_signature = cache_entry
+        try:
+            self.response_cache.store(fingerprint, model_name, full_response_text, llm_response_obj)
+            if prompt_signature is not None:
+                self.similar_index.add(fingerprint, mode, similar_context_key, prompt_signature)
+        except Exception as err:
+            print("▶️"*16, f"Didn't manage to cache the response. Got error: {err}")
+
+    def _cache_lookup_for(self, mode: str, model_name: str, prompt_text: str, kwargs: dict):
+        """_cache_lookup for a model run through _execute_async (fan-out): builds its prompt arguments from `kwargs` first."""
+        prompt_args, _ = self._build_prompt_args(model_name, get_model_family(model_name), prompt_text, dict(kwargs))
+        if prompt_args is None:
+            return None, None
+        return self._cache_lookup(mode, model_name, prompt_args, prompt_text, self._get_model_instance(model_name, True))
+
+    def _run_model(self, model_name: str, model_type: str, execution_type: LLMExecutionType, 
+                   prompt_text: str, mode_for_logging: str = None, **kwargs):
+        current_mode = mode_for_logging if mode_for_logging is not None else self.default_mode
+        token_plan = kwargs.pop('token_plan', None)
+        continued_from = kwargs.pop('continued_from', None) # Partial answer being continued (see resume_run)
+
+        prompt_args, full_prompt_for_log = self._build_prompt_args(model_name, model_type, prompt_text, kwargs)
+        if prompt_args is None:
+            return None, None
+
+        is_async = execution_type in [LLMExecutionType.ASYNC_MODEL_STREAM, LLMExecutionType.ASYNC_MODEL_NON_STREAM]
+        
+        model_instance = self._get_model_instance(model_name, is_async)
 
         full_response_text = ""
         llm_response_obj = None # This will be llm.Response or a compatible wrapper
@@ -454,47 +840,146 @@ class LLMRunner:
         if PRINTING_ARGS_INFO:
             print(f"▶️"*16, f"{model_name}; {execution_type}; ")
             for key, value in prompt_args.items():
-                if key != "prompt" and key != "key":
+                if key == "fragments":
+                    print(f"fragments: stable prompt prefix of {sum(len(f) for f in value):,} chars, cached by the provider")
+                elif key != "prompt" and key != "key":
                     print(f"{key}: {value}")
+            if token_plan is not None:
+                print(token_plan.report())
         print(f"▶️"*16, f"\n")
-        if execution_type == LLMExecutionType.MODEL_NON_STREAM:
-            llm_response_obj = model_instance.prompt(**prompt_args)
-            full_response_text = llm_response_obj.text()
+
+        cached_response, cache_entry = self._cache_lookup(current_mode, model_name, prompt_args, prompt_text, model_instance)
+        if cached_response is not None:
+            full_response_text = cached_response.text()
             print(full_response_text)
             print(f"▶️"*16, f"\n")
-        elif execution_type == LLMExecutionType.MODEL_STREAM:
-            response_chunks = []
-            stream_iterator = model_instance.prompt(**prompt_args)
-            for chunk in stream_iterator:
-                print(str(chunk), end="", flush=True)
-                response_chunks.append(str(chunk))
-            print()
-            full_response_text = "".join(response_chunks)
-            if hasattr(stream_iterator, 'response') and stream_iterator.response:
-                llm_response_obj = stream_iterator.response
-            else: # Fallback for streams that don't set .response
-                print("[Note: .response attribute not found on stream iterator, attempting to fetch last log for details.]")
-                # This needs to be async if _get_response_object_from_logs is async
-                # For sync stream, we'd need a sync version or accept limitation.
-                # For now, let's assume _get_response_object_from_logs can be called carefully or adapted.
-                # Simplified: run a sync version of log fetching if possible or accept limited logging.
-                # For this path, we'll try a simplified sync fetch if possible, or log without full details.
-
-                # Disabled ....
-                #  llm_response_obj = asyncio.run(self._get_response_object_from_logs(model_instance, full_response_text))
-                llm_response_obj = {}
-
-        elif execution_type == LLMExecutionType.ASYNC_MODEL_NON_STREAM:
-            full_response_text, llm_response_obj = asyncio.run(self._handle_async_non_stream(model_instance, prompt_args))
-        elif execution_type == LLMExecutionType.ASYNC_MODEL_STREAM:
-            full_response_text, llm_response_obj = asyncio.run(self._handle_async_stream(model_instance, prompt_args))
+            try:
+                self._save_logs(current_mode, cached_response, full_prompt_for_log, full_response_text, token_plan=token_plan)
+            except Exception as err:
+                print(f"▶️"*16, f"Didn't manage to save logs. Got error: {err}")
+            return full_response_text, cached_response
+
+        try:
+            self.check_budget(current_mode, [model_name], prompt_text, token_plan)
+        except BudgetExceeded as err:
+            print(f"Error: {err}", file=sys.stderr)
+            return None, None
+
+        output_file = self.base_folder / current_mode / "output.md" # Stream paths write it as tokens arrive
+        response_file = None
+        checkpoint = self._create_checkpoint(current_mode, model_name, model_type, execution_type, prompt_args)
+        on_flush = checkpoint.append if checkpoint is not None else None
+        if is_async:
+            import asyncio
+        started = time.monotonic()
+        try:
+            if execution_type == LLMExecutionType.MODEL_NON_STREAM:
+                llm_response_obj = model_instance.prompt(**prompt_args)
+                full_response_text = (continued_from or "") + llm_response_obj.text()
+                self._profile_mark("first byte")
+                print(full_response_text)
+                print(f"▶️"*16, f"\n")
+            elif execution_type == LLMExecutionType.MODEL_STREAM:
+                response_file = output_file
+                stream_iterator = model_instance.prompt(**prompt_args)
+                with StreamSink(output_file, socket_path=self.stream_socket_path, on_flush=on_flush) as sink:
+                    if continued_from:
+                        print(continued_from, end="", flush=True)
+                        sink.write(continued_from)
+                    for chunk in stream_iterator:
+                        self._profile_mark("first byte")
+                        print(str(chunk), end="", flush=True)
+                        sink.write(str(chunk))
+                print()
+                full_response_text = sink.getvalue()
+                llm_response_obj = stream_iterator # The exhausted Response carries usage, id and raw JSON
+            elif execution_type == LLMExecutionType.ASYNC_MODEL_NON_STREAM:
+                full_response_text, llm_response_obj = asyncio.run(self._handle_async_non_stream(model_instance, prompt_args))
+                full_response_text = (continued_from or "") + full_response_text
+            elif execution_type == LLMExecutionType.ASYNC_MODEL_STREAM:
+                response_file = output_file
+                sink = StreamSink(output_file, socket_path=self.stream_socket_path, on_flush=on_flush)
+                try:
+                    if continued_from:
+                        print(continued_from, end="", flush=True)
+                        sink.write(continued_from)
+                    full_response_text, llm_response_obj = asyncio.run(self._handle_async_stream(model_instance, prompt_args, sink=sink))
+                finally:
+                    sink.close()
+        except BaseException as err: # Ctrl-C, SIGHUP from a closed terminal (see __main__), API errors, ...
+            if checkpoint is not None:
+                self._keep_partial_run(checkpoint, err, current_mode, model_name, full_prompt_for_log, token_plan, response_file)
+            raise
+        latency = time.monotonic() - started
+        self._profile_mark("answer complete")
+        self._cache_store(cache_entry, current_mode, model_name, full_response_text, llm_response_obj)
         try: 
-            self._save_logs(current_mode, llm_response_obj, full_prompt_for_log, full_response_text)
+            with profile_phase(self.profile, "log save"):
+                self._save_logs(current_mode, llm_response_obj, full_prompt_for_log, full_response_text, token_plan=token_plan,
+                                response_file=response_file, latency=latency)
         except Exception as err:
             print(f"▶️"*16, f"\n")
             print(f"▶️"*16, f"Didn't manage to save logs. Got error: {err}")
+        if checkpoint is not None:
+            checkpoint.finish()
         return full_response_text, llm_response_obj
 
+    def _keep_partial_run(self, checkpoint, err, mode: str, model_name: str, full_prompt_for_log: str, token_plan, response_file,
+                          variant: str = None):
+        """
+        Saves what was received before `err` to output.md / the logs and keeps the checkpoint for --resume.
+        The streamed tokens were paid for, so the run goes into the usage ledger with estimated usage.
+        """
+        import asyncio
+
+        # CancelledError: a fan-out or batch stream stopped because another one got the Ctrl-C
+        status = "interrupted" if isinstance(err, (KeyboardInterrupt, SystemExit, asyncio.CancelledError)) else "failed"
+        try:
+            checkpoint.mark(status, error=f"{type(err).__name__}: {err}")
+            partial_text = checkpoint.answer_text()
+            if partial_text:
+                input_tokens = token_plan.total_tokens if token_plan is not None else (len(full_prompt_for_log) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+                output_tokens = (len(partial_text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+                self._save_logs(mode, PartialResponse(model_name, input_tokens, output_tokens), full_prompt_for_log, partial_text,
+                                token_plan=token_plan, variant=variant, response_file=response_file)
+            print(f"\n{'▶️'*16} Run {status} after {len(partial_text):,} chars; the partial answer was saved. "
+                  f"Continue it with: --resume {checkpoint.run_id} (list partial runs with --resume_log)", file=sys.stderr)
+        except Exception as save_err: # The terminal may be gone already; the checkpoint is what matters
+            try:
+                print(f"Didn't manage to save the partial run. Got error: {save_err}", file=sys.stderr)
+            except Exception:
+                pass
+
+    def resume_run(self, checkpoint: RunCheckpoint):
+        """
+        Sends an interrupted run again. For claude the partial answer is sent as prefill, so the model
+        continues where it stopped; other providers regenerate the answer from scratch.
+        """
+        meta = checkpoint.meta
+        model_type = meta["model_type"]
+        kwargs = dict(meta["options"])
+        attachments = checkpoint.build_attachments()
+        if attachments:
+            kwargs["attachments"] = attachments
+        partial_text = checkpoint.answer_text()
+        continued_from = None
+        if partial_text.strip() and model_type == "claude":
+            continued_from = partial_text.rstrip() # The API rejects a prefill ending in whitespace
+            hidden_prefill = kwargs.get("prefill") if kwargs.get("hide_prefill") else ""
+            kwargs["prefill"] = (hidden_prefill or "") + continued_from
+            kwargs["hide_prefill"] = True
+            if kwargs.pop("thinking", None): # Extended thinking can't be combined with a prefilled answer
+                kwargs.pop("thinking_budget", None)
+                print(f"▶️"*16, f"thinking disabled for the continuation")
+            print(f"▶️"*16, f"continuing {checkpoint.run_id} from {len(continued_from):,} chars (sent as prefill)")
+        elif partial_text.strip():
+            print(f"▶️"*16, f"{model_type} can't continue a partial answer; sending the prompt of {checkpoint.run_id} again")
+        result = self._run_model(meta["model_name"], model_type, LLMExecutionType[meta["execution_type"]],
+                                 checkpoint.prompt_text(), mode_for_logging=meta["mode"], continued_from=continued_from, **kwargs)
+        if result[0] is not None:
+            checkpoint.finish()
+        return result
+
     def run_openai(self, model_name: str, execution_type: LLMExecutionType, prompt: str, mode: str = None,
                    system: str = None, temperature: float = None, attachments: list = None, conversation = None,
                    max_output_tokens: int = None, top_p: float = None, schema: dict = None, key: str = None, **kwargs):
@@ -540,41 +1025,32 @@ class LLMRunner:
         return self._run_model(model_name=model_name, model_type="claude", execution_type=execution_type,
                                prompt_text=prompt, mode_for_logging=mode, **run_args)
 
-runner = LLMRunner(default_mode="general_tests")
-simple_prompt = "Tell me a very short joke."
-
-system_prompt="You must be concise"
-
-prompt_for_json_request = dedent("""
-    Describe a dog with its name, age, breed, and one defining personality trait.
-""").strip()
-
-system_prompt_for_json_request = dedent("""
-    You are a helpful assistant specialized in providing information about pets.
-""").strip()
 
-
-json_schema = {
-    "properties": {
-        "name": {"title": "Name", "type": "string", "description": "The name of the dog"},
-        "age": {"title": "Age", "type": "integer", "description": "The age of the dog in years"},
-        "breed": {"title": "Breed", "type": "string", "description": "The breed of the dog"},
-        "personality": {"title": "Personality", "type": "string", "description": "A dominant personality trait of the dog"}
-    },
-    "required": ["name", "age", "breed", "personality"],
-    "title": "Dog",
-    "type": "object"
-}
-
-if __name__ == "__main__":
+def main(argv=None, runner=None):
+    """The llmr CLI. The daemon (llmr_daemon.py) calls it with a client's argv and its pre-warmed runner."""
+    profile = StartupProfile()
     parser = argparse.ArgumentParser(description="LLM Runner CLI")    
 
     # Required arguments from Bash script
-    parser.add_argument("--model_provider", required=True, choices=["openai", "gemini", "claude"], help="The model provider.")
-    parser.add_argument("--model_name", required=True, help="The specific model name.")
-    parser.add_argument("--execution_type", required=True, choices=[e.name for e in LLMExecutionType], help="The execution type for the LLM.")
+    # Required unless --batch is given (batch records carry their own provider and model)
+    parser.add_argument("--model_provider", choices=["openai", "gemini", "claude"], help="The model provider.")
+    parser.add_argument("--model_name", help="The specific model name.")
+    parser.add_argument("--execution_type", choices=[e.name for e in LLMExecutionType], help="The execution type for the LLM.")
     parser.add_argument("--mode", help="Mode for logging purposes.")
 
+    # Batch mode
+    parser.add_argument("--batch", help="JSONL file of {provider, model, prompt, system, schema, ...} records to run concurrently.")
+    parser.add_argument("--batch_output", help="Output JSONL (default: <batch>.out.jsonl). Rows already completed in it are skipped.")
+    parser.add_argument("--batch_concurrency", type=int, default=DEFAULT_BATCH_CONCURRENCY, help="How many batch records run at once.")
+
+    # Fan-out: same prompt to several models at once (ASYNC_MODEL_STREAM); --model_name still picks attachment handling
+    parser.add_argument("--fanout", type=lambda x: [m.strip() for m in x.split(",") if m.strip()], help="Comma separated model names to send the prompt to concurrently.")
+
+    # Prompt assembly (otherwise the prompt is read from stdin)
+    parser.add_argument("--assemble_prompt", action="store_true", help="Build the prompt from the mode folder's instructions.md and task.md plus --context_files.")
+    parser.add_argument("--task_file", help="Use this file as the task instead of the mode folder's task.md.")
+    parser.add_argument("--context_files", nargs='+', default=[], help="Files or directories to include in <context>.")
+
     # Optional arguments (common and model-specific)
     parser.add_argument("--system", help="System prompt or instruction.")
     parser.add_argument("--temperature", type=float, help="Sampling temperature.")
@@ -596,6 +1072,52 @@ if __name__ == "__main__":
     parser.add_argument("--prefill", help="Prefill text for the model (Claude specific).")
     parser.add_argument("--hide_prefill", action="store_true", help="Hide prefill text from output (Claude specific).")
     parser.add_argument("--stop_sequences", nargs='+', help="List of stop sequences (Claude specific).")
+
+    # Attachments
+    parser.add_argument("--http_cache_ttl", type=float, help="Seconds a cached URL attachment is used without revalidating it (default: always revalidate).")
+    parser.add_argument("--no_http_cache", action="store_true", help="Don't use the on-disk cache for URL attachments.")
+    parser.add_argument("--website_max_bytes", type=int, default=WEBSITE_MAX_BYTES, help="Stop reading a website after this many bytes of HTML.")
+    parser.add_argument("--website_max_tokens", type=int, default=WEBSITE_MAX_TOKENS, help="Stop extracting a website's text after about this many tokens.")
+    parser.add_argument("--no_attachment_cache", action="store_true", help="Hash and base64-encode local attachments again instead of reusing the cached forms.")
+    parser.add_argument("--no_convert", action="store_true", help="Skip local attachments of types the model doesn't accept instead of converting them to text (HTML, DOCX, PPTX, CSV, PDF, ...).")
+    parser.add_argument("--no_dedup", action="store_true", help="Send duplicate context files, attachments and website texts as they are.")
+    parser.add_argument("--website_main_content", action="store_true", help="Keep only the main article text of websites (drops navigation, footers, sidebars, ...).")
+
+    # Interrupted runs
+    parser.add_argument("--resume_log", "--resume-log", dest="resume_log", action="store_true", help="List interrupted runs (of --mode, or of every mode) and exit.")
+    parser.add_argument("--resume", metavar="RUN_ID", help="Continue an interrupted run listed by --resume_log.")
+
+    # Run history (log store)
+    parser.add_argument("--list_logs", action="store_true", help="List the latest logged runs (of --mode, or of every mode) and exit.")
+    parser.add_argument("--show_log", metavar="RUN_KEY", help="Print the log of a run listed by --list_logs and exit.")
+    parser.add_argument("--compact_logs", action="store_true", help="Roll the old markdown files of <mode>/log/ into the log store's monthly segments and exit.")
+    parser.add_argument("--search", metavar="QUERY", help="Full-text search (FTS5 syntax) over prompts and outputs of past runs and exit.")
+    parser.add_argument("--search_limit", type=int, default=DEFAULT_SEARCH_LIMIT, help="Maximum number of --search hits.")
+    parser.add_argument("--compact_older_than_days", type=float, default=0, help="With --compact_logs, only roll files older than this.")
+
+    # Usage ledger and budgets
+    parser.add_argument("--usage", action="store_true", help="Print token and cost totals from the usage ledger (of --mode, or of every mode) and exit.")
+    parser.add_argument("--usage_by", default="day", help=f"Comma separated grouping for --usage, from: {', '.join(USAGE_GROUPS)}.")
+    parser.add_argument("--usage_days", type=int, default=7, help="Days covered by --usage (today included).")
+    parser.add_argument("--set_budget", nargs=2, metavar=("MODE", "USD"), help="Set the daily budget of a mode (0 removes it) and exit.")
+    parser.add_argument("--ignore_budget", action="store_true", help="Send the request even if it goes over the mode's daily budget.")
+
+    # Daemon (llmr_daemon.py); llmr_client.py starts it on demand
+    parser.add_argument("--daemon", action="store_true", help="Serve llmr_client.py requests over a Unix socket from a process with llm, its plugins and the default models pre-imported (each job is forked from it).")
+    parser.add_argument("--daemon_socket", help="Socket path of --daemon (default: <base folder>/.daemon.sock).")
+    parser.add_argument("--daemon_idle_timeout", type=float, default=DAEMON_IDLE_TIMEOUT_SECONDS, help="Seconds without jobs after which --daemon exits (0: never).")
+
+    # Diagnostics
+    parser.add_argument("--profile_startup", "--profile-startup", dest="profile_startup", action="store_true", help="Print an import and phase timing breakdown (argument parsing, attachments, model lookup, first byte, log save) to stderr at exit.")
+
+    # Streaming
+    parser.add_argument("--stream_socket", help="Unix socket path that editors can tail; streamed output is sent there as it is written to output.md.")
+
+    # Response cache
+    parser.add_argument("--no_cache", "--no-cache", dest="no_cache", action="store_true", help="Always send the request, ignoring (and not filling) the response cache.")
+    parser.add_argument("--cache_ttl", type=float, default=RESPONSE_CACHE_TTL_SECONDS, help="Seconds a cached response can be reused.")
+    parser.add_argument("--similar_cache", "--similar-cache", dest="similar_cache", action="store_true", help="Also offer the answer of a near-duplicate earlier prompt of the same mode (SimHash).")
+    parser.add_argument("--similar_threshold", type=float, default=DEFAULT_SIMILARITY_THRESHOLD, help="Minimum prompt similarity (0-1) for --similar_cache.")
     
     claude_only_args = [
         "thinking", "thinking_budget", "prefill", "hide_prefill", "stop_sequences"
@@ -612,13 +1134,123 @@ if __name__ == "__main__":
     # However, for this implementation, we explicitly define all known args.
     # For any other args passed via named_args in bash that are not defined here, they will cause an error.
     # This is generally safer.
-    parsed_args = parser.parse_args()
+    parsed_args = parser.parse_args(argv)
+    profile.add_phase("argument parsing", time.perf_counter() - profile.started)
+
+    if parsed_args.daemon:
+        from llmr_daemon import run_daemon
+        run_daemon(main, runner or LLMRunner(), socket_path=parsed_args.daemon_socket,
+                   idle_timeout=parsed_args.daemon_idle_timeout)
+        sys.exit(0)
+
+    if runner is None:
+        runner = LLMRunner() # Uses default base_folder
+
+    def _raise_keyboard_interrupt(signum, frame):
+        raise KeyboardInterrupt(signal.Signals(signum).name)
+    # Closing the terminal (SIGHUP) or a kill (SIGTERM) unwinds like Ctrl-C, so the partial answer is checkpointed
+    signal.signal(signal.SIGHUP, _raise_keyboard_interrupt)
+    signal.signal(signal.SIGTERM, _raise_keyboard_interrupt)
+
+    runner.ignore_budget = parsed_args.ignore_budget
+    if parsed_args.profile_startup:
+        runner.profile = profile
+        atexit.register(lambda: print(profile.report(), file=sys.stderr))
+    if parsed_args.usage or parsed_args.set_budget:
+        usage_ledger = runner._get_usage_ledger()
+        if parsed_args.set_budget:
+            budget_mode, budget_usd = parsed_args.set_budget
+            try:
+                usage_ledger.set_budget(budget_mode, float(budget_usd))
+            except ValueError:
+                parser.error(f"--set_budget expects an amount in USD, got '{budget_usd}'")
+        else:
+            group_by = [column.strip() for column in parsed_args.usage_by.split(",") if column.strip()]
+            try:
+                rows = usage_ledger.summary(group_by, days=parsed_args.usage_days, mode=parsed_args.mode)
+            except ValueError as e:
+                parser.error(str(e))
+            print(format_usage_summary(rows, group_by))
+        for row in usage_ledger.budgets():
+            print(f"Budget {row['mode']}: ${usage_ledger.spent(row['mode']):.4f} of ${row['daily_usd']:.2f} spent today")
+        sys.exit(0)
+    if parsed_args.list_logs or parsed_args.show_log or parsed_args.compact_logs or parsed_args.search:
+        log_store = runner._get_log_store()
+        if parsed_args.search:
+            search_index = runner._get_search_index()
+            search_index.catch_up(runner.base_folder, log_store)
+            hits = search_index.search(parsed_args.search, mode=parsed_args.mode, limit=parsed_args.search_limit)
+            for hit in hits:
+                print(hit.format())
+            if not hits:
+                print("No matching runs.")
+        elif parsed_args.compact_logs:
+            moved = log_store.compact_markdown_logs(runner.base_folder, parsed_args.mode, parsed_args.compact_older_than_days)
+            stats = log_store.stats()
+            print(f"Rolled {moved} markdown log(s) into {log_store.segment_dir}. "
+                  f"Store: {stats['runs']} runs, {stats['blocks']} blocks, {stats['raw_bytes']:,} bytes stored as {stats['stored_bytes']:,}.")
+        elif parsed_args.show_log:
+            try:
+                print(log_store.materialize(parsed_args.show_log))
+            except KeyError as e:
+                print(f"Error: {e.args[0]}", file=sys.stderr)
+                sys.exit(1)
+        else:
+            for row in log_store.list_runs(parsed_args.mode):
+                created = datetime.fromtimestamp(row["created_at"]).strftime("%Y-%m-%d %H:%M:%S")
+                print(f"{row['run_key']}  {row['mode']}  {row['model'] or '-'}  {created}" + ("  (imported)" if row["source"] == "markdown" else ""))
+        sys.exit(0)
+    if parsed_args.resume_log:
+        print(format_checkpoint_list(list_checkpoints(runner.base_folder, parsed_args.mode)))
+        sys.exit(0)
+    if parsed_args.resume:
+        checkpoint = find_checkpoint(runner.base_folder, parsed_args.resume, parsed_args.mode)
+        if checkpoint is None:
+            print(f"Error: No partial run '{parsed_args.resume}'. See --resume_log.", file=sys.stderr)
+            sys.exit(1)
+        if checkpoint.state() == "running":
+            print(f"Error: Run '{parsed_args.resume}' is still running (pid {checkpoint.meta.get('pid')}).", file=sys.stderr)
+            sys.exit(1)
+        runner.stream_socket_path = parsed_args.stream_socket
+        try:
+            runner.resume_run(checkpoint)
+        except KeyboardInterrupt:
+            sys.exit(130)
+        sys.exit(0)
 
-    prompt_text = sys.stdin.read()
-    
-    runner = LLMRunner() # Uses default base_folder
+    if parsed_args.batch:
+        batch_execution_type = LLMExecutionType[parsed_args.execution_type or "ASYNC_MODEL_NON_STREAM"]
+        try:
+            run_batch(runner, parsed_args.batch, batch_execution_type, output_path=parsed_args.batch_output,
+                      concurrency=parsed_args.batch_concurrency, default_provider=parsed_args.model_provider,
+                      default_model=parsed_args.model_name)
+        except (ValueError, BudgetExceeded) as e:
+            print(f"Error: {e}", file=sys.stderr)
+            sys.exit(1)
+        except KeyboardInterrupt:
+            sys.exit(130) # Rows that were streaming kept their partial answers (see batch.py)
+        sys.exit(0)
+    for required_arg in ("model_provider", "model_name", "execution_type"):
+        if getattr(parsed_args, required_arg) is None:
+            parser.error(f"the following arguments are required: --{required_arg}")
 
     args_dict = vars(parsed_args)
+    for batch_arg in ("batch", "batch_output", "batch_concurrency", "resume_log", "resume",
+                      "list_logs", "show_log", "compact_logs", "compact_older_than_days", "search", "search_limit",
+                      "usage", "usage_by", "usage_days", "set_budget", "ignore_budget",
+                      "daemon", "daemon_socket", "daemon_idle_timeout", "profile_startup"):
+        args_dict.pop(batch_arg)
+
+    assemble_from_mode_folder = args_dict.pop('assemble_prompt')
+    task_file = args_dict.pop('task_file')
+    context_paths = args_dict.pop('context_files')
+    prompt_buffer = None
+    with profile_phase(runner.profile, "prompt assembly"):
+        if assemble_from_mode_folder:
+            prompt_buffer = assemble_prompt(runner.base_folder / (parsed_args.mode or runner.default_mode), task_file, context_paths)
+            prompt_text = prompt_buffer.getvalue()
+        else:
+            prompt_text = sys.stdin.read()
 
     # Extract core arguments for run_* methods
     model_provider = args_dict.pop('model_provider')
@@ -626,6 +1258,32 @@ if __name__ == "__main__":
     execution_type_str = args_dict.pop('execution_type')
     mode_for_logging = args_dict.pop('mode')
     print(f"▶️"*16, f"mode_for_logging: {mode_for_logging}")
+    fanout_models = args_dict.pop('fanout')
+    # Attachment options are consumed here, not by the run_* methods
+    http_cache_ttl = args_dict.pop('http_cache_ttl')
+    use_http_cache = not args_dict.pop('no_http_cache')
+    use_attachment_cache = not args_dict.pop('no_attachment_cache')
+    use_conversion = not args_dict.pop('no_convert')
+    use_dedup = not args_dict.pop('no_dedup')
+    html_options = HtmlTextOptions(
+        max_bytes=args_dict.pop('website_max_bytes'),
+        max_tokens=args_dict.pop('website_max_tokens'),
+        main_content=args_dict.pop('website_main_content'),
+    )
+
+    runner.stream_socket_path = args_dict.pop('stream_socket')
+    use_response_cache = not args_dict.pop('no_cache')
+    response_cache_ttl = args_dict.pop('cache_ttl')
+    use_similar_cache = args_dict.pop('similar_cache')
+    similar_threshold = args_dict.pop('similar_threshold')
+    if use_response_cache:
+        runner.response_cache = ResponseCache(runner.base_folder / ".response_cache.sqlite", ttl_seconds=response_cache_ttl)
+        runner.similar_index = SimilarPromptIndex(runner.base_folder / ".response_cache.sqlite")
+        if use_similar_cache:
+            runner.similar_threshold = similar_threshold
+
+    # Fan-out models can be of any provider, so keep every option around before the provider filtering below
+    fanout_args = dict(args_dict)
 
     if model_provider == "openai":
         # remove claude ones
@@ -677,15 +1335,132 @@ if __name__ == "__main__":
 
     # Add attachments
     attachments_file = f"~/utils/llmr_py_runs/{mode_for_logging}/attachments.md"
-    attachments, plain_text_from_links = get_attachments(attachments_file, model_name)
+    if runner.profile is not None: # Timed on its own here; otherwise it happens inside the first phase that needs it
+        with runner.profile.phase("import llm"):
+            import llm # noqa: F401 -- imported here only to time it; later imports reuse the loaded module
+    http_cache = HttpCache(runner.base_folder / ".http_cache", ttl_seconds=http_cache_ttl) if use_http_cache else None
+    attachment_cache = None
+    conversion_pool = None
+    mime_cache = MimeTypeCache(runner.base_folder / MIME_CACHE_FILE_NAME)
+    try:
+        with profile_phase(runner.profile, "attachment resolution"):
+            if use_attachment_cache:
+                from attachment_cache import ATTACHMENT_CACHE_DIR_NAME, AttachmentCache
+                attachment_cache = AttachmentCache(runner.base_folder / ATTACHMENT_CACHE_DIR_NAME)
+            if use_conversion:
+                conversion_pool = ConversionPool(
+                    runner.base_folder / CONVERSION_CACHE_DIR_NAME,
+                    file_digest=(lambda path: attachment_cache.file_digest(path)[0]) if attachment_cache is not None else None,
+                )
+            attachments, plain_text_from_links = get_attachments(attachments_file, model_name, http_cache=http_cache, html_options=html_options,
+                                                                 attachment_cache=attachment_cache, mime_cache=mime_cache,
+                                                                 conversion_pool=conversion_pool)
+    finally:
+        if conversion_pool is not None:
+            conversion_pool.close()
+        if http_cache is not None:
+            http_cache.close()
+        if attachment_cache is not None:
+            attachment_cache.close()
+        mime_cache.close()
+
+    # Pre-flight token budget: estimate every section and drop low priority ones if the window overflows
+    reserved_output = run_kwargs.get("max_output_tokens") or run_kwargs.get("max_tokens")
+    if model_provider == "gemini":
+        reserved_output = reserved_output or GEMINI_MAX_OUTPUT_TOKENS
+    # A fan-out prompt has to fit the smallest context window among its models
+    plan_model_name = min(fanout_models, key=context_window_for) if fanout_models else model_name
+    token_cache = TokenCountCache(runner.base_folder / ".token_cache.sqlite")
+    try:
+        dedup = None
+        if use_dedup:
+            with profile_phase(runner.profile, "dedup"):
+                dedup = dedup_prompt(prompt_buffer, plain_text_from_links, attachments, token_cache, get_model_family(model_name))
+            if dedup.actions:
+                print(f"▶️"*16, dedup.report())
+                if prompt_buffer is not None:
+                    prompt_buffer.replace_sections(dedup.replacements)
+                    prompt_text = prompt_buffer.getvalue()
+                plain_text_from_links = dedup.websites
+                attachments = dedup.attachments
+        with profile_phase(runner.profile, "token planning"):
+            while True:
+                token_plan = plan_token_budget(
+                    plan_model_name, get_model_family(model_name), token_cache, prompt_buffer=prompt_buffer,
+                    prompt_text=None if prompt_buffer is not None else prompt_text,
+                    websites=plain_text_from_links, attachments=attachments, reserved_output=reserved_output,
+                )
+                if token_plan.fits() or dedup is None:
+                    break
+                token_plan.trim()
+                # A trimmed item may be the first copy a collapsed or dropped duplicate stood for: that copy comes back in full
+                restored = dedup.restore_references(prompt_buffer, [item.ref for item in token_plan.dropped_items])
+                if not restored:
+                    break
+                print("▶️"*16, f"dedup: restored {', '.join(restored)} in full (the copy it referred to was trimmed); planning again")
+                if prompt_buffer is not None:
+                    prompt_text = prompt_buffer.getvalue()
+                plain_text_from_links = dedup.websites
+                attachments = dedup.attachments
+    finally:
+        token_cache.close()
+    if dedup is not None and dedup.actions:
+        token_plan.notes.append(dedup.report())
+    if not token_plan.fits() or token_plan.dropped_items:
+        token_plan.trim()
+        for item in token_plan.dropped_items:
+            print(f"Warning: Dropping {item.kind} {item.label} (~{item.tokens:,} tokens) to fit the context window of {model_name}.")
+        if prompt_buffer is not None:
+            prompt_text = prompt_buffer.render(exclude=token_plan.dropped_refs("context_file"))
+        plain_text_from_links = token_plan.kept_refs("website")
+        attachments = token_plan.kept_refs("attachment")
+    if not token_plan.fits():
+        print(token_plan.report())
+        print(f"Error: The prompt needs ~{token_plan.total_tokens:,} tokens even after trimming, more than the {token_plan.budget:,} available for {model_name}. Aborting.", file=sys.stderr)
+        sys.exit(1)
+    run_kwargs["token_plan"] = token_plan
+    if prompt_buffer is not None and prompt_buffer.stable_prefix_end:
+        # <instructions> and <context> come before the task, so runs of the mode share this prefix (see prompt_cache.py)
+        stable_prefix_chars = len(prompt_buffer.stable_prefix(exclude=token_plan.dropped_refs("context_file")))
+        run_kwargs["stable_prefix_chars"] = stable_prefix_chars
+        print(f"▶️"*16, f"stable prompt prefix: ~{stable_prefix_chars // CHARS_PER_TOKEN:,} tokens (instructions and context, cacheable by the provider)")
+
     if plain_text_from_links:
-        print(f"▶️"*16, f"plain_text_from_links: {plain_text_from_links}")
-        prompt_text += f"\n\n # Plain Text Links\n\n {plain_text_from_links}"
+        print(f"▶️"*16, f"plain_text_from_links: {len(plain_text_from_links)} website(s) / converted file(s)")
+        prompt_text += "\n\n # Plain Text Links\n\n " + "\n\n".join(plain_text_from_links)
     if attachments:
         print(f"▶️"*16, f"attachments: {attachments}; ")
-    if attachments:
         run_kwargs["attachments"] = attachments
 
+    if fanout_models:
+        def fanout_kwargs_for_model(name):
+            family = get_model_family(name)
+            kwargs = {}
+            for k, v in fanout_args.items():
+                if (k in claude_only_args and family != "claude") or (k in gemini_only_args and family != "gemini") \
+                        or (k in openai_only_args and family != "openai"):
+                    continue
+                arg_spec = next((action for action in parser._actions if action.dest == k), None)
+                if isinstance(arg_spec, argparse._StoreTrueAction) or v is not None:
+                    kwargs[k] = v
+            if family == "gemini":
+                kwargs.setdefault("max_output_tokens", GEMINI_MAX_OUTPUT_TOKENS)
+            if attachments:
+                kwargs["attachments"] = filter_attachments_for_family(attachments, SUPPORTED_ATTACHMENT_TYPES.get(family, set()))
+            if "stable_prefix_chars" in run_kwargs:
+                kwargs["stable_prefix_chars"] = run_kwargs["stable_prefix_chars"]
+            return kwargs
+
+        try:
+            run_fanout(runner, fanout_models, prompt_text, mode_for_logging or runner.default_mode,
+                       LLMExecutionType.ASYNC_MODEL_STREAM, fanout_kwargs_for_model, token_plan=token_plan)
+        except BudgetExceeded as e:
+            print(f"Error: {e}", file=sys.stderr)
+            sys.exit(1)
+        except KeyboardInterrupt:
+            sys.exit(130) # Every model's partial answer was checkpointed by _execute_async
+        sys.exit(0)
+
     response = None
 
     try:
@@ -703,7 +1478,7 @@ if __name__ == "__main__":
                 execution_type=execution_type_enum,
                 prompt=prompt_text,
                 mode=mode_for_logging,
-                max_output_tokens=800000,
+                max_output_tokens=GEMINI_MAX_OUTPUT_TOKENS,
                 **run_kwargs
             )
         elif model_provider == "claude":
@@ -719,8 +1494,14 @@ if __name__ == "__main__":
             # This case should ideally not be reached if choices are enforced by argparse for model_provider
             print(f"Error: Unknown model_provider '{model_provider}'", file=sys.stderr)
             sys.exit(1)
+    except KeyboardInterrupt:
+        sys.exit(130) # The partial answer was checkpointed by _run_model
     except Exception as e:
         print(f"An error occurred during LLM execution: {e}", file=sys.stderr)
         import traceback
         traceback.print_exc() # For more detailed debugging
         sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
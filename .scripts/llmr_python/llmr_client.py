@@ -0,0 +1,120 @@
+"""
+Thin llmr client: hands its argv, terminal and environment to the llmr daemon (llmr_daemon.py) and
+exits with the job's exit code. Takes the same arguments as llm_runner.py.
+
+The daemon is started in the background when nothing listens on the socket yet. With
+LLMR_NO_DAEMON=1, or when the daemon can't be reached, llm_runner.py is run directly instead.
+LLMR_DAEMON_IDLE_TIMEOUT sets the idle timeout (seconds) of a daemon started from here.
+
+Only the standard library modules needed to talk to the socket are imported, so this starts in
+a few milliseconds.
+"""
+import json
+import os
+import signal
+import socket
+import sys
+import time
+from pathlib import Path
+
+LLM_RUNNER_PATH = Path(__file__).with_name("llm_runner.py")
+DAEMON_SOCKET_PATH = Path(os.environ.get("LLMR_DAEMON_SOCKET") or Path("~/utils/llmr_py_runs/.daemon.sock").expanduser())
+DAEMON_START_TIMEOUT_SECONDS = 30
+_FORWARDED_SIGNALS = (signal.SIGINT, signal.SIGHUP, signal.SIGTERM)
+
+
+def _connect():
+    conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        conn.connect(str(DAEMON_SOCKET_PATH))
+    except OSError:
+        conn.close()
+        return None
+    return conn
+
+
+def _start_daemon():
+    import subprocess
+
+    command = [sys.executable, str(LLM_RUNNER_PATH), "--daemon", "--daemon_socket", str(DAEMON_SOCKET_PATH)]
+    if os.environ.get("LLMR_DAEMON_IDLE_TIMEOUT"):
+        command += ["--daemon_idle_timeout", os.environ["LLMR_DAEMON_IDLE_TIMEOUT"]]
+    DAEMON_SOCKET_PATH.parent.mkdir(parents=True, exist_ok=True)
+    with open(DAEMON_SOCKET_PATH.with_suffix(".log"), "ab") as log:
+        subprocess.Popen(command, stdin=subprocess.DEVNULL, stdout=log, stderr=log, start_new_session=True)
+    deadline = time.monotonic() + DAEMON_START_TIMEOUT_SECONDS
+    while time.monotonic() < deadline:
+        conn = _connect()
+        if conn is not None:
+            return conn
+        time.sleep(0.05)
+    return None
+
+
+def _run_directly(argv):
+    os.execv(sys.executable, [sys.executable, str(LLM_RUNNER_PATH)] + argv)
+
+
+def _read_messages(conn):
+    buffer = b""
+    while True:
+        chunk = conn.recv(4096)
+        if not chunk:
+            return
+        buffer += chunk
+        while b"\n" in buffer:
+            line, buffer = buffer.split(b"\n", 1)
+            yield json.loads(line)
+
+
+def stop_daemon() -> int:
+    conn = _connect()
+    if conn is None:
+        print("No llmr daemon is running.")
+        return 0
+    with conn:
+        conn.sendall(json.dumps({"stop": True}).encode("utf-8") + b"\n")
+        conn.recv(4096)
+    print("llmr daemon stopped.")
+    return 0
+
+
+def main(argv) -> int:
+    if argv == ["--stop_daemon"]:
+        return stop_daemon()
+    if os.environ.get("LLMR_NO_DAEMON"):
+        _run_directly(argv)
+    conn = _connect() or _start_daemon()
+    if conn is None:
+        print("llmr daemon didn't start; running llm_runner.py directly.", file=sys.stderr)
+        _run_directly(argv)
+
+    job_pid = None
+    pending_signals = []
+    def _forward(signum, frame):
+        if job_pid is not None:
+            os.kill(job_pid, signum)
+        else:
+            pending_signals.append(signum)
+    for signum in _FORWARDED_SIGNALS:
+        signal.signal(signum, _forward)
+
+    request = json.dumps({"argv": argv, "cwd": os.getcwd(), "env": dict(os.environ)}).encode("utf-8") + b"\n"
+    with conn:
+        sent = socket.send_fds(conn, [request], [0, 1, 2])
+        conn.sendall(request[sent:])
+        for message in _read_messages(conn):
+            if "pid" in message:
+                job_pid = message["pid"]
+                for signum in pending_signals:
+                    os.kill(job_pid, signum)
+            if "error" in message:
+                print(f"llmr daemon: {message['error']}", file=sys.stderr)
+            if "exit" in message:
+                return message["exit"]
+    print("llmr daemon closed the connection without an exit status.", file=sys.stderr)
+    return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
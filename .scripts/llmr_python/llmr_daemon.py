@@ -0,0 +1,217 @@
+"""
+llmr daemon: a process with the modules pre-imported (llm_runner.py --daemon). `llm`, its provider
+plugins, tiktoken's encodings and the default models' instances are loaded once at start-up, so a
+keypress doesn't pay for Python start-up, plugin imports and model lookup again.
+
+Jobs are forked from it, so nothing a job creates outlives the job: HTTP connection pools and TLS
+sessions are opened per job as in a direct run, and models other than the warm ones are resolved in
+every job that uses them.
+
+Clients (llmr_client.py) connect to a Unix socket and send their argv, working directory and
+environment, passing their stdin/stdout/stderr file descriptors along (SCM_RIGHTS). Each job runs in a
+process forked from the warm daemon, with those descriptors as its own: output goes straight to the
+client's terminal, prompts like the similar-cache [Y/n] read from it, and a crash or Ctrl-C only ends
+that job. The client forwards SIGINT/SIGHUP/SIGTERM to the job's pid, so an interrupted answer is
+checkpointed exactly as in a direct run.
+
+Protocol (newline-delimited JSON):
+    client -> daemon   {"argv": [...], "cwd": "...", "env": {...}}  (+ fds 0, 1, 2)  or  {"stop": true}
+    daemon -> client   {"pid": N}, then {"exit": code} when the job ends
+
+The daemon exits after `idle_timeout` seconds without jobs (0 keeps it running).
+"""
+import atexit
+import json
+import os
+import select
+import signal
+import socket
+import struct
+import sys
+import time
+from pathlib import Path
+
+DAEMON_SOCKET_FILE_NAME = ".daemon.sock"
+# Models resolved at start-up (the ones llmr's g/o/c keys pick) and inherited by every job; others are resolved per job
+DEFAULT_WARM_MODELS = ("gemini-2.5-pro-preview-05-06", "openai/gpt-4.1", "claude-3.7-sonnet")
+_MAX_REQUEST_BYTES = 4 * 1024 * 1024
+
+
+def default_socket_path(base_folder="~/utils/llmr_py_runs") -> Path:
+    return Path(os.environ.get("LLMR_DAEMON_SOCKET") or Path(base_folder).expanduser() / DAEMON_SOCKET_FILE_NAME)
+
+
+def send_message(conn, message: dict):
+    conn.sendall(json.dumps(message).encode("utf-8") + b"\n")
+
+
+def _read_request(conn):
+    """(request dict, received fds) of the first line sent on `conn`."""
+    data, fds, _, _ = socket.recv_fds(conn, 64 * 1024, 3)
+    while not data.endswith(b"\n"):
+        if len(data) > _MAX_REQUEST_BYTES:
+            raise ValueError("request too large")
+        chunk = conn.recv(64 * 1024)
+        if not chunk:
+            raise ValueError("connection closed before the request was complete")
+        data += chunk
+    return json.loads(data), fds
+
+
+def _peer_uid(conn) -> int:
+    creds = conn.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize("3i"))
+    return struct.unpack("3i", creds)[1]
+
+
+def _warm_up(runner, model_names):
+    """Loads the plugins and resolves `model_names` (sync and async) into the runner's model cache."""
+    from token_budget import _load_tokenizer
+
+    for model_name in model_names:
+        for is_async in (False, True):
+            try:
+                runner._get_model_instance(model_name, is_async)
+            except Exception as err:
+                print(f"Didn't manage to resolve {model_name} (async={is_async}): {err}", file=sys.stderr)
+    _load_tokenizer() # tiktoken keeps its encodings, so every job's TokenCountCache starts warm
+
+
+def _run_job(listener, conn, request: dict, fds, runner, cli_main):
+    """Runs in the forked child: becomes the client's process and never returns."""
+    exit_code = 1
+    try:
+        listener.close()
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.default_int_handler)
+        for target_fd, client_fd in enumerate(fds):
+            os.dup2(client_fd, target_fd)
+            os.close(client_fd)
+        sys.stdin = open(0, "r", encoding="utf-8", errors="replace", closefd=False)
+        sys.stdout = open(1, "w", encoding="utf-8", errors="replace", buffering=1, closefd=False)
+        sys.stderr = open(2, "w", encoding="utf-8", errors="replace", buffering=1, closefd=False)
+        os.chdir(request.get("cwd") or os.path.expanduser("~"))
+        os.environ.clear()
+        os.environ.update(request.get("env") or {})
+        runner.load_api_keys()
+        send_message(conn, {"pid": os.getpid()})
+        sys.argv = ["llm_runner.py"] + list(request.get("argv") or [])
+        try:
+            cli_main(sys.argv[1:], runner=runner)
+            exit_code = 0
+        except SystemExit as exit_request:
+            code = exit_request.code
+            exit_code = code if isinstance(code, int) else (0 if code is None else 1)
+            if not isinstance(code, (int, type(None))):
+                print(code, file=sys.stderr)
+        except KeyboardInterrupt:
+            exit_code = 130
+        except BaseException:
+            import traceback
+            traceback.print_exc()
+    finally:
+        try:
+            atexit._run_exitfuncs() # The job ends like a process would (e.g. the --profile_startup report)
+        except Exception:
+            pass
+        try:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            send_message(conn, {"exit": exit_code})
+        except Exception:
+            pass
+        os._exit(exit_code)
+
+
+def _socket_in_use(socket_path: Path) -> bool:
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(str(socket_path))
+        return True
+    except OSError:
+        return False
+    finally:
+        probe.close()
+
+
+def run_daemon(cli_main, runner, socket_path=None, idle_timeout: float = 30 * 60, warm_models=DEFAULT_WARM_MODELS):
+    """
+    Serves jobs until idle or stopped. `cli_main(argv, runner=...)` is llm_runner.main and `runner` the
+    LLMRunner every job starts from (passed in so the running llm_runner module isn't imported twice).
+    """
+    socket_path = Path(socket_path).expanduser() if socket_path else default_socket_path(runner.base_folder)
+    socket_path.parent.mkdir(parents=True, exist_ok=True)
+    if socket_path.exists():
+        if _socket_in_use(socket_path):
+            print(f"An llmr daemon is already listening on {socket_path}", file=sys.stderr)
+            return
+        socket_path.unlink()
+
+    started = time.monotonic()
+    _warm_up(runner, warm_models)
+    print(f"llmr daemon warmed up in {time.monotonic() - started:.2f}s; listening on {socket_path}", flush=True)
+
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    previous_umask = os.umask(0o077) # Jobs run with the caller's API keys: the socket is for this user only
+    try:
+        listener.bind(str(socket_path))
+    finally:
+        os.umask(previous_umask)
+    listener.listen(16)
+
+    stopping = False
+    def _request_stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+    signal.signal(signal.SIGTERM, _request_stop)
+    signal.signal(signal.SIGHUP, _request_stop)
+
+    jobs = set()
+    last_activity = time.monotonic()
+    try:
+        while not stopping:
+            while jobs: # Reap finished jobs
+                pid, _ = os.waitpid(-1, os.WNOHANG)
+                if pid == 0:
+                    break
+                jobs.discard(pid)
+                last_activity = time.monotonic()
+            if not jobs and idle_timeout and time.monotonic() - last_activity > idle_timeout:
+                print("llmr daemon idle, exiting", flush=True)
+                break
+            try:
+                readable, _, _ = select.select([listener], [], [], 1.0)
+            except InterruptedError:
+                continue
+            if not readable:
+                continue
+            conn, _ = listener.accept()
+            fds = []
+            try:
+                if _peer_uid(conn) != os.getuid():
+                    continue
+                request, fds = _read_request(conn)
+                if request.get("stop"):
+                    send_message(conn, {"exit": 0})
+                    break
+                if len(fds) != 3:
+                    send_message(conn, {"error": "expected stdin, stdout and stderr descriptors", "exit": 2})
+                    continue
+                sys.stdout.flush()
+                sys.stderr.flush()
+                pid = os.fork()
+                if pid == 0:
+                    _run_job(listener, conn, request, fds, runner, cli_main)
+                jobs.add(pid)
+                last_activity = time.monotonic()
+            except (OSError, ValueError) as err:
+                print(f"Rejected a client request: {err}", file=sys.stderr, flush=True)
+            finally:
+                for fd in fds:
+                    os.close(fd)
+                conn.close()
+    finally:
+        listener.close()
+        try:
+            socket_path.unlink()
+        except FileNotFoundError:
+            pass
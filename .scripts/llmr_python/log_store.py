@@ -0,0 +1,223 @@
+"""
+Append-only, compressed store for run logs (replaces one markdown file per run in `<mode>/log/`).
+
+Each run is split into blocks (header, prompt, output); blocks are zlib-compressed and appended to a
+monthly segment file `segments/<YYYY-MM>.seg`, and a SQLite index maps block hashes to their
+(segment, offset, length). A block that is already stored (the same instructions or context file sent
+again) is only referenced, so a large context costs disk space once, not once per run.
+
+The prompt is cut into blocks at content-defined line boundaries, so editing one part of a prompt
+leaves the other blocks (and their hashes) unchanged.
+
+`last-log.md` and `output.md` stay plain files in the mode folder; they are just views of the newest
+run. `materialize(run_key)` rebuilds any older run's markdown by reading only its blocks.
+"""
+import fcntl
+import hashlib
+import json
+import re
+import sqlite3
+import time
+import zlib
+from datetime import datetime
+from pathlib import Path
+
+LOG_STORE_DIR_NAME = ".log_store"
+BLOCK_MIN_BYTES = 2 * 1024
+BLOCK_MAX_BYTES = 64 * 1024
+# A line whose hash has these low bits all zero ends a block: ~1 boundary every 32 lines
+BLOCK_BOUNDARY_MASK = 0x1F
+COMPRESSION_LEVEL = 6
+
+_LOG_FILE_NAME_RE = re.compile(r"^(\d{4}-\d{2}-\d{2}_\d{2}-\d{2}-\d{2})(?:\.(.+))?\.md$")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS blocks (
+    digest TEXT PRIMARY KEY,
+    segment TEXT NOT NULL,
+    offset INTEGER NOT NULL,
+    length INTEGER NOT NULL,
+    size INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    run_key TEXT UNIQUE NOT NULL,
+    mode TEXT NOT NULL,
+    variant TEXT,
+    model TEXT,
+    created_at REAL NOT NULL,
+    source TEXT NOT NULL,
+    header_blocks TEXT NOT NULL,
+    prompt_blocks TEXT NOT NULL,
+    output_blocks TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS runs_mode_created ON runs(mode, created_at);
+"""
+
+
+def split_blocks(text: str):
+    """Content-defined blocks of whole lines, BLOCK_MIN_BYTES..BLOCK_MAX_BYTES each (the last one may be smaller)."""
+    blocks = []
+    current = []
+    current_size = 0
+    for line in text.splitlines(keepends=True):
+        current.append(line)
+        current_size += len(line)
+        line_hash = zlib.crc32(line.encode("utf-8"))
+        if current_size >= BLOCK_MAX_BYTES or (current_size >= BLOCK_MIN_BYTES and line_hash & BLOCK_BOUNDARY_MASK == 0):
+            blocks.append("".join(current))
+            current = []
+            current_size = 0
+    if current:
+        blocks.append("".join(current))
+    return blocks
+
+
+def split_log_markdown(markdown: str):
+    """(header, prompt, output) of a log in the last-log.md layout."""
+    header, _, rest = markdown.partition("\n\n# Input:\n")
+    prompt_text, _, output_text = rest.partition("\n\n# Output:\n")
+    return header, prompt_text, output_text
+
+
+class LogStore:
+    def __init__(self, store_dir):
+        self.store_dir = Path(store_dir).expanduser()
+        self.segment_dir = self.store_dir / "segments"
+        self.segment_dir.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(str(self.store_dir / "index.sqlite"), timeout=30)
+        self._db.row_factory = sqlite3.Row
+        self._db.executescript(_SCHEMA)
+
+    def close(self):
+        self._db.close()
+
+    def _store_block(self, text: str, segment: str) -> str:
+        data = text.encode("utf-8")
+        digest = hashlib.sha256(data).hexdigest()
+        if self._db.execute("SELECT 1 FROM blocks WHERE digest = ?", (digest,)).fetchone():
+            return digest
+        compressed = zlib.compress(data, COMPRESSION_LEVEL)
+        with open(self.segment_dir / f"{segment}.seg", "ab") as f:
+            fcntl.flock(f, fcntl.LOCK_EX) # Several llmr processes (fan-out, batch, ...) may append at once
+            try:
+                f.seek(0, 2)
+                offset = f.tell()
+                f.write(compressed)
+                f.flush()
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+        self._db.execute(
+            "INSERT OR IGNORE INTO blocks (digest, segment, offset, length, size) VALUES (?, ?, ?, ?, ?)",
+            (digest, segment, offset, len(compressed), len(data)),
+        )
+        return digest
+
+    def _read_block(self, digest: str) -> str:
+        row = self._db.execute("SELECT segment, offset, length FROM blocks WHERE digest = ?", (digest,)).fetchone()
+        if row is None:
+            raise KeyError(f"Block {digest} is missing from the log index")
+        with open(self.segment_dir / f"{row['segment']}.seg", "rb") as f:
+            f.seek(row["offset"])
+            return zlib.decompress(f.read(row["length"])).decode("utf-8")
+
+    def _store_text(self, text: str, segment: str):
+        return [self._store_block(block, segment) for block in split_blocks(text)]
+
+    def append_run(self, mode: str, header: str, prompt_text: str, output_text: str, model: str = None,
+                   variant: str = None, created_at: float = None, source: str = "run") -> str:
+        """Stores one run and returns its key (unique even for runs started in the same second)."""
+        created_at = time.time() if created_at is None else created_at
+        created = datetime.fromtimestamp(created_at)
+        segment = created.strftime("%Y-%m")
+        header_blocks = self._store_text(header, segment)
+        prompt_blocks = self._store_text(prompt_text, segment)
+        output_blocks = self._store_text(output_text, segment)
+        run_key = created.strftime("%Y-%m-%d_%H-%M-%S-%f") + (f".{variant}" if variant else "")
+        suffix = 1
+        while self._db.execute("SELECT 1 FROM runs WHERE run_key = ?", (run_key,)).fetchone():
+            suffix += 1
+            run_key = f"{created.strftime('%Y-%m-%d_%H-%M-%S-%f')}-{suffix}" + (f".{variant}" if variant else "")
+        self._db.execute(
+            "INSERT INTO runs (run_key, mode, variant, model, created_at, source, header_blocks, prompt_blocks, output_blocks) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (run_key, mode, variant, model, created_at, source,
+             json.dumps(header_blocks), json.dumps(prompt_blocks), json.dumps(output_blocks)),
+        )
+        self._db.commit()
+        return run_key
+
+    def _run_parts(self, row):
+        return tuple(
+            "".join(self._read_block(digest) for digest in json.loads(row[column]))
+            for column in ("header_blocks", "prompt_blocks", "output_blocks")
+        )
+
+    def materialize(self, run_key: str) -> str:
+        """The run's log as markdown, in the same layout as last-log.md."""
+        row = self._db.execute("SELECT * FROM runs WHERE run_key = ?", (run_key,)).fetchone()
+        if row is None:
+            raise KeyError(f"No logged run '{run_key}'")
+        header, prompt_text, output_text = self._run_parts(row)
+        if row["source"] == "markdown": # Imported log file, kept verbatim in the header blocks
+            return header
+        return f"{header}\n\n# Input:\n{prompt_text}\n\n# Output:\n{output_text}"
+
+    def iter_runs_after(self, last_id: int):
+        """(id, run_key, mode, model, created_at, header, prompt, output) of every run stored after `last_id`."""
+        rows = self._db.execute("SELECT * FROM runs WHERE id > ? ORDER BY id", (last_id,)).fetchall()
+        for row in rows:
+            header, prompt_text, output_text = self._run_parts(row)
+            if row["source"] == "markdown":
+                header, prompt_text, output_text = split_log_markdown(header)
+            yield row["id"], row["run_key"], row["mode"], row["model"], row["created_at"], header, prompt_text, output_text
+
+    def list_runs(self, mode: str = None, limit: int = 20):
+        query = "SELECT run_key, mode, model, created_at, source FROM runs"
+        params = []
+        if mode:
+            query += " WHERE mode = ?"
+            params.append(mode)
+        query += " ORDER BY created_at DESC, id DESC LIMIT ?"
+        params.append(limit)
+        return self._db.execute(query, params).fetchall()
+
+    def stats(self) -> dict:
+        runs = self._db.execute("SELECT COUNT(*) FROM runs").fetchone()[0]
+        blocks, raw_size, stored_size = self._db.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0), COALESCE(SUM(length), 0) FROM blocks"
+        ).fetchone()
+        return {"runs": runs, "blocks": blocks, "raw_bytes": raw_size, "stored_bytes": stored_size}
+
+    def compact_markdown_logs(self, base_folder, mode: str = None, older_than_days: float = 0):
+        """
+        Moves the old per-run markdown files of `<mode>/log/` (every mode when None) into the monthly
+        segments, deleting each file once it is indexed. Returns the number of files rolled in.
+        """
+        base_folder = Path(base_folder).expanduser()
+        mode_folders = [base_folder / mode] if mode else sorted(p for p in base_folder.iterdir() if p.is_dir())
+        cutoff = time.time() - older_than_days * 86400
+        moved = 0
+        for mode_folder in mode_folders:
+            log_folder = mode_folder / "log"
+            if not log_folder.is_dir():
+                continue
+            for log_file in sorted(log_folder.glob("*.md")):
+                match = _LOG_FILE_NAME_RE.match(log_file.name)
+                if match:
+                    created_at = datetime.strptime(match.group(1), "%Y-%m-%d_%H-%M-%S").timestamp()
+                    variant = match.group(2)
+                else:
+                    created_at, variant = log_file.stat().st_mtime, None
+                if created_at > cutoff:
+                    continue
+                markdown = log_file.read_text(encoding="utf-8", errors="replace")
+                model_match = re.search(r"^\*\*Model\*\*: (.+)$", markdown, re.MULTILINE)
+                model = model_match.group(1) if model_match and model_match.group(1) != "<model-name-missing>" else None
+                self.append_run(mode_folder.name, markdown, "", "", model=model,
+                                variant=variant, created_at=created_at, source="markdown")
+                log_file.unlink()
+                moved += 1
+            if not any(log_folder.iterdir()):
+                log_folder.rmdir()
+        return moved
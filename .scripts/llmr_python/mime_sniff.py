@@ -0,0 +1,167 @@
+"""
+Magic-byte MIME detection, for when a server sends no Content-Type (or a file has no useful extension).
+
+Local files are typed from their first bytes too: the extension is only trusted for text files and
+formats without a signature here, so an extensionless PDF or a PNG saved as .jpg goes out with its
+real type. Results are cached in SQLite by inode and mtime, and files that aren't cached yet are
+read in parallel (a directory in attachments.md can hold hundreds of them).
+"""
+import concurrent.futures
+import os
+import sqlite3
+
+# (offset, signature, mime type). Checked in order, first match wins.
+_MAGIC_SIGNATURES = [
+    (0, b"%PDF-", "application/pdf"),
+    (0, b"\x89PNG\r\n\x1a\n", "image/png"),
+    (0, b"\xff\xd8\xff", "image/jpeg"),
+    (0, b"GIF87a", "image/gif"),
+    (0, b"GIF89a", "image/gif"),
+    (0, b"OggS", "application/ogg"),
+    (0, b"fLaC", "audio/flac"),
+    (0, b"ID3", "audio/mpeg"),
+    (0, b"\x1aE\xdf\xa3", "video/webm"),
+    (0, b"FLV", "video/x-flv"),
+    (0, b"PK\x03\x04", "application/zip"),
+]
+
+# RIFF and ISO-BMFF containers carry their real type a few bytes in.
+_RIFF_TYPES = {b"WEBP": "image/webp", b"WAVE": "audio/wav", b"AVI ": "video/avi"}
+_FTYP_BRANDS = {
+    b"qt  ": "video/quicktime",
+    b"3gp": "video/3gpp",
+    b"heic": "image/heic",
+    b"heix": "image/heic",
+    b"mif1": "image/heif",
+    b"M4A ": "audio/aac",
+}
+
+_HTML_MARKERS = (b"<!doctype html", b"<html", b"<head", b"<body")
+
+
+def sniff_mime_type(head: bytes):
+    """Returns the MIME type suggested by the first bytes of a payload, or None if nothing matches."""
+    if not head:
+        return None
+    for offset, signature, mime_type in _MAGIC_SIGNATURES:
+        if head.startswith(signature, offset):
+            return mime_type
+    if head[:4] == b"RIFF" and head[8:12] in _RIFF_TYPES:
+        return _RIFF_TYPES[head[8:12]]
+    if head[4:8] == b"ftyp":
+        brand = head[8:12]
+        for prefix, mime_type in _FTYP_BRANDS.items():
+            if brand.startswith(prefix):
+                return mime_type
+        return "video/mp4"
+    if len(head) >= 2 and head[0] == 0xFF and head[1] & 0xE0 == 0xE0:
+        return "audio/mpeg" # MPEG audio frame sync
+    text_head = head[:512].lstrip().lower()
+    if text_head.startswith(b"\xef\xbb\xbf"):
+        text_head = text_head[3:].lstrip()
+    if any(text_head.startswith(marker) for marker in _HTML_MARKERS):
+        return "text/html"
+    return None
+
+
+SNIFF_BYTES = 4096
+MIME_CACHE_FILE_NAME = ".mime_cache.sqlite"
+CLASSIFY_MAX_WORKERS = 8
+
+
+def _looks_like_text(head: bytes, truncated: bool) -> bool:
+    if b"\0" in head:
+        return False
+    try:
+        head.decode("utf-8")
+    except UnicodeDecodeError as err:
+        return truncated and err.start >= len(head) - 3 # A multi-byte character cut off at the end of the sample
+    return True
+
+
+def sniff_file_type(path: str):
+    """MIME type of a local file from its first bytes, falling back to its extension; None when unknown."""
+    import mimetypes
+
+    with open(path, "rb") as f:
+        head = f.read(SNIFF_BYTES)
+    sniffed = sniff_mime_type(head)
+    if sniffed is not None:
+        return sniffed
+    guessed = (mimetypes.guess_type(path)[0] or "").lower() or None
+    if head and _looks_like_text(head, truncated=len(head) == SNIFF_BYTES):
+        return guessed if guessed and guessed.startswith("text/") else "text/plain"
+    return guessed
+
+
+class MimeTypeCache:
+    """Sniffed types keyed by (device, inode), valid while size and mtime are unchanged."""
+
+    def __init__(self, db_path):
+        db_path = os.path.expanduser(db_path)
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self._db = sqlite3.connect(db_path, timeout=30)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS mime_types (device INTEGER, inode INTEGER, size INTEGER, mtime_ns INTEGER, "
+            "mime_type TEXT, PRIMARY KEY (device, inode))"
+        )
+
+    def commit(self):
+        self._db.commit()
+
+    def close(self):
+        self._db.commit()
+        self._db.close()
+
+    def lookup(self, stat):
+        """(found, mime type); the type itself can be None for a file that was classified as unknown."""
+        row = self._db.execute(
+            "SELECT mime_type FROM mime_types WHERE device = ? AND inode = ? AND size = ? AND mtime_ns = ?",
+            (stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns),
+        ).fetchone()
+        return (True, row[0]) if row is not None else (False, None)
+
+    def store(self, stat, mime_type):
+        self._db.execute(
+            "INSERT OR REPLACE INTO mime_types (device, inode, size, mtime_ns, mime_type) VALUES (?, ?, ?, ?, ?)",
+            (stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns, mime_type),
+        )
+
+
+def classify_files(paths, cache: MimeTypeCache = None, max_workers: int = CLASSIFY_MAX_WORKERS) -> dict:
+    """
+    {path: MIME type or None} for local files. Cache lookups happen on the calling thread; the files
+    that miss are sniffed on a thread pool.
+    """
+    types = {}
+    stats = {}
+    for path in paths:
+        try:
+            stats[path] = os.stat(path)
+        except OSError:
+            types[path] = None
+            continue
+        if cache is not None:
+            found, mime_type = cache.lookup(stats[path])
+            if found:
+                types[path] = mime_type
+    misses = [path for path in stats if path not in types]
+
+    def sniff(path):
+        try:
+            return sniff_file_type(path)
+        except OSError:
+            return None
+
+    if len(misses) > 1:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(misses)))) as executor:
+            sniffed = list(executor.map(sniff, misses))
+    else:
+        sniffed = [sniff(path) for path in misses]
+    for path, mime_type in zip(misses, sniffed):
+        types[path] = mime_type
+        if cache is not None:
+            cache.store(stats[path], mime_type)
+    if cache is not None and misses:
+        cache.commit()
+    return types
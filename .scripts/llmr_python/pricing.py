@@ -0,0 +1,145 @@
+"""
+Model pricing from pricing.json.
+
+The table is loaded once and compiled into a dict of prefixes; a model ID resolves to the entry of
+its longest matching prefix (so "gpt-4.1-mini-2025-04-14" gets gpt-4.1-mini, not gpt-4.1 or gpt-4) and
+the result is memoized, so a lookup is a dict hit after the first time. A prefix only matches at a
+boundary: the whole ID, or the prefix followed by a date/version ("-2025-04-14", "-20250219", "-001",
+"-latest"). "gpt-4.5-preview", "o1-preview" or "o3-pro" are other models, not gpt-4, o1 or o3. A model
+with no entry resolves to None: it is reported as unpriced rather than silently billed at some other
+model's rate.
+
+Usage is split into buckets (uncached input, cached input, cache writes, audio input, output,
+reasoning) from the token details each llm plugin reports, and every bucket has its own price.
+"""
+import functools
+import json
+import re
+from pathlib import Path
+
+PRICING_FILE = Path(__file__).with_name("pricing.json")
+TOKENS_PER_PRICE_UNIT = 1_000_000
+
+_MODEL_ID_PREFIXES_TO_STRIP = ("openai/", "models/", "anthropic/", "gemini/")
+# What may follow a priced prefix for the ID to still be that model: dated or numbered snapshots
+_SNAPSHOT_SUFFIX_RE = re.compile(r"(?:-\d+)*(?:-latest)?")
+# Buckets whose price falls back to another one when the table doesn't list it
+_PRICE_FALLBACKS = {"cached_input": "input", "cache_write": "input", "audio_input": "input", "reasoning": "output"}
+BUCKET_LABELS = {
+    "input": "input_tokens",
+    "cached_input": "cached_input_tokens",
+    "cache_write": "cache_write_tokens",
+    "audio_input": "audio_input_tokens",
+    "output": "output_tokens",
+    "reasoning": "reasoning_tokens",
+}
+
+
+def normalize_model_id(model_id: str) -> str:
+    name = model_id.lower()
+    for prefix in _MODEL_ID_PREFIXES_TO_STRIP:
+        if name.startswith(prefix):
+            name = name[len(prefix):]
+    return name
+
+
+class ModelPrice:
+    def __init__(self, prefix: str, entry: dict):
+        self.prefix = prefix
+        self._entry = entry
+        self.long_context = entry.get("long_context")
+
+    def price(self, bucket: str, prompt_tokens: int = 0) -> float:
+        """USD per 1M tokens of `bucket`, taking the long-context tier into account."""
+        tiers = [self._entry]
+        if self.long_context and prompt_tokens > self.long_context["threshold"]:
+            tiers.insert(0, self.long_context)
+        while True:
+            for tier in tiers:
+                if bucket in tier:
+                    return tier[bucket]
+            bucket = _PRICE_FALLBACKS[bucket]
+
+
+@functools.lru_cache(maxsize=1)
+def load_pricing_table(path: str = str(PRICING_FILE)):
+    with open(path, encoding="utf-8") as f:
+        data = json.load(f)
+    models = {prefix.lower(): ModelPrice(prefix.lower(), entry) for prefix, entry in data["models"].items()}
+    return data.get("version", "unversioned"), models
+
+
+@functools.lru_cache(maxsize=None)
+def price_for(model_id: str):
+    """The ModelPrice of the longest prefix matching `model_id` at a boundary, or None when the model is unpriced."""
+    _, models = load_pricing_table()
+    name = normalize_model_id(model_id)
+    for end in range(len(name), 0, -1):
+        price = models.get(name[:end])
+        if price is not None and _SNAPSHOT_SUFFIX_RE.fullmatch(name, end):
+            return price
+    return None
+
+
+def pricing_version() -> str:
+    return load_pricing_table()[0]
+
+
+def _detail(details: dict, *path):
+    value = details
+    for key in path:
+        if not isinstance(value, dict):
+            return 0
+        value = value.get(key)
+    return value or 0
+
+
+def usage_buckets(input_tokens: int, output_tokens: int, details: dict = None) -> dict:
+    """
+    Splits llm's (input, output, details) into priced buckets. The plugins report input/output
+    differently: OpenAI and Gemini include cached tokens in the input count, Anthropic lists cache
+    reads and writes separately; reasoning/thinking tokens are part of the output count for all three.
+    """
+    details = details or {}
+    input_tokens = input_tokens or 0
+    output_tokens = output_tokens or 0
+    buckets = dict.fromkeys(BUCKET_LABELS, 0)
+    if "cache_read_input_tokens" in details or "cache_creation_input_tokens" in details: # Anthropic
+        buckets["cached_input"] = _detail(details, "cache_read_input_tokens")
+        buckets["cache_write"] = _detail(details, "cache_creation_input_tokens")
+        buckets["input"] = input_tokens
+    else:
+        cached = _detail(details, "input_tokens_details", "cached_tokens") or _detail(details, "cachedContentTokenCount")
+        audio = _detail(details, "input_tokens_details", "audio_tokens")
+        for modality in details.get("promptTokensDetails") or []: # Gemini per-modality counts
+            if modality.get("modality") == "AUDIO":
+                audio += modality.get("tokenCount") or 0
+        buckets["cached_input"] = cached
+        buckets["audio_input"] = audio
+        buckets["input"] = max(input_tokens - cached - audio, 0)
+    reasoning = (_detail(details, "output_tokens_details", "reasoning_tokens") or _detail(details, "thoughtsTokenCount"))
+    buckets["reasoning"] = min(reasoning, output_tokens)
+    buckets["output"] = output_tokens - buckets["reasoning"]
+    return buckets
+
+
+class CostBreakdown:
+    def __init__(self, model_id: str, price: ModelPrice, buckets: dict):
+        self.model_id = model_id
+        self.priced = price is not None
+        self.matched_prefix = price.prefix if price is not None else None
+        self.buckets = buckets
+        self.costs = {}
+        if price is not None:
+            prompt_tokens = buckets["input"] + buckets["cached_input"] + buckets["cache_write"] + buckets["audio_input"]
+            for bucket, tokens in buckets.items():
+                self.costs[bucket] = tokens / TOKENS_PER_PRICE_UNIT * price.price(bucket, prompt_tokens)
+
+    @property
+    def total(self):
+        """Total USD, or None for an unpriced model."""
+        return sum(self.costs.values()) if self.priced else None
+
+
+def compute_cost(model_id: str, input_tokens: int, output_tokens: int, details: dict = None) -> CostBreakdown:
+    return CostBreakdown(model_id, price_for(model_id), usage_buckets(input_tokens, output_tokens, details))
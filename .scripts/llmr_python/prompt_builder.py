@@ -0,0 +1,226 @@
+"""
+Builds the llmr prompt (<instructions>, <context>, <task>) straight from the mode folder.
+
+This used to be done in the `llmr` bash script, which accumulated everything in a shell variable and
+piped it through `echo -e` (mangling backslashes in code). Here every file is memory-mapped and copied
+once into a single byte buffer, which is decoded once at the end. Context files use the same layout as
+`files-to-prompt`'s default output.
+
+The task comes last: instructions and context rarely change between runs of a mode, so everything
+before the task is a byte-identical prefix that providers can serve from their prompt cache (see
+prompt_cache.py).
+"""
+import fnmatch
+import mmap
+import os
+from pathlib import Path
+
+BINARY_SNIFF_BYTES = 8192
+
+
+class PromptSection:
+    """A span of the assembled prompt; offsets are byte offsets into the prompt's UTF-8 buffer."""
+    __slots__ = ("kind", "label", "start", "end")
+
+    def __init__(self, kind: str, label: str, start: int, end: int):
+        self.kind = kind # "instructions", "task" or "context_file"
+        self.label = label
+        self.start = start
+        self.end = end
+
+    @property
+    def size(self) -> int:
+        return self.end - self.start
+
+    def __repr__(self):
+        return f"<PromptSection {self.kind} {self.label!r} {self.size} bytes>"
+
+
+class PromptBuffer:
+    def __init__(self):
+        self._buffer = bytearray()
+        self.sections = []
+        self.stable_prefix_end = 0 # Byte offset where the part that changes from run to run (the task) starts
+
+    def write(self, text: str):
+        self._buffer += text.encode("utf-8")
+
+    def tell(self) -> int:
+        return len(self._buffer)
+
+    def rollback(self, position: int):
+        del self._buffer[position:]
+
+    def add_section(self, kind: str, label: str, start: int):
+        """Records everything written since `start` as one section."""
+        self.sections.append(PromptSection(kind, label, start, len(self._buffer)))
+
+    def write_file(self, path, strip_trailing_newlines: bool = False):
+        """Appends a file's bytes via mmap. Returns False (writing nothing) for binary files."""
+        with open(path, "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return True
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                if mapped.find(b"\0", 0, BINARY_SNIFF_BYTES) != -1:
+                    return False
+                end = len(mapped)
+                if strip_trailing_newlines:
+                    while end > 0 and mapped[end - 1] in (0x0A, 0x0D):
+                        end -= 1
+                self._buffer += mapped[:end] if end != len(mapped) else mapped
+        return True
+
+    def getvalue(self) -> str:
+        # Invalid UTF-8 is replaced rather than fatal, like a terminal would show it.
+        return self._buffer.decode("utf-8", errors="replace")
+
+    def section_bytes(self, section: PromptSection) -> bytes:
+        return bytes(self._buffer[section.start:section.end])
+
+    def render(self, exclude=(), end: int = None) -> str:
+        """Decodes the prompt, leaving out the given sections (used when trimming to fit a budget)."""
+        end = len(self._buffer) if end is None else end
+        if not exclude and end == len(self._buffer):
+            return self.getvalue()
+        parts = []
+        position = 0
+        for section in sorted(exclude, key=lambda s: s.start):
+            if section.start >= end:
+                break
+            parts.append(self._buffer[position:section.start])
+            position = section.end
+        parts.append(self._buffer[position:end])
+        return b"".join(parts).decode("utf-8", errors="replace")
+
+    def replace_sections(self, replacements: dict):
+        """
+        Rewrites spans of the prompt in place: `replacements` maps PromptSections (not necessarily ones
+        in self.sections) to their new text, "" removing them. The offsets after each span are shifted;
+        the replaced spans themselves are updated to cover their new text, so they can be rewritten again.
+        """
+        if not replacements:
+            return
+        spans = sorted(replacements.items(), key=lambda item: item[0].start)
+        shifts = [] # (start and end of the replaced span in the old buffer, total size change up to there)
+        buffer = bytearray()
+        position = 0
+        delta = 0
+        new_spans = {} # Replaced span -> (start, end) of its new text
+        for span, text in spans:
+            new_bytes = text.encode("utf-8")
+            buffer += self._buffer[position:span.start]
+            new_spans[span] = (len(buffer), len(buffer) + len(new_bytes))
+            buffer += new_bytes
+            position = span.end
+            delta += len(new_bytes) - span.size
+            shifts.append((span.start, span.end, delta))
+        buffer += self._buffer[position:]
+
+        def moved(offset, is_end=False):
+            shift = 0
+            for start, end, total in shifts:
+                # Text inserted where a section ends (an empty span put back) comes after it, not inside it
+                if end > offset or (is_end and start == end == offset):
+                    break
+                shift = total
+            return offset + shift
+
+        removed = {span for span, text in spans if not text}
+        self.sections = [section for section in self.sections if section not in removed]
+        for section in self.sections:
+            if section not in new_spans:
+                section.start, section.end = moved(section.start), moved(section.end, is_end=True)
+        for span, (start, end) in new_spans.items():
+            span.start, span.end = start, end
+        self.stable_prefix_end = moved(self.stable_prefix_end)
+        self._buffer = buffer
+
+    def stable_prefix(self, exclude=()) -> str:
+        """The start of `render(exclude)` that doesn't depend on the task."""
+        return self.render(exclude, end=self.stable_prefix_end)
+
+
+def _read_gitignore(directory: str):
+    try:
+        with open(os.path.join(directory, ".gitignore"), encoding="utf-8") as f:
+            return [line.strip() for line in f if line.strip() and not line.startswith("#")]
+    except OSError:
+        return []
+
+
+def _is_ignored(path: str, rules) -> bool:
+    name = os.path.basename(path)
+    for rule in rules:
+        if rule.endswith("/"):
+            if os.path.isdir(path) and fnmatch.fnmatch(name, rule.rstrip("/")):
+                return True
+        elif fnmatch.fnmatch(name, rule) or fnmatch.fnmatch(path, rule):
+            return True
+    return False
+
+
+def iter_context_files(paths):
+    """Expands files and directories the way files-to-prompt does: hidden entries and .gitignore'd ones are skipped."""
+    for path in paths:
+        path = os.path.expanduser(path)
+        if os.path.isfile(path):
+            yield path
+            continue
+        if not os.path.isdir(path):
+            print(f"Warning: Context path {path} does not exist. Skipping.")
+            continue
+        gitignore_rules = {}
+        for root, dirs, files in os.walk(path):
+            rules = gitignore_rules.get(os.path.dirname(root), []) + _read_gitignore(root)
+            gitignore_rules[root] = rules
+            dirs[:] = sorted(d for d in dirs if not d.startswith(".") and not _is_ignored(os.path.join(root, d), rules))
+            for name in sorted(files):
+                file_path = os.path.join(root, name)
+                if name.startswith(".") or _is_ignored(file_path, rules):
+                    continue
+                yield file_path
+
+
+def assemble_prompt(mode_folder, task_file: str = None, context_paths=()) -> PromptBuffer:
+    """
+    Assembles the prompt for a run of `mode_folder`. `task_file` overrides `<mode_folder>/task.md`
+    (the bash script writes text typed with 'i' to a temp file).
+    """
+    mode_folder = Path(mode_folder).expanduser()
+    mode_folder.mkdir(parents=True, exist_ok=True)
+    instructions_file = mode_folder / "instructions.md"
+    instructions_file.touch()
+    task_path = Path(task_file).expanduser() if task_file else mode_folder / "task.md"
+
+    prompt = PromptBuffer()
+    prompt.write("\n<instructions>\n")
+    start = prompt.tell()
+    prompt.write_file(instructions_file, strip_trailing_newlines=True)
+    prompt.add_section("instructions", "instructions.md", start)
+    prompt.write("\n</instructions>\n\n")
+
+    context_files = list(iter_context_files(context_paths))
+    if context_files:
+        prompt.write("<context>\n")
+        for file_path in context_files:
+            # The section spans the whole entry (path header included) so dropping it leaves no residue.
+            start = prompt.tell()
+            prompt.write(f"{file_path}\n---\n")
+            if not prompt.write_file(file_path):
+                prompt.rollback(start)
+                print(f"Warning: Skipping file {file_path} (binary content)")
+                continue
+            prompt.write("\n\n---\n")
+            prompt.add_section("context_file", file_path, start)
+        prompt.write("</context>\n\n")
+
+    prompt.stable_prefix_end = prompt.tell()
+    if task_path.is_file():
+        prompt.write("<task>\n")
+        start = prompt.tell()
+        prompt.write_file(task_path, strip_trailing_newlines=True)
+        prompt.add_section("task", task_path.name, start)
+        prompt.write("\n</task>\n\n")
+    else:
+        print(f"Warning: No task provided via input ('i') or found in {task_path}")
+    return prompt
@@ -0,0 +1,76 @@
+"""
+Provider-side prompt caching of the stable start of the prompt.
+
+assemble_prompt writes what rarely changes between runs of a mode first (<instructions>, then
+<context>) and the task last, so consecutive runs share a byte-identical prefix. What each provider
+does with it:
+
+- OpenAI caches prompt prefixes of 1024+ tokens by itself; a stable prefix is all it takes.
+- Gemini 2.5 models cache prefixes implicitly as well. Explicit cached content (the cachedContents
+  API) isn't exposed by llm-gemini, so nothing is marked.
+- Anthropic only caches up to explicit breakpoints. llm-anthropic's `cache` option puts one on the
+  last block of the user turn, which would include the task: the next run, with another task, would
+  miss. The prefix is sent as an llm fragment instead and the breakpoint moved to its end.
+
+Cached tokens come back in the usage details and are priced (and recorded in the ledger) by pricing.py.
+"""
+from html_text import CHARS_PER_TOKEN
+
+# Anthropic doesn't cache shorter prefixes (2048 for Haiku); below this the split isn't worth sending
+PROMPT_CACHE_MIN_TOKENS = 1024
+_EPHEMERAL = {"type": "ephemeral"}
+
+
+def supports_cache_option(model_instance) -> bool:
+    options = getattr(model_instance, "Options", None)
+    return "cache" in (getattr(options, "model_fields", None) or {})
+
+
+def split_stable_prefix(prompt_text: str, stable_prefix_chars: int):
+    """
+    (fragment, rest) such that llm's "\\n".join([fragment, rest]) is `prompt_text` again, or None when
+    the prefix is too short for the provider to cache.
+    """
+    if not stable_prefix_chars or stable_prefix_chars >= len(prompt_text):
+        return None
+    if stable_prefix_chars // CHARS_PER_TOKEN < PROMPT_CACHE_MIN_TOKENS:
+        return None
+    prefix, rest = prompt_text[:stable_prefix_chars], prompt_text[stable_prefix_chars:]
+    if not prefix.endswith("\n"):
+        return None
+    return prefix[:-1], rest
+
+
+def _move_breakpoint(messages, fragment: str):
+    user_turn = next((m for m in reversed(messages) if m["role"] == "user"), None)
+    if user_turn is None or not isinstance(user_turn.get("content"), list):
+        return
+    blocks = user_turn["content"]
+    prefix = fragment + "\n"
+    for index, block in enumerate(blocks):
+        if block.get("type") == "text" and block.get("text", "").startswith(prefix):
+            for other in blocks:
+                other.pop("cache_control", None)
+            rest = block["text"][len(prefix):]
+            blocks[index:index + 1] = [{"type": "text", "text": prefix, "cache_control": dict(_EPHEMERAL)}] + \
+                ([{"type": "text", "text": rest}] if rest else [])
+            return
+
+
+def place_prefix_breakpoint(model_instance):
+    """
+    Makes an llm-anthropic model put its cache breakpoint at the end of the prompt's first fragment
+    rather than at the end of the user turn. Only prompts sent with `cache` and fragments are changed.
+    """
+    if getattr(model_instance, "_prefix_breakpoint", False) or not hasattr(model_instance, "build_messages"):
+        return
+    build_messages = model_instance.build_messages
+
+    def build_messages_with_prefix_breakpoint(prompt, conversation, *args, **kwargs):
+        messages = build_messages(prompt, conversation, *args, **kwargs)
+        if getattr(prompt.options, "cache", None) and prompt.fragments:
+            _move_breakpoint(messages, str(prompt.fragments[0]))
+        return messages
+
+    model_instance.build_messages = build_messages_with_prefix_breakpoint
+    model_instance._prefix_breakpoint = True
@@ -0,0 +1,136 @@
+"""
+Exact-match response cache.
+
+Rerunning llmr with an unchanged prompt (same model, system prompt, prompt text, attachment contents
+and sampling options) returns the stored answer instead of paying for an identical request. Entries
+live in a SQLite file, expire after `ttl_seconds` and are evicted least-recently-used once the stored
+text goes over `max_bytes`.
+"""
+import hashlib
+import json
+import sqlite3
+import time
+from datetime import datetime
+from pathlib import Path
+
+RESPONSE_CACHE_MAX_BYTES = 64 * 1024 * 1024
+RESPONSE_CACHE_TTL_SECONDS = 7 * 24 * 3600
+
+# prompt() arguments that don't change the answer
+_NON_FINGERPRINT_ARGS = {"key"}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    fingerprint TEXT PRIMARY KEY,
+    model TEXT NOT NULL,
+    response_text TEXT NOT NULL,
+    response_id TEXT,
+    response_json TEXT,
+    input_tokens INTEGER,
+    output_tokens INTEGER,
+    size INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    last_access REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS responses_last_access ON responses(last_access);
+"""
+
+
+def _attachment_fingerprint(attachment) -> str:
+    # llm's own attachment id: sha256 of the content (or file), or of the URL for remote ones
+    return attachment.id()
+
+
+def request_fingerprint(model_name: str, prompt_args: dict) -> str:
+    """sha256 over everything that determines the answer: model, prompt, system, attachments and options."""
+    options = {}
+    for name, value in prompt_args.items():
+        if name in _NON_FINGERPRINT_ARGS or name == "attachments":
+            continue
+        options[name] = value
+    request = {
+        "model": model_name,
+        "options": options,
+        "attachments": [_attachment_fingerprint(a) for a in prompt_args.get("attachments") or []],
+    }
+    canonical = json.dumps(request, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class CachedResponse:
+    """Stands in for an llm.Response when the answer comes from the cache (see LLMRunner._save_logs)."""
+    cache_hit = True
+
+    def __init__(self, row, model):
+        self.similarity = None # Set when reused for a near-duplicate prompt (see similar_cache.py)
+        self.id = row["response_id"]
+        self.model = model
+        self.input_tokens = row["input_tokens"]
+        self.output_tokens = row["output_tokens"]
+        self.created_at = row["created_at"]
+        self._text = row["response_text"]
+        self._json = json.loads(row["response_json"]) if row["response_json"] else None
+
+    def text(self):
+        return self._text
+
+    def json(self):
+        return self._json
+
+    def cached_at(self) -> str:
+        return datetime.fromtimestamp(self.created_at).strftime("%Y-%m-%d %H:%M:%S")
+
+
+class ResponseCache:
+    def __init__(self, db_path, max_bytes: int = RESPONSE_CACHE_MAX_BYTES, ttl_seconds: float = RESPONSE_CACHE_TTL_SECONDS):
+        db_path = Path(db_path).expanduser()
+        db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._db = sqlite3.connect(str(db_path))
+        self._db.row_factory = sqlite3.Row
+        self._db.executescript(_SCHEMA)
+
+    def close(self):
+        self._db.close()
+
+    def lookup(self, fingerprint: str, model=None):
+        """Returns a CachedResponse (with `model` as its .model) or None; expired entries are removed."""
+        row = self._db.execute("SELECT * FROM responses WHERE fingerprint = ?", (fingerprint,)).fetchone()
+        if row is None:
+            return None
+        now = time.time()
+        if self.ttl_seconds is not None and now - row["created_at"] >= self.ttl_seconds:
+            self._db.execute("DELETE FROM responses WHERE fingerprint = ?", (fingerprint,))
+            self._db.commit()
+            return None
+        self._db.execute("UPDATE responses SET last_access = ? WHERE fingerprint = ?", (now, fingerprint))
+        self._db.commit()
+        return CachedResponse(row, model)
+
+    def store(self, fingerprint: str, model_name: str, response_text: str, llm_response_obj=None):
+        response_json = getattr(llm_response_obj, "response_json", None)
+        size = len(response_text.encode("utf-8"))
+        now = time.time()
+        self._db.execute(
+            "INSERT OR REPLACE INTO responses (fingerprint, model, response_text, response_id, response_json, "
+            "input_tokens, output_tokens, size, created_at, last_access) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (fingerprint, model_name, response_text, getattr(llm_response_obj, "id", None),
+             json.dumps(response_json, default=str) if response_json else None,
+             getattr(llm_response_obj, "input_tokens", None), getattr(llm_response_obj, "output_tokens", None),
+             size, now, now),
+        )
+        self._evict()
+        self._db.commit()
+
+    def _evict(self):
+        if self.ttl_seconds is not None:
+            self._db.execute("DELETE FROM responses WHERE created_at <= ?", (time.time() - self.ttl_seconds,))
+        total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for row in self._db.execute("SELECT fingerprint, size FROM responses ORDER BY last_access").fetchall():
+            self._db.execute("DELETE FROM responses WHERE fingerprint = ?", (row["fingerprint"],))
+            total -= row["size"]
+            if total <= self.max_bytes:
+                break
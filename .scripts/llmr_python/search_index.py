@@ -0,0 +1,195 @@
+"""
+Full-text search over llmr run history (SQLite FTS5).
+
+Runs are indexed as they are saved (LLMRunner._save_logs). Before each search the index catches up
+incrementally: runs appended to the log store since the last indexed store id, and markdown log files
+under `<mode>/log/` that are new or whose mtime/size changed since they were indexed (files that were
+deleted, e.g. rolled into the log store by --compact_logs, are dropped from the index).
+
+Hits are ranked with bm25, with the prompt weighted below the output and the model/mode columns.
+"""
+import os
+import re
+import sqlite3
+from datetime import datetime
+from pathlib import Path
+
+from log_store import split_log_markdown
+
+SEARCH_INDEX_FILE_NAME = ".search_index.sqlite"
+DEFAULT_SEARCH_LIMIT = 20
+# bm25 weights for (mode, model, prompt, output)
+_BM25_WEIGHTS = (2.0, 2.0, 0.5, 1.0)
+
+_PRICE_RE = re.compile(r"\(price: \$([0-9]+(?:\.[0-9]+)?)\)")
+# Header lines _save_logs writes for answers served from the response / similar-prompt cache
+_CACHE_HIT_MARKERS = ("**Response cache hit**", "**Similar-prompt cache hit**")
+_MODEL_RE = re.compile(r"^\*\*Model\*\*: (.+)$", re.MULTILINE)
+_LOG_FILE_TIMESTAMP_RE = re.compile(r"^(\d{4}-\d{2}-\d{2}_\d{2}-\d{2}-\d{2})")
+
+_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS run_text USING fts5(mode, model, prompt, output, tokenize = 'unicode61');
+CREATE TABLE IF NOT EXISTS run_meta (
+    rowid INTEGER PRIMARY KEY,
+    run_key TEXT UNIQUE NOT NULL,
+    mode TEXT,
+    model TEXT,
+    created_at REAL,
+    cost REAL
+);
+CREATE INDEX IF NOT EXISTS run_meta_mode ON run_meta(mode);
+CREATE TABLE IF NOT EXISTS indexed_files (
+    path TEXT PRIMARY KEY,
+    mtime REAL NOT NULL,
+    size INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS index_state (
+    key TEXT PRIMARY KEY,
+    value INTEGER
+);
+"""
+
+
+def cost_from_log_header(header: str):
+    """
+    Sum of the "(price: $x)" entries of a log header, or None when it has none. A cache hit lists the
+    original call's usage and prices but cost nothing, so it is 0 (counting it would bill that call twice).
+    """
+    prices = _PRICE_RE.findall(header)
+    if prices and any(marker in header for marker in _CACHE_HIT_MARKERS):
+        return 0.0
+    return sum(float(price) for price in prices) if prices else None
+
+
+class SearchHit:
+    __slots__ = ("run_key", "mode", "model", "created_at", "cost", "snippet")
+
+    def __init__(self, row):
+        self.run_key = row["run_key"]
+        self.mode = row["mode"]
+        self.model = row["model"]
+        self.created_at = row["created_at"]
+        self.cost = row["cost"]
+        self.snippet = row["snippet"]
+
+    def format(self) -> str:
+        created = datetime.fromtimestamp(self.created_at).strftime("%Y-%m-%d %H:%M") if self.created_at else "-"
+        cost = f"${self.cost:.4f}" if self.cost is not None else "-"
+        snippet = " ".join(self.snippet.split())
+        return f"{self.run_key}  {self.mode}  {self.model or '-'}  {created}  {cost}\n    {snippet}"
+
+
+class SearchIndex:
+    def __init__(self, db_path):
+        db_path = Path(db_path).expanduser()
+        db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(str(db_path), timeout=30)
+        self._db.row_factory = sqlite3.Row
+        self._db.executescript(_SCHEMA)
+
+    def close(self):
+        self._db.close()
+
+    def _has_run(self, run_key: str) -> bool:
+        return self._db.execute("SELECT 1 FROM run_meta WHERE run_key = ?", (run_key,)).fetchone() is not None
+
+    def _delete_run(self, run_key: str):
+        row = self._db.execute("SELECT rowid FROM run_meta WHERE run_key = ?", (run_key,)).fetchone()
+        if row is not None:
+            self._db.execute("DELETE FROM run_text WHERE rowid = ?", (row["rowid"],))
+            self._db.execute("DELETE FROM run_meta WHERE rowid = ?", (row["rowid"],))
+
+    def _insert_run(self, run_key: str, mode: str, model: str, created_at: float, cost, prompt_text: str, output_text: str):
+        cursor = self._db.execute(
+            "INSERT INTO run_meta (run_key, mode, model, created_at, cost) VALUES (?, ?, ?, ?, ?)",
+            (run_key, mode, model, created_at, cost),
+        )
+        self._db.execute(
+            "INSERT INTO run_text (rowid, mode, model, prompt, output) VALUES (?, ?, ?, ?, ?)",
+            (cursor.lastrowid, mode, model or "", prompt_text, output_text),
+        )
+
+    def add_run(self, run_key: str, mode: str, model: str, created_at: float, cost, prompt_text: str, output_text: str):
+        if self._has_run(run_key):
+            return
+        self._insert_run(run_key, mode, model, created_at, cost, prompt_text, output_text)
+        self._db.commit()
+
+    def _state(self, key: str, default: int = 0) -> int:
+        row = self._db.execute("SELECT value FROM index_state WHERE key = ?", (key,)).fetchone()
+        return row["value"] if row is not None else default
+
+    def _set_state(self, key: str, value: int):
+        self._db.execute("INSERT OR REPLACE INTO index_state (key, value) VALUES (?, ?)", (key, value))
+
+    def catch_up(self, base_folder, log_store=None) -> int:
+        """Indexes what was added since the last call. Returns the number of runs (re)indexed."""
+        indexed = 0
+        if log_store is not None and not self._state("cache_hit_costs_zeroed"):
+            # Cache hits indexed before cost_from_log_header priced them at 0 still carry the original call's cost
+            for _, run_key, _, _, _, header, _, _ in log_store.iter_runs_after(0):
+                if any(marker in header for marker in _CACHE_HIT_MARKERS):
+                    self._db.execute("UPDATE run_meta SET cost = 0 WHERE run_key = ?", (run_key,))
+            self._set_state("cache_hit_costs_zeroed", 1)
+        if log_store is not None:
+            last_id = self._state("log_store_last_id")
+            for run_id, run_key, mode, model, created_at, header, prompt_text, output_text in log_store.iter_runs_after(last_id):
+                if not self._has_run(run_key):
+                    self._insert_run(run_key, mode, model, created_at, cost_from_log_header(header), prompt_text, output_text)
+                    indexed += 1
+                last_id = run_id
+            self._set_state("log_store_last_id", last_id)
+        indexed += self._catch_up_markdown_files(Path(base_folder).expanduser())
+        self._db.commit()
+        return indexed
+
+    def _catch_up_markdown_files(self, base_folder: Path) -> int:
+        known = {row["path"]: (row["mtime"], row["size"]) for row in self._db.execute("SELECT * FROM indexed_files")}
+        seen = set()
+        indexed = 0
+        if base_folder.is_dir():
+            for mode_entry in os.scandir(base_folder):
+                log_folder = os.path.join(mode_entry.path, "log")
+                if not mode_entry.is_dir() or not os.path.isdir(log_folder):
+                    continue
+                for entry in os.scandir(log_folder):
+                    if not entry.name.endswith(".md") or not entry.is_file():
+                        continue
+                    stat = entry.stat()
+                    seen.add(entry.path)
+                    if known.get(entry.path) == (stat.st_mtime, stat.st_size):
+                        continue
+                    with open(entry.path, encoding="utf-8", errors="replace") as f:
+                        header, prompt_text, output_text = split_log_markdown(f.read())
+                    timestamp_match = _LOG_FILE_TIMESTAMP_RE.match(entry.name)
+                    created_at = (datetime.strptime(timestamp_match.group(1), "%Y-%m-%d_%H-%M-%S").timestamp()
+                                  if timestamp_match else stat.st_mtime)
+                    model_match = _MODEL_RE.search(header)
+                    model = model_match.group(1) if model_match and model_match.group(1) != "<model-name-missing>" else None
+                    self._delete_run(entry.path)
+                    self._insert_run(entry.path, mode_entry.name, model,
+                                     created_at, cost_from_log_header(header), prompt_text, output_text)
+                    self._db.execute("INSERT OR REPLACE INTO indexed_files (path, mtime, size) VALUES (?, ?, ?)",
+                                     (entry.path, stat.st_mtime, stat.st_size))
+                    indexed += 1
+        for path in set(known) - seen: # Deleted or rolled into the log store
+            self._delete_run(path)
+            self._db.execute("DELETE FROM indexed_files WHERE path = ?", (path,))
+        return indexed
+
+    def search(self, query: str, mode: str = None, limit: int = DEFAULT_SEARCH_LIMIT):
+        """Ranked hits for an FTS5 query; plain text that isn't valid FTS5 syntax is searched as quoted terms."""
+        sql = (
+            "SELECT m.run_key, m.mode, m.model, m.created_at, m.cost, "
+            "snippet(run_text, -1, '[', ']', ' … ', 16) AS snippet "
+            "FROM run_text JOIN run_meta m ON m.rowid = run_text.rowid "
+            "WHERE run_text MATCH ?" + (" AND m.mode = ?" if mode else "") +
+            f" ORDER BY bm25(run_text, {', '.join(str(w) for w in _BM25_WEIGHTS)}) LIMIT ?"
+        )
+        params = [query] + ([mode] if mode else []) + [limit]
+        try:
+            rows = self._db.execute(sql, params).fetchall()
+        except sqlite3.OperationalError:
+            params[0] = " ".join('"' + term.replace('"', '""') + '"' for term in query.split())
+            rows = self._db.execute(sql, params).fetchall()
+        return [SearchHit(row) for row in rows]
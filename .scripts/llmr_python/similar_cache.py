@@ -0,0 +1,141 @@
+"""
+Near-duplicate prompt lookup for the response cache.
+
+Each cached run also gets a 64-bit SimHash of its prompt (over word 3-gram shingles), so a rerun that
+only fixes a typo or reorders context files lands a few bits away from the original. Signatures are
+split into bands that are indexed in SQLite; by the pigeonhole principle two signatures within
+`MAX_INDEXED_DISTANCE` bits share at least one band exactly, so a lookup only reads the rows that
+collide on a band instead of scanning every stored run.
+
+Only runs with the same mode, model and non-prompt options (system prompt, attachments, sampling
+options) are compared.
+"""
+import hashlib
+import re
+import sqlite3
+import time
+from collections import Counter
+from pathlib import Path
+
+SIMHASH_BITS = 64
+SHINGLE_WORDS = 3
+# 6 bands -> any two signatures at most 5 bits apart share one band
+BAND_BITS = (11, 11, 11, 11, 10, 10)
+MAX_INDEXED_DISTANCE = len(BAND_BITS) - 1
+MIN_SIMILARITY = 1 - MAX_INDEXED_DISTANCE / SIMHASH_BITS
+DEFAULT_SIMILARITY_THRESHOLD = 0.95
+
+_WORD_RE = re.compile(r"\w+")
+
+_SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS prompt_signatures (
+    fingerprint TEXT PRIMARY KEY,
+    mode TEXT NOT NULL,
+    context_key TEXT NOT NULL,
+    simhash INTEGER NOT NULL,
+    {", ".join(f"band{i} INTEGER NOT NULL" for i in range(len(BAND_BITS)))},
+    created_at REAL NOT NULL
+);
+{"".join(f"CREATE INDEX IF NOT EXISTS prompt_signatures_band{i} ON prompt_signatures(context_key, band{i});" for i in range(len(BAND_BITS)))}
+"""
+
+
+def prompt_simhash(text: str) -> int:
+    """64-bit SimHash of `text`; shingles are weighted by how often they occur."""
+    words = _WORD_RE.findall(text.lower())
+    if len(words) < SHINGLE_WORDS:
+        shingles = [" ".join(words)]
+    else:
+        shingles = [" ".join(words[i:i + SHINGLE_WORDS]) for i in range(len(words) - SHINGLE_WORDS + 1)]
+    digests = b"".join(hashlib.blake2b(s.encode("utf-8"), digest_size=8).digest() for s in shingles)
+    total = len(shingles)
+    signature = 0
+    # Count set bits per position a byte column at a time: Counter over a bytes slice runs in C.
+    for byte_index in range(SIMHASH_BITS // 8):
+        byte_counts = Counter(digests[byte_index::8])
+        for bit in range(8):
+            mask = 1 << bit
+            set_count = sum(count for value, count in byte_counts.items() if value & mask)
+            if set_count * 2 > total:
+                signature |= 1 << (byte_index * 8 + bit)
+    return signature
+
+
+def _bands(signature: int):
+    bands = []
+    shift = 0
+    for width in BAND_BITS:
+        bands.append((signature >> shift) & ((1 << width) - 1))
+        shift += width
+    return bands
+
+
+def _to_sqlite_int(signature: int) -> int:
+    # SQLite integers are signed 64-bit
+    return signature - (1 << 64) if signature >= 1 << 63 else signature
+
+
+def _from_sqlite_int(value: int) -> int:
+    return value + (1 << 64) if value < 0 else value
+
+
+class SimilarMatch:
+    __slots__ = ("fingerprint", "similarity", "created_at")
+
+    def __init__(self, fingerprint: str, similarity: float, created_at: float):
+        self.fingerprint = fingerprint
+        self.similarity = similarity
+        self.created_at = created_at
+
+
+class SimilarPromptIndex:
+    def __init__(self, db_path):
+        db_path = Path(db_path).expanduser()
+        db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(str(db_path))
+        self._db.row_factory = sqlite3.Row
+        self._db.executescript(_SCHEMA)
+
+    def close(self):
+        self._db.close()
+
+    def add(self, fingerprint: str, mode: str, context_key: str, signature: int):
+        bands = _bands(signature)
+        self._db.execute(
+            f"INSERT OR REPLACE INTO prompt_signatures (fingerprint, mode, context_key, simhash, "
+            f"{', '.join(f'band{i}' for i in range(len(bands)))}, created_at) "
+            f"VALUES (?, ?, ?, ?, {', '.join('?' * len(bands))}, ?)",
+            (fingerprint, mode, context_key, _to_sqlite_int(signature), *bands, time.time()),
+        )
+        self._db.commit()
+
+    def remove(self, fingerprint: str):
+        self._db.execute("DELETE FROM prompt_signatures WHERE fingerprint = ?", (fingerprint,))
+        self._db.commit()
+
+    def lookup(self, mode: str, context_key: str, signature: int, threshold: float = DEFAULT_SIMILARITY_THRESHOLD,
+               exclude=()):
+        """
+        Returns the closest stored run at or above `threshold` similarity (1 - hamming distance / 64), or None.
+        Thresholds below MIN_SIMILARITY are clamped to it, since the band index can't find runs further apart.
+        """
+        max_distance = min(int((1 - max(threshold, MIN_SIMILARITY)) * SIMHASH_BITS + 1e-9), MAX_INDEXED_DISTANCE)
+        bands = _bands(signature)
+        # One indexed query per band (OR across bands defeats the index on some SQLite builds)
+        query = " UNION ".join(
+            f"SELECT fingerprint, simhash, created_at FROM prompt_signatures WHERE context_key = ? AND band{i} = ? AND mode = ?"
+            for i in range(len(bands))
+        )
+        params = []
+        for band in bands:
+            params += [context_key, band, mode]
+        best = None
+        for row in self._db.execute(query, params):
+            if row["fingerprint"] in exclude:
+                continue
+            distance = bin(_from_sqlite_int(row["simhash"]) ^ signature).count("1")
+            if distance > max_distance:
+                continue
+            if best is None or distance < best[0] or (distance == best[0] and row["created_at"] > best[1].created_at):
+                best = (distance, SimilarMatch(row["fingerprint"], 1 - distance / SIMHASH_BITS, row["created_at"]))
+        return best[1] if best else None
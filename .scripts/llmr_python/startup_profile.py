@@ -0,0 +1,72 @@
+"""
+--profile_startup: where the time goes between starting llmr and the answer being saved.
+
+Imports are timed at module level (llm_runner.py notes when its own imports start and end; `llm`
+and its plugins are timed where they are first imported), the run is split into phases
+(argument parsing, prompt assembly, attachment resolution, model lookup, ...) and "first byte" is
+the time until the first chunk of the answer arrived. The report goes to stderr when the process exits.
+For a per-module import breakdown, run with `python -X importtime`.
+"""
+import contextlib
+import os
+import time
+
+# Set by llm_runner.py around its module-level imports
+module_imports = {}
+
+
+def mark_module_imports(name: str, started: float, finished: float):
+    module_imports[name] = (started, finished, os.getpid())
+
+
+def _process_start_offset():
+    """Seconds between the process start (per /proc) and now, or None where that isn't available."""
+    try:
+        with open("/proc/self/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        started_ticks = int(fields[19]) # starttime, field 22 of /proc/<pid>/stat
+        return time.clock_gettime(time.CLOCK_BOOTTIME) - started_ticks / os.sysconf("SC_CLK_TCK")
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+
+class StartupProfile:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.process_age = _process_start_offset()
+        # name -> ("phase", seconds spent in it) or ("mark", seconds since main() started), in the order they happened
+        self.timings = {}
+
+    def add_phase(self, name: str, seconds: float):
+        _, spent = self.timings.get(name, ("phase", 0.0))
+        self.timings[name] = ("phase", spent + seconds)
+
+    @contextlib.contextmanager
+    def phase(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_phase(name, time.perf_counter() - started)
+
+    def mark_once(self, name: str):
+        if name not in self.timings:
+            self.timings[name] = ("mark", time.perf_counter() - self.started)
+
+    def report(self) -> str:
+        total = time.perf_counter() - self.started
+        lines = ["▶️" * 16 + " startup profile"]
+        if self.process_age is not None:
+            lines.append(f"  process start -> main(): ~{self.process_age:.3f}s (interpreter start-up and imports, /proc resolution 10ms)")
+        for name, (started, finished, pid) in module_imports.items():
+            note = "" if pid == os.getpid() else " (done once by the daemon, not by this job)"
+            lines.append(f"  imports {name}: {finished - started:.3f}s{note}")
+        for name, (kind, seconds) in self.timings.items():
+            lines.append(f"  {name}: {seconds:.3f}s" if kind == "phase" else f"  {name} at {seconds:.3f}s after main()")
+        lines.append(f"  main() total: {total:.3f}s")
+        return "\n".join(lines)
+
+
+def profile_phase(profile, name: str):
+    """`profile.phase(name)`, or a no-op context when not profiling."""
+    return profile.phase(name) if profile is not None else contextlib.nullcontext()
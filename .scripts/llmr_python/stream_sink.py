@@ -0,0 +1,131 @@
+"""
+Append-only sink for streamed answers.
+
+Chunks are written to output.md as they arrive (flushed every `flush_interval` seconds or
+`flush_bytes` bytes, whichever comes first), so an editor opened on output.md sees the answer grow
+instead of an empty file until the end. Nothing is kept in memory besides the pending buffer.
+
+Optionally the same bytes are broadcast over a Unix socket: `socat - UNIX-CONNECT:<path>` (or any
+client) first receives what was written so far, then every flush live.
+"""
+import os
+import socket
+import threading
+import time
+from pathlib import Path
+
+STREAM_FLUSH_INTERVAL_SECONDS = 0.2
+STREAM_FLUSH_BYTES = 8 * 1024
+SOCKET_SEND_TIMEOUT_SECONDS = 1.0
+
+
+class _SocketBroadcaster:
+    def __init__(self, socket_path, output_path, lock):
+        self.socket_path = str(Path(socket_path).expanduser())
+        self._output_path = output_path
+        self._lock = lock # Shared with the sink: a new client's backlog and the live flushes never overlap
+        self._clients = []
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path) # Left over from a run that was killed
+        self._server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._server.bind(self.socket_path)
+        self._server.listen()
+        threading.Thread(target=self._accept_loop, daemon=True).start()
+
+    def _accept_loop(self):
+        while True:
+            try:
+                client, _ = self._server.accept()
+            except OSError:
+                return # Server socket closed
+            client.settimeout(SOCKET_SEND_TIMEOUT_SECONDS)
+            with self._lock:
+                try:
+                    with open(self._output_path, "rb") as f:
+                        client.sendfile(f)
+                except OSError:
+                    client.close()
+                    continue
+                self._clients.append(client)
+
+    def send(self, data: bytes):
+        """Called with the sink's lock held. Clients that are gone or too slow are dropped."""
+        for client in list(self._clients):
+            try:
+                client.sendall(data)
+            except OSError:
+                client.close()
+                self._clients.remove(client)
+
+    def close(self):
+        self._server.close()
+        with self._lock:
+            for client in self._clients:
+                try:
+                    client.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+                client.close()
+            self._clients = []
+        try:
+            os.unlink(self.socket_path)
+        except FileNotFoundError:
+            pass
+
+
+class StreamSink:
+    def __init__(self, path, socket_path=None, flush_interval: float = STREAM_FLUSH_INTERVAL_SECONDS,
+                 flush_bytes: int = STREAM_FLUSH_BYTES, on_flush=None):
+        self.on_flush = on_flush # Called with every flushed block (checkpointing, see checkpoint.py)
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.flush_interval = flush_interval
+        self.flush_bytes = flush_bytes
+        self.bytes_written = 0
+        self._file = open(self.path, "wb")
+        self._pending = []
+        self._pending_bytes = 0
+        self._last_flush = time.monotonic()
+        self._lock = threading.Lock()
+        self._broadcaster = _SocketBroadcaster(socket_path, self.path, self._lock) if socket_path else None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def write(self, chunk: str):
+        data = chunk.encode("utf-8")
+        self._pending.append(data)
+        self._pending_bytes += len(data)
+        if self._pending_bytes >= self.flush_bytes or time.monotonic() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        if not self._pending:
+            return
+        data = b"".join(self._pending)
+        self._pending = []
+        self._pending_bytes = 0
+        with self._lock:
+            self._file.write(data)
+            self._file.flush()
+            if self._broadcaster is not None:
+                self._broadcaster.send(data)
+        if self.on_flush is not None:
+            self.on_flush(data)
+        self.bytes_written += len(data)
+        self._last_flush = time.monotonic()
+
+    def close(self):
+        if self._file.closed:
+            return
+        self.flush()
+        self._file.close()
+        if self._broadcaster is not None:
+            self._broadcaster.close()
+
+    def getvalue(self) -> str:
+        """The whole streamed text, read back once from disk."""
+        return self.path.read_text(encoding="utf-8")
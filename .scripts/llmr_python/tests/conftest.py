@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# The llmr modules import each other as top-level modules (llm_runner.py is run as a script)
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
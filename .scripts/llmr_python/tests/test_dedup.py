@@ -0,0 +1,84 @@
+import llm
+import pytest
+
+from dedup import dedup_prompt
+from prompt_builder import assemble_prompt
+from token_budget import TokenCountCache
+
+CONTENT = "".join(f"def function_{i}():\n    return {i}\n\n" for i in range(40))
+
+
+def _website(url, text):
+    return "\n".join(["<website-plain-text-content>", "<url>", url, "</url>", "<content>", text, "</content>",
+                      "</website-plain-text-content>"])
+
+
+@pytest.fixture
+def token_cache(tmp_path):
+    cache = TokenCountCache(tmp_path / "tokens.sqlite")
+    yield cache
+    cache.close()
+
+
+@pytest.fixture
+def files(tmp_path):
+    (tmp_path / "mode").mkdir()
+    (tmp_path / "a.py").write_text(CONTENT)
+    (tmp_path / "copy_of_a.py").write_text(CONTENT)
+    (tmp_path / "other.py").write_text("x = 1\n" * 100)
+    return tmp_path
+
+
+def _context(prompt_buffer, name):
+    return next(section for section in prompt_buffer.sections if section.kind == "context_file" and section.label.endswith(name))
+
+
+def test_identical_context_file_collapses_into_a_reference(files, token_cache):
+    prompt_buffer = assemble_prompt(files / "mode", context_paths=[str(files / "a.py"), str(files / "copy_of_a.py")])
+    original = prompt_buffer.getvalue()
+    result = dedup_prompt(prompt_buffer, [], [], token_cache, "claude")
+    assert [action[1] for action in result.actions] == [str(files / "copy_of_a.py")]
+    assert result.tokens_saved > 0
+    prompt_buffer.replace_sections(result.replacements)
+    text = prompt_buffer.getvalue()
+    assert text.count(CONTENT.strip()) == 1
+    assert f"(identical to {files / 'a.py'})" in text
+
+    restored = result.restore_references(prompt_buffer, [_context(prompt_buffer, "/a.py")])
+    assert restored == [str(files / "copy_of_a.py")]
+    assert prompt_buffer.getvalue() == original
+    assert result.actions == []
+
+
+def test_restore_ignores_unrelated_drops(files, token_cache):
+    prompt_buffer = assemble_prompt(files / "mode", context_paths=[str(files / "a.py"), str(files / "copy_of_a.py"), str(files / "other.py")])
+    result = dedup_prompt(prompt_buffer, [], [], token_cache, "claude")
+    prompt_buffer.replace_sections(result.replacements)
+    assert result.restore_references(prompt_buffer, [_context(prompt_buffer, "other.py")]) == []
+    assert len(result.actions) == 1
+
+
+def test_dropped_attachment_and_website_come_back_with_their_first_copy(files, token_cache):
+    prompt_buffer = assemble_prompt(files / "mode", context_paths=[str(files / "a.py")])
+    attachment = llm.Attachment(type="text/plain", path=str(files / "copy_of_a.py"))
+    website = _website("https://example.com/a.py", CONTENT)
+    result = dedup_prompt(prompt_buffer, [website], [attachment], token_cache, "claude")
+    assert result.attachments == []
+    assert result.websites == []
+    assert {action[0] for action in result.actions} == {"attachment", "website"}
+
+    restored = result.restore_references(prompt_buffer, [_context(prompt_buffer, "/a.py")])
+    assert sorted(restored) == sorted([str(files / "copy_of_a.py"), "https://example.com/a.py"])
+    assert result.attachments == [attachment]
+    assert result.websites == [website]
+    assert result.actions == []
+
+
+def test_website_listed_twice_is_dropped(files, token_cache):
+    first = _website("https://example.com/", "page text " * 50)
+    second = _website("https://example.com/", "page text " * 50)
+    result = dedup_prompt(None, [first, second], [], token_cache, "openai")
+    assert len(result.websites) == 1
+    assert result.actions[0][2] == "(listed twice, dropped)"
+    assert result.restore_references(None, [result.websites[0]]) == ["https://example.com/"]
+    assert len(result.websites) == 2
@@ -0,0 +1,54 @@
+import random
+
+from log_store import BLOCK_MAX_BYTES, BLOCK_MIN_BYTES, LogStore, split_blocks
+
+
+def _lines(count, seed=0):
+    rng = random.Random(seed)
+    return "".join(f"line {i} {rng.random():.12f}\n" for i in range(count))
+
+
+def test_split_blocks_round_trips_and_respects_sizes():
+    text = _lines(20000) + "no trailing newline"
+    blocks = split_blocks(text)
+    assert "".join(blocks) == text
+    assert len(blocks) > 1
+    assert all(len(block) <= BLOCK_MAX_BYTES + 64 for block in blocks)
+    assert all(len(block) >= BLOCK_MIN_BYTES for block in blocks[:-1])
+    assert all(block.endswith("\n") for block in blocks[:-1])
+
+
+def test_split_blocks_boundaries_survive_an_edit():
+    text = _lines(20000)
+    edited = "an extra first line\n" + text
+    unchanged = set(split_blocks(text)) & set(split_blocks(edited))
+    # Content-defined cuts: only the block holding the edit changes
+    assert len(unchanged) >= len(split_blocks(text)) - 2
+
+
+def test_split_blocks_of_empty_text():
+    assert split_blocks("") == []
+
+
+def test_materialize_rebuilds_the_run(tmp_path):
+    store = LogStore(tmp_path / "store")
+    try:
+        prompt_text = _lines(5000)
+        key = store.append_run("mode", "# header", prompt_text, "the answer", model="m", variant="v")
+        assert key.endswith(".v")
+        assert store.materialize(key) == f"# header\n\n# Input:\n{prompt_text}\n\n# Output:\nthe answer"
+    finally:
+        store.close()
+
+
+def test_repeated_prompt_blocks_are_stored_once(tmp_path):
+    store = LogStore(tmp_path / "store")
+    try:
+        prompt_text = _lines(5000)
+        store.append_run("mode", "# first", prompt_text, "one")
+        blocks_after_first = store.stats()["blocks"]
+        second = store.append_run("mode", "# second", prompt_text, "two")
+        assert store.stats()["blocks"] == blocks_after_first + 2 # Only the new header and output
+        assert store.materialize(second).endswith(f"{prompt_text}\n\n# Output:\ntwo")
+    finally:
+        store.close()
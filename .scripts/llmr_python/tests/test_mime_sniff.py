@@ -0,0 +1,52 @@
+import pytest
+
+from mime_sniff import sniff_file_type, sniff_mime_type
+
+
+@pytest.mark.parametrize("head, expected", [
+    (b"%PDF-1.7\n", "application/pdf"),
+    (b"\x89PNG\r\n\x1a\n\0\0\0\rIHDR", "image/png"),
+    (b"\xff\xd8\xff\xe0\0\x10JFIF", "image/jpeg"),
+    (b"GIF89a\x01\0", "image/gif"),
+    (b"PK\x03\x04\x14\0", "application/zip"),
+    (b"RIFF\x24\0\0\0WEBPVP8 ", "image/webp"),
+    (b"RIFF\x24\0\0\0WAVEfmt ", "audio/wav"),
+    (b"\0\0\0\x18ftypheic\0\0\0\0", "image/heic"),
+    (b"\0\0\0\x18ftypisom\0\0\0\0", "video/mp4"),
+    (b"\xff\xfb\x90\x64", "audio/mpeg"),
+    (b"ID3\x04\0", "audio/mpeg"),
+    (b"\xef\xbb\xbf  <!DOCTYPE html><html>", "text/html"),
+    (b"\n<HTML><body>", "text/html"),
+    (b"just some text", None),
+    (b"RIFF\x24\0\0\0XXXX", None),
+    (b"", None),
+])
+def test_sniff_mime_type(head, expected):
+    assert sniff_mime_type(head) == expected
+
+
+def test_signature_wins_over_the_extension(tmp_path):
+    path = tmp_path / "picture.jpg"
+    path.write_bytes(b"\x89PNG\r\n\x1a\n" + bytes(64))
+    assert sniff_file_type(str(path)) == "image/png"
+
+
+def test_extensionless_pdf(tmp_path):
+    path = tmp_path / "report"
+    path.write_bytes(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+    assert sniff_file_type(str(path)) == "application/pdf"
+
+
+def test_text_files_keep_their_text_type(tmp_path):
+    csv_path = tmp_path / "table.csv"
+    csv_path.write_text("a,b\n1,2\n")
+    assert sniff_file_type(str(csv_path)) == "text/csv"
+    unknown = tmp_path / "notes.unknownext"
+    unknown.write_text("plain words, héllo\n")
+    assert sniff_file_type(str(unknown)) == "text/plain"
+
+
+def test_binary_without_signature_falls_back_to_the_extension(tmp_path):
+    path = tmp_path / "blob.bin"
+    path.write_bytes(b"\0\x01\x02\x03" * 16)
+    assert sniff_file_type(str(path)) == "application/octet-stream"
@@ -0,0 +1,64 @@
+import pytest
+
+from pricing import TOKENS_PER_PRICE_UNIT, compute_cost, load_pricing_table, price_for, usage_buckets
+
+
+def _entry(prefix):
+    return load_pricing_table()[1][prefix]
+
+
+@pytest.mark.parametrize("model_id, prefix", [
+    ("gpt-4.1", "gpt-4.1"),
+    ("openai/gpt-4.1-mini-2025-04-14", "gpt-4.1-mini"),
+    ("gpt-4o-2024-08-06", "gpt-4o"),
+    ("claude-3-7-sonnet-20250219", "claude-3-7-sonnet"),
+    ("claude-3-7-sonnet-latest", "claude-3-7-sonnet"),
+    ("gemini/gemini-2.5-pro-preview-05-06", "gemini-2.5-pro-preview"),
+    ("gemini-1.5-flash-001", "gemini-1.5-flash"),
+    ("o3-pro", "o3-pro"),
+])
+def test_longest_prefix_at_a_boundary(model_id, prefix):
+    assert price_for(model_id).prefix == prefix
+
+
+@pytest.mark.parametrize("model_id", ["gpt-4.5-preview", "o1-previewish", "gpt-4.1-turbo", "totally-unknown"])
+def test_other_models_are_unpriced(model_id):
+    assert price_for(model_id) is None
+    cost = compute_cost(model_id, 1000, 1000)
+    assert not cost.priced
+    assert cost.total is None
+
+
+def test_openai_cached_and_reasoning_tokens():
+    details = {"input_tokens_details": {"cached_tokens": 400}, "output_tokens_details": {"reasoning_tokens": 150}}
+    buckets = usage_buckets(1000, 500, details)
+    assert buckets["input"] == 600
+    assert buckets["cached_input"] == 400
+    assert buckets["output"] == 350
+    assert buckets["reasoning"] == 150
+
+    price = _entry("gpt-4.1")
+    expected = (600 * price.price("input") + 400 * price.price("cached_input") + 500 * price.price("output")) / TOKENS_PER_PRICE_UNIT
+    assert compute_cost("gpt-4.1", 1000, 500, details).total == pytest.approx(expected)
+
+
+def test_anthropic_cache_reads_and_writes_are_separate_buckets():
+    details = {"cache_read_input_tokens": 2000, "cache_creation_input_tokens": 300}
+    buckets = usage_buckets(100, 50, details)
+    assert (buckets["input"], buckets["cached_input"], buckets["cache_write"]) == (100, 2000, 300)
+
+
+def test_gemini_long_context_tier():
+    price = _entry("gemini-2.5-pro")
+    threshold = price.long_context["threshold"]
+    short = compute_cost("gemini-2.5-pro", threshold, 0)
+    long = compute_cost("gemini-2.5-pro", threshold + 1, 0)
+    assert short.total == pytest.approx(threshold * price.price("input") / TOKENS_PER_PRICE_UNIT)
+    assert long.total == pytest.approx((threshold + 1) * price.long_context["input"] / TOKENS_PER_PRICE_UNIT)
+    assert price.long_context["input"] > price.price("input")
+
+
+def test_missing_bucket_prices_fall_back():
+    price = _entry("gpt-4.1")
+    assert price.price("audio_input") == price.price("input")
+    assert price.price("reasoning") == price.price("output")
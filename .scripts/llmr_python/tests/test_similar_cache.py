@@ -0,0 +1,74 @@
+import random
+
+import pytest
+
+from similar_cache import MAX_INDEXED_DISTANCE, MIN_SIMILARITY, SIMHASH_BITS, SimilarPromptIndex, prompt_simhash
+
+BASE_SIGNATURE = random.Random(7).getrandbits(SIMHASH_BITS)
+
+
+def _flip(signature, bits):
+    for bit in bits:
+        signature ^= 1 << bit
+    return signature
+
+
+@pytest.fixture
+def index(tmp_path):
+    index = SimilarPromptIndex(tmp_path / "similar.sqlite")
+    yield index
+    index.close()
+
+
+def test_simhash_is_stable_and_close_for_small_edits():
+    rng = random.Random(1)
+    words = [f"word{rng.randrange(5000)}" for _ in range(2000)]
+    text = " ".join(words)
+    edited = " ".join(words[:1000] + ["typo"] + words[1001:])
+    assert prompt_simhash(text) == prompt_simhash(text)
+    assert bin(prompt_simhash(text) ^ prompt_simhash(edited)).count("1") <= 3
+    unrelated = " ".join(f"other{rng.randrange(5000)}" for _ in range(2000))
+    assert bin(prompt_simhash(text) ^ prompt_simhash(unrelated)).count("1") > MAX_INDEXED_DISTANCE
+
+
+def test_simhash_fits_in_64_bits():
+    assert 0 <= prompt_simhash("a b c d e f") < 1 << SIMHASH_BITS
+    assert 0 <= prompt_simhash("") < 1 << SIMHASH_BITS
+
+
+@pytest.mark.parametrize("distance, threshold, found", [
+    (0, 1.0, True),
+    (1, 1.0, False),
+    (3, 0.95, True), # 1 - 3/64 = 0.953
+    (4, 0.95, False), # 1 - 4/64 = 0.9375
+    (5, 0.0, True), # Thresholds below MIN_SIMILARITY are clamped to it
+    (6, 0.0, False),
+])
+def test_lookup_threshold(index, distance, threshold, found):
+    # The flipped bits are spread over the bands, the hardest case for the band index
+    index.add("stored", "mode", "context", _flip(BASE_SIGNATURE, range(0, 11 * distance, 11)))
+    match = index.lookup("mode", "context", BASE_SIGNATURE, threshold)
+    assert (match is not None) == found
+    if found:
+        assert match.similarity == pytest.approx(1 - distance / SIMHASH_BITS)
+
+
+def test_min_similarity_matches_the_band_layout():
+    assert MIN_SIMILARITY == 1 - MAX_INDEXED_DISTANCE / SIMHASH_BITS
+
+
+def test_lookup_picks_the_closest_run_of_the_same_mode_and_context(index):
+    index.add("far", "mode", "context", _flip(BASE_SIGNATURE, [1, 20, 40]))
+    index.add("near", "mode", "context", _flip(BASE_SIGNATURE, [63]))
+    index.add("other-mode", "other", "context", BASE_SIGNATURE)
+    index.add("other-context", "mode", "other", BASE_SIGNATURE)
+    assert index.lookup("mode", "context", BASE_SIGNATURE, 0.9).fingerprint == "near"
+    assert index.lookup("mode", "context", BASE_SIGNATURE, 0.9, exclude={"near"}).fingerprint == "far"
+    index.remove("near")
+    assert index.lookup("mode", "context", BASE_SIGNATURE, 0.9).fingerprint == "far"
+
+
+def test_signatures_with_the_top_bit_set_round_trip(index):
+    signature = (1 << 63) | 12345
+    index.add("high", "mode", "context", signature)
+    assert index.lookup("mode", "context", signature, 1.0).similarity == 1.0
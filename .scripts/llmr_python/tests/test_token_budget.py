@@ -0,0 +1,45 @@
+from token_budget import BudgetItem, TokenPlan
+
+
+def _plan(budget, *items):
+    plan = TokenPlan("model", context_window=budget + 100, reserved_output=100, tokenizer_name="test")
+    plan.items = [BudgetItem(kind, label, tokens) for kind, label, tokens in items]
+    return plan
+
+
+def _dropped(plan):
+    return [item.label for item in plan.dropped_items]
+
+
+def test_trim_keeps_a_plan_that_fits():
+    plan = _plan(1000, ("task", "task.md", 500), ("context_file", "a.py", 400))
+    assert plan.trim()
+    assert _dropped(plan) == []
+
+
+def test_trim_drops_lowest_priority_first():
+    plan = _plan(1000, ("task", "task.md", 500), ("context_file", "a.py", 300), ("website", "https://x", 300))
+    assert plan.trim()
+    assert _dropped(plan) == ["https://x"]
+    assert plan.total_tokens == 800
+
+
+def test_trim_drops_the_largest_item_of_a_priority_first():
+    plan = _plan(1000, ("task", "task.md", 500), ("context_file", "small.py", 200), ("context_file", "big.py", 450))
+    assert plan.trim()
+    assert _dropped(plan) == ["big.py"]
+
+
+def test_trim_readmits_items_that_fit_after_later_drops():
+    # The website goes first, but the big context file has to go too; the website then fits again
+    plan = _plan(1000, ("task", "task.md", 500), ("context_file", "big.py", 600), ("website", "https://x", 100))
+    assert plan.trim()
+    assert _dropped(plan) == ["big.py"]
+    assert plan.total_tokens == 600
+
+
+def test_trim_never_drops_required_sections():
+    plan = _plan(1000, ("instructions", "instructions.md", 700), ("task", "task.md", 500), ("context_file", "a.py", 10))
+    assert not plan.trim()
+    assert _dropped(plan) == ["a.py"]
+    assert {item.kind for item in plan.items if not item.dropped} == {"instructions", "task"}
@@ -0,0 +1,55 @@
+import time
+
+import pytest
+
+from usage_ledger import BudgetExceeded, UsageLedger
+
+
+@pytest.fixture
+def ledger(tmp_path):
+    ledger = UsageLedger(tmp_path / "usage.sqlite")
+    yield ledger
+    ledger.close()
+
+
+def test_no_budget_never_raises(ledger):
+    ledger.record("openai", "gpt-4.1", "mode", 1000, 1000, cost=50.0)
+    ledger.check_budget("mode", 1000.0)
+
+
+def test_check_budget_counts_today_spend_of_the_mode_only(ledger):
+    ledger.set_budget("mode", 1.0)
+    ledger.record("openai", "gpt-4.1", "mode", 100, 100, cost=0.6)
+    ledger.record("openai", "gpt-4.1", "other", 100, 100, cost=5.0)
+    ledger.record("openai", "gpt-4.1", "mode", 100, 100, cost=5.0, created_at=time.time() - 2 * 86400)
+    ledger.check_budget("mode", 0.4) # Exactly at the budget is allowed
+    with pytest.raises(BudgetExceeded) as excinfo:
+        ledger.check_budget("mode", 0.41)
+    assert excinfo.value.spent == pytest.approx(0.6)
+    assert excinfo.value.estimate == pytest.approx(0.41)
+    assert "--set_budget mode" in str(excinfo.value)
+
+
+def test_unpriced_calls_and_estimates_count_as_free(ledger):
+    ledger.set_budget("mode", 1.0)
+    ledger.record("unknown", "some-model", "mode", 100, 100, cost=None)
+    ledger.check_budget("mode", None)
+
+
+def test_removing_a_budget(ledger):
+    ledger.set_budget("mode", 0.01)
+    ledger.record("openai", "gpt-4.1", "mode", 100, 100, cost=1.0)
+    with pytest.raises(BudgetExceeded):
+        ledger.check_budget("mode", 0.0)
+    ledger.set_budget("mode", 0)
+    assert ledger.budget("mode") is None
+    ledger.check_budget("mode", 100.0)
+
+
+def test_output_estimate_ignores_cache_hits_and_partial_runs(ledger):
+    ledger.record("openai", "gpt-4.1", "mode", 10, 100)
+    ledger.record("openai", "gpt-4.1", "mode", 10, 300)
+    ledger.record("openai", "gpt-4.1", "mode", 10, 9000, cache_hit=True, cost=0.0)
+    ledger.record("openai", "gpt-4.1", "mode", 10, 5, partial=True)
+    assert ledger.average_output_tokens("mode", "gpt-4.1") == 200
+    assert ledger.average_output_tokens("mode", "other-model") is None
@@ -0,0 +1,252 @@
+"""
+Pre-flight token budget planning.
+
+Before a request is sent, every part of the prompt (instructions, task, each context file, each website
+text, each attachment) gets a token estimate. The total is compared with the model's context window and,
+if it doesn't fit, the lowest priority / largest parts are dropped until it does.
+
+Text is counted with tiktoken when it is installed (close enough for every provider) and with a
+chars/4 estimate otherwise. Counts are cached in SQLite by content hash, so replanning an unchanged
+prompt doesn't tokenize anything.
+"""
+import hashlib
+import mmap
+import os
+import sqlite3
+from pathlib import Path
+
+from html_text import CHARS_PER_TOKEN
+
+DEFAULT_CONTEXT_WINDOW = 128_000
+DEFAULT_RESERVED_OUTPUT_TOKENS = 8_192
+MAX_RESERVED_OUTPUT_TOKENS = 65_536
+
+# Longest matching prefix wins (model IDs are lowercased, "openai/" is stripped).
+MODEL_CONTEXT_WINDOWS = {
+    "gemini-2.5": 1_048_576,
+    "gemini-2.0": 1_048_576,
+    "gemini-1.5-pro": 2_097_152,
+    "gemini-1.5-flash": 1_048_576,
+    "gemini": 1_048_576,
+    "gpt-4.1": 1_047_576,
+    "gpt-4o": 128_000,
+    "gpt-4-turbo": 128_000,
+    "gpt-3.5-turbo": 16_385,
+    "o1": 200_000,
+    "o3": 200_000,
+    "o4-mini": 200_000,
+    "claude": 200_000,
+}
+
+# Rough per-item costs for attachments, by model family.
+IMAGE_TOKENS = {"gemini": 258, "openai": 1_105, "claude": 1_600, "unknown": 1_600}
+PDF_PAGE_TOKENS = {"gemini": 258, "openai": 1_500, "claude": 2_000, "unknown": 2_000}
+AUDIO_TOKENS_PER_SECOND = 32
+VIDEO_TOKENS_PER_SECOND = 263
+AUDIO_BYTES_PER_SECOND = 16_000 # ~128 kbit/s
+VIDEO_BYTES_PER_SECOND = 250_000
+
+# Higher is kept longer. Instructions and the task are never dropped.
+PRIORITY_REQUIRED = 100
+SECTION_PRIORITIES = {
+    "instructions": PRIORITY_REQUIRED,
+    "task": PRIORITY_REQUIRED,
+    "prompt": PRIORITY_REQUIRED,
+    "context_file": 30,
+    "attachment": 20,
+    "website": 10,
+}
+
+
+def context_window_for(model_name: str) -> int:
+    name = model_name.lower()
+    if name.startswith("openai/"):
+        name = name[len("openai/"):]
+    if name.startswith("models/"):
+        name = name[len("models/"):]
+    best = None
+    for prefix in MODEL_CONTEXT_WINDOWS:
+        if name.startswith(prefix) and (best is None or len(prefix) > len(best)):
+            best = prefix
+    return MODEL_CONTEXT_WINDOWS[best] if best else DEFAULT_CONTEXT_WINDOW
+
+
+def _load_tokenizer():
+    """Returns (name, encode) using tiktoken when available, else the chars/4 estimate."""
+    try:
+        import tiktoken
+        encoding = tiktoken.get_encoding("o200k_base")
+        return "tiktoken-o200k_base", lambda text: len(encoding.encode(text, disallowed_special=()))
+    except Exception:
+        return "chars/4", lambda text: (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+class TokenCountCache:
+    """Token counts keyed by (sha256 of content, tokenizer)."""
+
+    def __init__(self, db_path):
+        Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(str(db_path))
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS token_counts (digest TEXT, tokenizer TEXT, tokens INTEGER, "
+            "PRIMARY KEY (digest, tokenizer))"
+        )
+        self.tokenizer_name, self._encode = _load_tokenizer()
+
+    def close(self):
+        self._db.commit()
+        self._db.close()
+
+    def count(self, data: bytes) -> int:
+        digest = hashlib.sha256(data).hexdigest()
+        row = self._db.execute(
+            "SELECT tokens FROM token_counts WHERE digest = ? AND tokenizer = ?", (digest, self.tokenizer_name)
+        ).fetchone()
+        if row is not None:
+            return row[0]
+        tokens = self._encode(data.decode("utf-8", errors="replace"))
+        self._db.execute(
+            "INSERT OR REPLACE INTO token_counts (digest, tokenizer, tokens) VALUES (?, ?, ?)",
+            (digest, self.tokenizer_name, tokens),
+        )
+        return tokens
+
+
+def _count_pdf_pages(path: str = None, content: bytes = None) -> int:
+    marker_count = 0
+    if content is not None:
+        marker_count = content.count(b"/Type /Page") + content.count(b"/Type/Page")
+        marker_count -= content.count(b"/Type /Pages") + content.count(b"/Type/Pages")
+    elif path is not None and os.path.getsize(path) > 0:
+        with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            for marker, sign in ((b"/Type /Page", 1), (b"/Type/Page", 1), (b"/Type /Pages", -1), (b"/Type/Pages", -1)):
+                position = mapped.find(marker)
+                while position != -1:
+                    marker_count += sign
+                    position = mapped.find(marker, position + 1)
+    return max(marker_count, 1)
+
+
+def estimate_attachment_tokens(attachment, model_family: str) -> int:
+    mime_type = (attachment.type or "").lower()
+    if not mime_type and attachment.path:
+        import mimetypes
+        mime_type = (mimetypes.guess_type(attachment.path)[0] or "").lower()
+    if attachment.content is not None:
+        size = len(attachment.content)
+    elif attachment.path:
+        size = os.path.getsize(attachment.path)
+    else:
+        size = None # URL attachment fetched by the plugin; size unknown
+    if mime_type.startswith("image/"):
+        return IMAGE_TOKENS.get(model_family, IMAGE_TOKENS["unknown"])
+    if mime_type == "application/pdf":
+        if size is None:
+            return PDF_PAGE_TOKENS.get(model_family, PDF_PAGE_TOKENS["unknown"]) * 10
+        pages = _count_pdf_pages(path=attachment.path if attachment.content is None else None, content=attachment.content)
+        return pages * PDF_PAGE_TOKENS.get(model_family, PDF_PAGE_TOKENS["unknown"])
+    if mime_type.startswith("audio/") or mime_type == "application/ogg":
+        return int((size or 0) / AUDIO_BYTES_PER_SECOND * AUDIO_TOKENS_PER_SECOND)
+    if mime_type.startswith("video/"):
+        return int((size or 0) / VIDEO_BYTES_PER_SECOND * VIDEO_TOKENS_PER_SECOND)
+    # text/plain, text/csv and anything else: treat as text
+    return ((size or 0) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+class BudgetItem:
+    __slots__ = ("kind", "label", "tokens", "priority", "ref", "dropped")
+
+    def __init__(self, kind: str, label: str, tokens: int, ref=None):
+        self.kind = kind
+        self.label = label
+        self.tokens = tokens
+        self.priority = SECTION_PRIORITIES.get(kind, 0)
+        self.ref = ref # PromptSection, website text or llm.Attachment
+        self.dropped = False
+
+
+class TokenPlan:
+    def __init__(self, model_name: str, context_window: int, reserved_output: int, tokenizer_name: str):
+        self.model_name = model_name
+        self.context_window = context_window
+        self.reserved_output = reserved_output
+        self.tokenizer_name = tokenizer_name
+        self.items = []
+        self.notes = [] # Extra report lines, e.g. what dedup.py removed before planning
+
+    @property
+    def budget(self) -> int:
+        return self.context_window - self.reserved_output
+
+    @property
+    def total_tokens(self) -> int:
+        return sum(item.tokens for item in self.items if not item.dropped)
+
+    @property
+    def dropped_items(self):
+        return [item for item in self.items if item.dropped]
+
+    def fits(self) -> bool:
+        return self.total_tokens <= self.budget
+
+    def trim(self):
+        """
+        Drops the lowest priority items (largest first within a priority) until the plan fits, then
+        re-admits dropped items, highest priority first, that fit in the room left by later drops.
+        """
+        candidates = sorted(
+            (item for item in self.items if not item.dropped and item.priority < PRIORITY_REQUIRED),
+            key=lambda item: (item.priority, -item.tokens),
+        )
+        for item in candidates:
+            if self.fits():
+                break
+            item.dropped = True
+        for item in sorted(self.dropped_items, key=lambda item: (-item.priority, item.tokens)):
+            if self.total_tokens + item.tokens <= self.budget:
+                item.dropped = False
+        return self.fits()
+
+    def kept_refs(self, kind: str):
+        return [item.ref for item in self.items if item.kind == kind and not item.dropped]
+
+    def dropped_refs(self, kind: str):
+        return [item.ref for item in self.items if item.kind == kind and item.dropped]
+
+    def report(self) -> str:
+        lines = [
+            f"token plan for {self.model_name} ({self.tokenizer_name}): "
+            f"{self.total_tokens:,} of {self.budget:,} input tokens "
+            f"({100 * self.total_tokens / self.budget:.1f}%; window {self.context_window:,}, "
+            f"{self.reserved_output:,} reserved for output)"
+        ]
+        for item in self.items:
+            status = "  [dropped]" if item.dropped else ""
+            lines.append(f"  - {item.kind}: {item.label} = {item.tokens:,}{status}")
+        if self.dropped_items:
+            dropped_tokens = sum(item.tokens for item in self.dropped_items)
+            lines.append(f"  dropped {len(self.dropped_items)} item(s), {dropped_tokens:,} tokens, to fit the window")
+        lines += self.notes
+        return "\n".join(lines)
+
+
+def plan_token_budget(model_name: str, model_family: str, token_cache: TokenCountCache, prompt_buffer=None,
+                      prompt_text: str = None, websites=(), attachments=(), reserved_output: int = None) -> TokenPlan:
+    """
+    Builds the plan. With a `prompt_buffer` (assembled prompt) every section is an item; for a raw
+    stdin prompt the whole `prompt_text` is a single required item.
+    """
+    reserved = min(reserved_output or DEFAULT_RESERVED_OUTPUT_TOKENS, MAX_RESERVED_OUTPUT_TOKENS)
+    plan = TokenPlan(model_name, context_window_for(model_name), reserved, token_cache.tokenizer_name)
+    if prompt_buffer is not None:
+        for section in prompt_buffer.sections:
+            plan.items.append(BudgetItem(section.kind, section.label, token_cache.count(prompt_buffer.section_bytes(section)), section))
+    elif prompt_text:
+        plan.items.append(BudgetItem("prompt", "stdin", token_cache.count(prompt_text.encode("utf-8"))))
+    for website_text in websites:
+        url = website_text.split("\n", 3)[2] if website_text.count("\n") >= 3 else "website"
+        plan.items.append(BudgetItem("website", url, token_cache.count(website_text.encode("utf-8")), website_text))
+    for attachment in attachments:
+        label = attachment.path or attachment.url or f"{attachment.type} ({len(attachment.content or b'')} bytes)"
+        plan.items.append(BudgetItem("attachment", label, estimate_attachment_tokens(attachment, model_family), attachment))
+    return plan
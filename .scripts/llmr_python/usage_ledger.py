@@ -0,0 +1,168 @@
+"""
+Usage ledger: one row per provider call (and per cache hit) in SQLite, so spend can be queried
+without parsing logs ("how much did coding mode cost this week": `--usage --usage_by mode --usage_days 7`).
+
+Rows carry the local day they were made on, and (day, mode) / (day, model) are indexed, so the daily
+totals that budgets are checked against are an index range scan.
+
+Budgets are daily USD limits per mode, stored in the same database (`--set_budget MODE USD`). Before
+a request is sent its cost is estimated from the token plan (input) and the mode's recent average
+answer length (output); a request that would take the day's spend over the budget is refused.
+"""
+import sqlite3
+import time
+from datetime import date, datetime, timedelta
+from pathlib import Path
+
+USAGE_LEDGER_FILE_NAME = ".usage_ledger.sqlite"
+# Answers averaged to estimate the output tokens of the next call of a mode/model
+OUTPUT_ESTIMATE_SAMPLE = 20
+USAGE_GROUPS = ("day", "mode", "model", "provider")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS calls (
+    id INTEGER PRIMARY KEY,
+    created_at REAL NOT NULL,
+    day TEXT NOT NULL,
+    provider TEXT,
+    model TEXT,
+    mode TEXT,
+    variant TEXT,
+    run_key TEXT,
+    input_tokens INTEGER NOT NULL DEFAULT 0,
+    output_tokens INTEGER NOT NULL DEFAULT 0,
+    cached_tokens INTEGER NOT NULL DEFAULT 0,
+    reasoning_tokens INTEGER NOT NULL DEFAULT 0,
+    cost REAL,
+    latency REAL,
+    cache_hit INTEGER NOT NULL DEFAULT 0,
+    partial INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS calls_day_mode ON calls(day, mode);
+CREATE INDEX IF NOT EXISTS calls_day_model ON calls(day, model);
+CREATE TABLE IF NOT EXISTS budgets (
+    mode TEXT PRIMARY KEY,
+    daily_usd REAL NOT NULL
+);
+"""
+
+
+class BudgetExceeded(Exception):
+    def __init__(self, mode: str, budget: float, spent: float, estimate: float):
+        self.mode = mode
+        self.budget = budget
+        self.spent = spent
+        self.estimate = estimate
+        super().__init__(
+            f"Daily budget of mode '{mode}' is ${budget:.2f}: ${spent:.4f} spent today and this request is "
+            f"estimated at ${estimate:.4f}. Raise it with --set_budget {mode} USD or pass --ignore_budget."
+        )
+
+
+class UsageLedger:
+    def __init__(self, db_path):
+        db_path = Path(db_path).expanduser()
+        db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(str(db_path), timeout=30)
+        self._db.row_factory = sqlite3.Row
+        self._db.executescript(_SCHEMA)
+        columns = {row["name"] for row in self._db.execute("PRAGMA table_info(calls)")}
+        if "partial" not in columns: # Ledgers created before partial runs were recorded
+            self._db.execute("ALTER TABLE calls ADD COLUMN partial INTEGER NOT NULL DEFAULT 0")
+            self._db.commit()
+
+    def close(self):
+        self._db.close()
+
+    def record(self, provider: str, model: str, mode: str, input_tokens: int, output_tokens: int, cached_tokens: int = 0,
+               reasoning_tokens: int = 0, cost: float = None, latency: float = None, cache_hit: bool = False,
+               variant: str = None, run_key: str = None, created_at: float = None, partial: bool = False):
+        """Returns the row id. `partial` marks a run cut short, whose tokens (and cost) are estimates."""
+        created_at = time.time() if created_at is None else created_at
+        cursor = self._db.execute(
+            "INSERT INTO calls (created_at, day, provider, model, mode, variant, run_key, input_tokens, output_tokens, "
+            "cached_tokens, reasoning_tokens, cost, latency, cache_hit, partial) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (created_at, datetime.fromtimestamp(created_at).strftime("%Y-%m-%d"), provider, model, mode, variant, run_key,
+             input_tokens or 0, output_tokens or 0, cached_tokens or 0, reasoning_tokens or 0, cost, latency, int(bool(cache_hit)), int(bool(partial))),
+        )
+        self._db.commit()
+        return cursor.lastrowid
+
+    def set_run_key(self, row_id: int, run_key: str):
+        """Links a row recorded before its run was logged to the run's log store key."""
+        self._db.execute("UPDATE calls SET run_key = ? WHERE id = ?", (run_key, row_id))
+        self._db.commit()
+
+    def spent(self, mode: str, day: str = None) -> float:
+        day = day or date.today().isoformat()
+        row = self._db.execute("SELECT COALESCE(SUM(cost), 0) FROM calls WHERE day = ? AND mode = ?", (day, mode)).fetchone()
+        return row[0]
+
+    def average_output_tokens(self, mode: str, model: str):
+        """Mean answer length of the last OUTPUT_ESTIMATE_SAMPLE billed calls, or None without history."""
+        row = self._db.execute(
+            "SELECT AVG(output_tokens), COUNT(*) FROM (SELECT output_tokens FROM calls "
+            "WHERE mode = ? AND model = ? AND cache_hit = 0 AND partial = 0 ORDER BY id DESC LIMIT ?)",
+            (mode, model, OUTPUT_ESTIMATE_SAMPLE),
+        ).fetchone()
+        return row[0] if row[1] else None
+
+    def set_budget(self, mode: str, daily_usd: float):
+        """A negative or zero amount removes the budget."""
+        if daily_usd is None or daily_usd <= 0:
+            self._db.execute("DELETE FROM budgets WHERE mode = ?", (mode,))
+        else:
+            self._db.execute("INSERT OR REPLACE INTO budgets (mode, daily_usd) VALUES (?, ?)", (mode, daily_usd))
+        self._db.commit()
+
+    def budget(self, mode: str):
+        row = self._db.execute("SELECT daily_usd FROM budgets WHERE mode = ?", (mode,)).fetchone()
+        return row["daily_usd"] if row is not None else None
+
+    def budgets(self):
+        return self._db.execute("SELECT mode, daily_usd FROM budgets ORDER BY mode").fetchall()
+
+    def check_budget(self, mode: str, estimated_cost: float):
+        """Raises BudgetExceeded when `estimated_cost` would take today's spend of `mode` over its budget."""
+        budget = self.budget(mode)
+        if budget is None:
+            return
+        spent = self.spent(mode)
+        if spent + (estimated_cost or 0) > budget:
+            raise BudgetExceeded(mode, budget, spent, estimated_cost or 0)
+
+    def summary(self, group_by=("day",), days: int = 7, mode: str = None):
+        """Totals per `group_by` columns (a subset of USAGE_GROUPS) over the last `days` days, newest first."""
+        for column in group_by:
+            if column not in USAGE_GROUPS:
+                raise ValueError(f"Can't group usage by '{column}'; choose from {', '.join(USAGE_GROUPS)}")
+        columns = ", ".join(group_by)
+        since = (date.today() - timedelta(days=max(days, 1) - 1)).isoformat()
+        query = (
+            f"SELECT {columns}, COUNT(*) AS calls, SUM(cache_hit) AS cache_hits, SUM(partial) AS partial, SUM(input_tokens) AS input_tokens, "
+            "SUM(output_tokens) AS output_tokens, SUM(cached_tokens) AS cached_tokens, "
+            "SUM(reasoning_tokens) AS reasoning_tokens, SUM(cost) AS cost, SUM(cost IS NULL) AS unpriced, "
+            "AVG(CASE WHEN cache_hit = 0 THEN latency END) AS latency "
+            "FROM calls WHERE day >= ?" + (" AND mode = ?" if mode else "") +
+            f" GROUP BY {columns} ORDER BY " + ", ".join(f"{column} DESC" if column == "day" else column for column in group_by)
+        )
+        return self._db.execute(query, [since] + ([mode] if mode else [])).fetchall()
+
+
+def format_usage_summary(rows, group_by) -> str:
+    if not rows:
+        return "No usage recorded."
+    lines = []
+    total = 0.0
+    for row in rows:
+        key = "  ".join(str(row[column] or "-") for column in group_by)
+        cost = row["cost"] or 0.0
+        total += cost
+        latency = f"{row['latency']:.1f}s" if row["latency"] is not None else "-"
+        lines.append(
+            f"{key}  calls {row['calls']} ({row['cache_hits']} cached" + (f", {row['partial']} partial" if row["partial"] else "") + f")  in {row['input_tokens']:,} "
+            f"(cached {row['cached_tokens']:,})  out {row['output_tokens']:,} (reasoning {row['reasoning_tokens']:,})  "
+            f"${cost:.4f}" + (f" +{row['unpriced']} unpriced" if row["unpriced"] else "") + f"  avg latency {latency}"
+        )
+    lines.append(f"Total: ${total:.4f}")
+    return "\n".join(lines)